@@ -0,0 +1,172 @@
+"""
+Допуск загрузок в памяти процесса: ограничение частоты по IP и кэш решений
+перед таблицей uploads в SQLite
+"""
+
+import ipaddress
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+
+from api.config import (
+    RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW_SECONDS,
+    ACCESS_CACHE_SIZE, ACCESS_CACHE_TTL_SECONDS, TRUSTED_PROXIES
+)
+from api.database import db
+
+class RateLimitError(PermissionError):
+    """Превышена частота запросов с IP"""
+
+class TrustedProxies:
+    """Адреса прокси, которым разрешено передавать IP клиента в X-Forwarded-For"""
+    
+    def __init__(self, specs: List[str]):
+        self.trust_all = "*" in specs
+        self.networks = []
+        for spec in specs:
+            if spec == "*":
+                continue
+            try:
+                self.networks.append(ipaddress.ip_network(spec, strict=False))
+            except ValueError:
+                print(f"TRUSTED_PROXIES: пропущен некорректный адрес {spec}")
+    
+    def is_trusted(self, ip: str) -> bool:
+        if self.trust_all:
+            return True
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(address in network for network in self.networks)
+    
+    def client_ip(self, peer_ip: str, forwarded_for: Optional[str]) -> str:
+        """
+        IP клиента с учетом X-Forwarded-For
+        
+        Заголовок читается только если запрос пришел от доверенного прокси,
+        и справа налево: берется последний адрес, добавленный не доверенным
+        узлом. Адреса левее может подставить сам клиент, чтобы обойти лимит по IP.
+        
+        Args:
+            peer_ip: Адрес TCP соединения
+            forwarded_for: Значение X-Forwarded-For или None
+        """
+        if not forwarded_for or not self.is_trusted(peer_ip):
+            return peer_ip
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not self.is_trusted(hop):
+                return hop
+        # Вся цепочка из доверенных адресов - самый левый и есть клиент
+        return hops[0] if hops else peer_ip
+
+class SlidingWindowLimiter:
+    """Ограничение числа запросов на ключ в скользящем окне"""
+    
+    def __init__(self, max_requests: int, window_seconds: float, max_keys: int = 100_000):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._hits: "OrderedDict[str, Deque[float]]" = OrderedDict()
+    
+    def allow(self, key: str) -> bool:
+        """
+        Учет запроса и проверка лимита
+        
+        Returns:
+            True если запрос укладывается в лимит
+        """
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque()
+                # Самые давно активные ключи вытесняются первыми
+                if len(self._hits) > self.max_keys:
+                    self._hits.popitem(last=False)
+            else:
+                self._hits.move_to_end(key)
+            
+            while hits and now - hits[0] >= self.window_seconds:
+                hits.popleft()
+            if len(hits) >= self.max_requests:
+                return False
+            hits.append(now)
+            return True
+
+class AccessCache:
+    """LRU кэш последнего файла каждого IP (зеркало таблицы uploads)"""
+    
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+    
+    def get(self, ip: str) -> Optional[str]:
+        """Хеш последнего файла IP, если запись есть и не устарела"""
+        with self._lock:
+            entry = self._entries.get(ip)
+            if entry is None:
+                return None
+            file_hash, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[ip]
+                return None
+            self._entries.move_to_end(ip)
+            return file_hash
+    
+    def put(self, ip: str, file_hash: str) -> None:
+        """Запись последнего файла IP"""
+        with self._lock:
+            self._entries[ip] = (file_hash, time.monotonic())
+            self._entries.move_to_end(ip)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+class AdmissionController:
+    """Проверка допуска загрузки до обращения к базе данных"""
+    
+    def __init__(self):
+        self.limiter = SlidingWindowLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW_SECONDS)
+        self.access_cache = AccessCache(ACCESS_CACHE_SIZE, ACCESS_CACHE_TTL_SECONDS)
+        self.proxies = TrustedProxies(TRUSTED_PROXIES)
+    
+    def check_rate(self, ip: str) -> None:
+        """
+        Проверка частоты запросов с IP
+        
+        Raises:
+            RateLimitError: Если лимит превышен
+        """
+        if not self.limiter.allow(ip):
+            raise RateLimitError("Забагато запитів. Спробуйте пізніше")
+    
+    def check_file_access(self, ip: str, file_hash: str, allow_retry: bool = False) -> None:
+        """
+        Правило "один файл на IP" с кэшем решений и сквозной записью в uploads
+        
+        Повторная загрузка того же файла отклоняется из кэша без обращения к базе;
+        все остальные случаи проходят через Database.check_ip_file_access.
+        
+        Raises:
+            PermissionError: Если доступ запрещен
+        """
+        if not allow_retry and self.access_cache.get(ip) == file_hash:
+            raise PermissionError("Этот файл уже был обработан с данного IP адреса")
+        
+        try:
+            db.check_ip_file_access(ip, file_hash, allow_retry)
+        except PermissionError:
+            # Отказ: в uploads для IP уже записан именно этот файл
+            self.access_cache.put(ip, file_hash)
+            raise
+        # Кэш пополняется только после успешной записи: ошибка базы не должна
+        # оставить в кэше загрузку, которой нет в uploads
+        self.access_cache.put(ip, file_hash)
+
+# Глобальный экземпляр контроля допуска
+admission = AdmissionController()
@@ -0,0 +1,189 @@
+"""
+Сводка по задаче, накапливаемая по мере расчета строк отчета:
+видимость по доменам и странам, гистограмма позиций и топ конкурентов
+"""
+
+import csv
+import heapq
+import io
+from collections import Counter
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from api.config import SUMMARY_TOP_COMPETITORS, SUMMARY_TOP_DOMAINS
+
+# Корзины лучшей позиции: (название, верхняя граница включительно; None - без границы)
+RANK_BUCKETS: Tuple[Tuple[str, Optional[int]], ...] = (("#1", 1), ("#2-3", 3), ("#4-5", 5), ("#6+", None))
+
+# Колонки листа сводки: одна таблица с разделом в первой колонке
+SUMMARY_COLUMNS = [
+    "Section", "Name", "Queries", "Visible", "Inclusion Rate %", "Avg AIV-Score",
+    "Avg Best Rank", "Mentions", "Share of Voice %",
+    *(name for name, _ in RANK_BUCKETS), "Not visible"
+]
+
+def _to_number(value: Any) -> Optional[float]:
+    """Число из значения отчета (в том числе прочитанного из CSV) или None"""
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if number != number else number  # NaN из pandas
+
+class _Counts:
+    """Накопители одной группы (домен, страна или вся задача)"""
+    
+    __slots__ = ("queries", "visible", "aiv_sum", "rank_sum", "mentions", "sources", "ranks")
+    
+    def __init__(self):
+        self.queries = 0
+        self.visible = 0
+        self.aiv_sum = 0.0
+        self.rank_sum = 0
+        self.mentions = 0
+        self.sources = 0
+        self.ranks = [0] * (len(RANK_BUCKETS) + 1)  # Последняя корзина - не виден
+    
+    def add(self, aiv: float, rank: Optional[int], mentions: int, sources: int) -> None:
+        self.queries += 1
+        self.aiv_sum += aiv
+        self.mentions += mentions
+        self.sources += sources
+        if rank is None:
+            self.ranks[-1] += 1
+            return
+        self.visible += 1
+        self.rank_sum += rank
+        for position, (_, upper) in enumerate(RANK_BUCKETS):
+            if upper is None or rank <= upper:
+                self.ranks[position] += 1
+                break
+    
+    def row(self, section: str, name: str) -> Dict[str, Any]:
+        """Строка листа сводки"""
+        return {
+            "Section": section,
+            "Name": name,
+            "Queries": self.queries,
+            "Visible": self.visible,
+            "Inclusion Rate %": round(100 * self.visible / self.queries, 1) if self.queries else 0.0,
+            "Avg AIV-Score": round(self.aiv_sum / self.queries, 1) if self.queries else 0.0,
+            "Avg Best Rank": round(self.rank_sum / self.visible, 2) if self.visible else "",
+            "Mentions": self.mentions,
+            "Share of Voice %": round(100 * self.mentions / self.sources, 1) if self.sources else 0.0,
+            **{name: count for (name, _), count in zip(RANK_BUCKETS, self.ranks)},
+            "Not visible": self.ranks[-1]
+        }
+
+class JobAggregator:
+    """
+    Однопроходная сводка по строкам отчета
+    
+    Каждая строка отчета сразу добавляется в накопители, поэтому память
+    зависит только от числа уникальных доменов и стран, а не от числа строк.
+    """
+    
+    def __init__(self, top_competitors: int = SUMMARY_TOP_COMPETITORS):
+        self.top_competitors = top_competitors
+        self.total = _Counts()
+        self.domains: Dict[str, _Counts] = {}
+        self.countries: Dict[str, _Counts] = {}
+        self.competitors: Counter = Counter()
+    
+    def add(self, metrics: Dict[str, Any]) -> None:
+        """
+        Учет одной строки отчета (см. MetricsCalculator.calculate_metrics_for_query)
+        
+        Args:
+            metrics: Строка отчета; значения могут быть строками, если отчет прочитан из CSV
+        """
+        aiv = _to_number(metrics.get("AIV-Score")) or 0.0
+        rank = _to_number(metrics.get("Позиція"))
+        rank = int(rank) if rank else None
+        mentions = int(_to_number(metrics.get("Mentions Count")) or 0)
+        sources = int(_to_number(metrics.get("Total Sources")) or 0)
+        domain = str(metrics.get("Целевой домен") or "")
+        country = str(metrics.get("Страна") or "")
+        
+        self.total.add(aiv, rank, mentions, sources)
+        for group, key in ((self.domains, domain), (self.countries, country)):
+            counts = group.get(key)
+            if counts is None:
+                counts = group[key] = _Counts()
+            counts.add(aiv, rank, mentions, sources)
+        
+        competitors = metrics.get("Конкуренти")
+        if isinstance(competitors, str) and competitors:
+            self.competitors.update(competitors.split(", "))
+    
+    def add_many(self, rows: Iterable[Dict[str, Any]]) -> "JobAggregator":
+        for metrics in rows:
+            self.add(metrics)
+        return self
+    
+    @classmethod
+    def from_report_csv(cls, csv_content: bytes) -> "JobAggregator":
+        """Сводка по готовому CSV отчета (для отчетов из кэша)"""
+        reader = csv.DictReader(io.StringIO(csv_content.decode("utf-8-sig")))
+        return cls().add_many(reader)
+    
+    def top_competitor_items(self, k: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Самые частые конкуренты: (домен, число строк отчета)"""
+        return heapq.nlargest(k or self.top_competitors, self.competitors.items(), key=itemgetter(1))
+    
+    def summary_rows(self) -> List[Dict[str, Any]]:
+        """
+        Строки листа сводки: итог, домены, страны и топ конкурентов
+        
+        Returns:
+            Словари с колонками SUMMARY_COLUMNS
+        """
+        rows = [self.total.row("Total", "All queries")]
+        rows.extend(
+            self.domains[domain].row("Domain", domain)
+            for domain in sorted(self.domains, key=lambda d: (-self.domains[d].aiv_sum / self.domains[d].queries, d))
+        )
+        rows.extend(self.countries[country].row("Country", country) for country in sorted(self.countries))
+        rows.extend(
+            {"Section": "Competitor", "Name": domain, "Queries": count}
+            for domain, count in self.top_competitor_items()
+        )
+        return rows
+    
+    def to_csv(self) -> bytes:
+        """Лист сводки в CSV"""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(self.summary_rows())
+        return buffer.getvalue().encode("utf-8")
+    
+    def email_header(self) -> str:
+        """Краткая сводка для начала письма"""
+        total = self.total
+        if not total.queries:
+            return ""
+        lines = [
+            f"- Average AIV-Score: {total.aiv_sum / total.queries:.1f} "
+            f"(visible in {total.visible} of {total.queries} results, {100 * total.visible / total.queries:.0f}%)"
+        ]
+        top_domains = heapq.nlargest(
+            SUMMARY_TOP_DOMAINS, self.domains.items(), key=lambda item: item[1].aiv_sum / item[1].queries
+        )
+        for domain, counts in top_domains:
+            lines.append(
+                f"- {domain}: AIV-Score {counts.aiv_sum / counts.queries:.1f}, "
+                f"visible {100 * counts.visible / counts.queries:.0f}%, "
+                f"share of voice {100 * counts.mentions / counts.sources if counts.sources else 0:.1f}%"
+            )
+        if len(self.countries) > 1:
+            lines.append("- By country: " + ", ".join(
+                f"{country} {counts.aiv_sum / counts.queries:.1f}"
+                for country, counts in sorted(self.countries.items())
+            ))
+        competitors = self.top_competitor_items(5)
+        if competitors:
+            lines.append("- Top competitors: " + ", ".join(f"{domain} ({count})" for domain, count in competitors))
+        return "\n".join(lines)
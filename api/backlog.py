@@ -0,0 +1,111 @@
+"""
+Контроль очереди обработки: ограничение числа задач и строк в работе
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+from api.config import (
+    MAX_BACKLOG_JOBS, MAX_BACKLOG_ROWS,
+    BACKLOG_DEFAULT_ROW_SECONDS, BACKLOG_THROUGHPUT_WINDOW_SECONDS
+)
+
+class BacklogFullError(Exception):
+    """Очередь обработки заполнена"""
+    
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class BacklogController:
+    """Учет задач в работе и отказ в приеме сверх лимита"""
+    
+    def __init__(self, max_jobs: int = MAX_BACKLOG_JOBS, max_rows: int = MAX_BACKLOG_ROWS):
+        self.max_jobs = max_jobs
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self.active_jobs = 0
+        self.active_rows = 0
+        self.admitted = 0
+        self.rejected = 0
+        # Завершенные задачи (время окончания, строк) для оценки пропускной способности
+        self._completions: Deque[Tuple[float, int]] = deque()
+    
+    def _throughput(self, now: float) -> float:
+        """Строк в секунду за последнее окно (вызывается под блокировкой)"""
+        while self._completions and now - self._completions[0][0] > BACKLOG_THROUGHPUT_WINDOW_SECONDS:
+            self._completions.popleft()
+        if not self._completions:
+            return 1.0 / BACKLOG_DEFAULT_ROW_SECONDS
+        rows = sum(count for _, count in self._completions)
+        span = max(now - self._completions[0][0], 1.0)
+        return max(rows / span, 1.0 / BACKLOG_DEFAULT_ROW_SECONDS)
+    
+    def admit(self, rows: int, force: bool = False) -> int:
+        """
+        Прием задачи в обработку
+        
+        Args:
+            rows: Оценка количества строк задачи
+            force: Учесть задачу без проверки лимитов (возобновление прерванной)
+        
+        Returns:
+            Количество учтенных строк (передается в release)
+        
+        Raises:
+            BacklogFullError: Если лимит задач или строк превышен
+        """
+        now = time.monotonic()
+        with self._lock:
+            over_jobs = self.active_jobs + 1 > self.max_jobs
+            over_rows = self.active_jobs > 0 and self.active_rows + rows > self.max_rows
+            if (over_jobs or over_rows) and not force:
+                self.rejected += 1
+                # Сколько строк нужно обработать, чтобы освободилось место под эту задачу:
+                # при лимите задач - в среднем одна текущая задача
+                excess_rows = max(
+                    self.active_rows + rows - self.max_rows,
+                    self.active_rows / self.active_jobs if over_jobs and self.active_jobs else 1
+                )
+                retry_after = int(math.ceil(excess_rows / self._throughput(now)))
+                raise BacklogFullError(
+                    "Сервіс перевантажений. Спробуйте пізніше",
+                    retry_after=min(max(retry_after, 1), 600)
+                )
+            self.active_jobs += 1
+            self.active_rows += rows
+            self.admitted += 1
+            return rows
+    
+    def release(self, rows: int, completed_rows: int = 0) -> None:
+        """
+        Освобождение места после завершения задачи
+        
+        Args:
+            rows: Значение, возвращенное admit
+            completed_rows: Фактически обработанные строки (для оценки пропускной способности)
+        """
+        with self._lock:
+            self.active_jobs -= 1
+            self.active_rows -= rows
+            if completed_rows:
+                self._completions.append((time.monotonic(), completed_rows))
+    
+    def stats(self) -> Dict[str, Any]:
+        """Состояние очереди для мониторинга"""
+        with self._lock:
+            return {
+                "active_jobs": self.active_jobs,
+                "active_rows": self.active_rows,
+                "max_jobs": self.max_jobs,
+                "max_rows": self.max_rows,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "rows_per_second": round(self._throughput(time.monotonic()), 3)
+            }
+
+# Глобальный экземпляр контроля очереди
+backlog = BacklogController()
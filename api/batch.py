@@ -0,0 +1,269 @@
+"""
+Пакетный запуск анализа файла без веб-сервера, SMTP и реестра загрузок
+
+Использует тот же конвейер, что и сервис (FileProcessor, движки,
+MetricsCalculator), поэтому подходит и для внутренних аудитов, и для
+замеров производительности.
+
+Использование:
+    python -m api.batch prompts.xlsx -o report.csv [--concurrency 16] [--max-rows 0]
+    python -m api.batch prompts.csv -o report.xlsx --no-cache --engines openai:gpt-4o,stub
+    python -m api.batch catalog.xlsx -o estimate.csv --estimate [--precision 5] [--max-queries 5000]
+
+Прерывание (Ctrl+C) сохраняет готовые результаты в контрольную точку
+(по умолчанию <output>.checkpoint.json); повторный запуск с теми же
+аргументами продолжает с места остановки.
+
+Режим --estimate опрашивает только стратифицированную выборку строк
+(по стране и сайту), наращивая ее до заданной точности, и пишет оценки
+AIV-Score и доли видимости по доменам с доверительными интервалами.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import pandas as pd
+
+from api.aggregation import JobAggregator, SUMMARY_COLUMNS
+from api.config import ESTIMATE_PRECISION, ESTIMATE_CONFIDENCE, ESTIMATE_MAX_QUERIES
+from api.engines import build_engines, engines as default_engines
+from api.file_processor import FileProcessor
+from api.job_stats import JobStats
+from api.jobs import Job, JobInterruptedError
+from api.openai_client import openai_client
+from api.pipeline import analyze_rows
+from api.result_store import result_store
+from api.sampling import StratifiedEstimator, run_estimate
+from api.scheduler import fair_scheduler
+
+def load_checkpoint(path: str, file_hash: str) -> Optional[Dict[str, list]]:
+    """
+    Готовые результаты строк из контрольной точки того же файла
+    
+    Returns:
+        Результаты по ключам completed_key или None
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("file_hash") != file_hash:
+        print(f"Контрольная точка {path} относится к другому файлу, начинаем заново", file=sys.stderr)
+        return None
+    return checkpoint["completed"]
+
+def save_checkpoint(path: str, file_hash: str, completed: Dict[str, list]) -> None:
+    """Сохранение готовых результатов строк прерванного запуска"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"file_hash": file_hash, "completed": completed}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def write_report(report_df: pd.DataFrame, path: str, aggregator: JobAggregator) -> None:
+    """
+    Запись отчета в CSV, XLSX или Parquet по расширению файла
+    
+    Сводка пишется листом Summary в XLSX или файлом <output>.summary.csv.
+    """
+    base, ext = os.path.splitext(path)
+    if ext.lower() == ".xlsx":
+        with pd.ExcelWriter(path) as writer:
+            report_df.to_excel(writer, sheet_name="Report", index=False)
+            pd.DataFrame(aggregator.summary_rows(), columns=SUMMARY_COLUMNS).to_excel(writer, sheet_name="Summary", index=False)
+        return
+    
+    if ext.lower() == ".parquet":
+        result_store.write_file(report_df, path)
+    else:
+        report_df.to_csv(path, index=False, encoding="utf-8")
+    with open(f"{base}.summary.csv", "wb") as f:
+        f.write(aggregator.to_csv())
+
+def write_estimate(estimate_df: pd.DataFrame, path: str) -> None:
+    """Запись таблицы оценок в CSV, XLSX или Parquet по расширению файла"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".xlsx":
+        estimate_df.to_excel(path, sheet_name="Estimate", index=False)
+    elif ext == ".parquet":
+        result_store.write_file(estimate_df, path)
+    else:
+        estimate_df.to_csv(path, index=False, encoding="utf-8")
+
+def run_with_progress(target: Callable[[], Any], job: Job, stats: JobStats, total: Optional[int], progress_interval: float = 1.0) -> Any:
+    """
+    Выполнение target в отдельном потоке с выводом прогресса в stderr
+    
+    Основной поток остается свободным для Ctrl+C: прерывание отменяет
+    задачу с причиной shutdown, и target завершается с готовыми результатами.
+    
+    Returns:
+        Результат target
+    
+    Raises:
+        Исключение target
+    """
+    outcome: Dict[str, Any] = {}
+    finished = threading.Event()
+    
+    def run():
+        try:
+            outcome["results"] = target()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            finished.set()
+    
+    started = time.monotonic()
+    threading.Thread(target=run, name="batch-analyze", daemon=True).start()
+    try:
+        # Event, а не Thread.join: прерванный Ctrl+C join оставляет поток в неверном состоянии
+        while not finished.wait(progress_interval):
+            done = int(stats.counters.get("reused", 0)) + stats.count("country:")
+            elapsed = time.monotonic() - started
+            print(
+                f"\rГотово {done}{f'/{total}' if total else ''} запросов, {elapsed:.0f}с, "
+                f"ошибок {int(stats.counters.get('errors', 0))}",
+                end="", file=sys.stderr
+            )
+    except KeyboardInterrupt:
+        print("\nПрерывание: дожидаемся запросов в работе...", file=sys.stderr)
+        job.cancel("shutdown")
+        finished.wait()
+    print(file=sys.stderr)
+    
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["results"]
+
+def run_batch(
+    df: pd.DataFrame,
+    file_hash: str,
+    job: Job,
+    engines: list,
+    use_cache: bool,
+    completed: Optional[Dict[str, list]],
+    stats: JobStats,
+    aggregator: JobAggregator
+) -> List[Dict[str, Any]]:
+    """
+    Анализ всех строк с прогрессом в stderr (см. run_with_progress)
+    
+    Raises:
+        JobInterruptedError: Если запуск прерван или истек срок; содержит готовые результаты
+    """
+    return run_with_progress(
+        lambda: analyze_rows(
+            df, file_hash, use_cache=use_cache, engines=engines,
+            stats=stats, tenant="batch", job=job, completed=completed,
+            aggregator=aggregator
+        ),
+        job, stats, len(df) * len(engines)
+    )
+
+def run_estimate_batch(args: argparse.Namespace, df: pd.DataFrame, file_hash: str, engines: list) -> int:
+    """Оценочный режим: выборка до заданной точности и таблица оценок"""
+    estimator = StratifiedEstimator(
+        df, precision=args.precision, confidence=args.confidence,
+        max_rows=args.max_queries, seed=int(file_hash[:16], 16)
+    )
+    job = Job("batch", "local", file_hash, deadline_seconds=args.deadline)
+    stats = JobStats()
+    started = time.monotonic()
+    run_with_progress(
+        lambda: run_estimate(
+            df, file_hash, engines=engines, stats=stats, tenant="batch",
+            job=job, use_cache=not args.no_cache, estimator=estimator
+        ),
+        job, stats, None
+    )
+    
+    estimate_df = estimator.to_frame()
+    write_estimate(estimate_df, args.output)
+    imprecise = int((~estimate_df["Precise"].astype(bool)).sum())
+    elapsed = time.monotonic() - started
+    print(
+        f"Оценка {args.output}: выборка {estimator.sampled} из {len(df)} строк за {elapsed:.1f}с, "
+        f"{estimator.rounds} раундов; не достигли точности ±{args.precision:g}: {imprecise} из {len(estimate_df)}",
+        file=sys.stderr
+    )
+    if estimator.interrupted:
+        print(f"Запуск прерван ({estimator.interrupted}): оценка по готовым строкам", file=sys.stderr)
+        return 130 if estimator.interrupted == "shutdown" else 1
+    if stats.latencies:
+        print(stats.format(), file=sys.stderr)
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Пакетный анализ AI Visibility без веб-сервера")
+    parser.add_argument("input", help="Файл CSV/TSV/XLSX с колонками Country, Prompt, Website")
+    parser.add_argument("-o", "--output", required=True, help="Файл отчета (.csv, .xlsx или .parquet)")
+    parser.add_argument("--concurrency", type=int, default=fair_scheduler.workers, help="Параллельных запросов к движкам")
+    parser.add_argument("--country-concurrency", type=int, default=None, help="Параллельных запросов на одну страну (по умолчанию = --concurrency)")
+    parser.add_argument("--max-rows", type=int, default=0, help="Ограничение количества строк (0 - без ограничения)")
+    parser.add_argument("--engines", help="Движки через запятую (по умолчанию SEARCH_ENGINES)")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать сохраненные результаты строк")
+    parser.add_argument("--checkpoint", help="Файл контрольной точки (по умолчанию <output>.checkpoint.json)")
+    parser.add_argument("--deadline", type=float, default=24 * 3600, help="Предельное время запуска в секундах")
+    parser.add_argument("--estimate", action="store_true", help="Оценка по стратифицированной выборке вместо опроса всех строк")
+    parser.add_argument("--precision", type=float, default=ESTIMATE_PRECISION, help="Целевая полуширина интервала (пункты AIV-Score и п.п. видимости)")
+    parser.add_argument("--confidence", type=float, default=ESTIMATE_CONFIDENCE, help="Уровень доверия интервалов")
+    parser.add_argument("--max-queries", type=int, default=ESTIMATE_MAX_QUERIES, help="Предельный размер выборки в строках (0 - без ограничения)")
+    args = parser.parse_args(argv)
+    
+    # Рабочие потоки планировщика запускаются лениво, поэтому размер пула можно задать до первой задачи
+    fair_scheduler.workers = max(1, args.concurrency)
+    openai_client.country_concurrency = max(1, args.country_concurrency or args.concurrency)
+    engines = build_engines(args.engines.split(",")) if args.engines else default_engines
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint.json"
+    
+    with open(args.input, "rb") as f:
+        file_hash = hashlib.sha256(f.read()).hexdigest()
+    try:
+        df, queries_count = FileProcessor.process_file(args.input, max_rows=args.max_rows or None)
+    except ValueError as e:
+        print(f"Файл не обработан: {e}", file=sys.stderr)
+        return 1
+    if not queries_count:
+        print("В файле нет строк для анализа", file=sys.stderr)
+        return 1
+    if args.estimate:
+        return run_estimate_batch(args, df, file_hash, engines)
+    
+    completed = load_checkpoint(checkpoint_path, file_hash)
+    if completed:
+        print(f"Продолжение из {checkpoint_path}: готово {len(completed)} результатов", file=sys.stderr)
+    
+    job = Job("batch", "local", file_hash, deadline_seconds=args.deadline)
+    stats = JobStats()
+    aggregator = JobAggregator()
+    started = time.monotonic()
+    try:
+        results = run_batch(
+            df, file_hash, job, engines, not args.no_cache, completed, stats, aggregator
+        )
+    except JobInterruptedError as e:
+        save_checkpoint(checkpoint_path, file_hash, e.completed)
+        # Запросы в работе уже оплачены: дожидаемся и дописываем их в контрольную точку
+        if e.collect_in_flight():
+            save_checkpoint(checkpoint_path, file_hash, e.completed)
+        print(f"Запуск прерван ({e.reason}): {len(e.completed)} результатов сохранено в {checkpoint_path}", file=sys.stderr)
+        return 130 if e.reason == "shutdown" else 1
+    
+    write_report(pd.DataFrame(results), args.output, aggregator)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    
+    elapsed = time.monotonic() - started
+    print(f"Отчет {args.output}: {queries_count} строк за {elapsed:.1f}с (задача {job.id})", file=sys.stderr)
+    print(aggregator.email_header(), file=sys.stderr)
+    if stats.latencies:
+        print(stats.format(), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Замер задержки цикла событий при одновременных загрузках XLSX
+
+Цикл событий отмечает каждые --tick мс, насколько позже запланированного
+он проснулся, пока параллельно разбираются --uploads книг по --rows строк:
+в потоке процесса сервиса (как раньше) и в пуле процессов parse_pool.
+
+Использование:
+    python -m api.bench_upload [--rows 20000] [--uploads 4] [--mode both]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from starlette.concurrency import run_in_threadpool
+
+from api.file_processor import FileProcessor
+from api.parse_pool import ParsePool
+
+def make_workbook(path: str, rows: int) -> None:
+    """Книга с колонками Country, Prompt, Website, Tracked"""
+    from openpyxl import Workbook
+    
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Prompts")
+    sheet.append(["Country", "Prompt", "Website", "Tracked"])
+    countries = ("UK", "USA", "Germany", "France")
+    for i in range(rows):
+        sheet.append([
+            countries[i % len(countries)],
+            f"best cordless vacuum cleaner model {i} reviews and price",
+            f"https://www.example{i % 50}.com/products/{i}",
+            f"competitor{i % 7}.com, rival{i % 11}.co.uk"
+        ])
+    workbook.save(path)
+
+async def measure(parse: Callable[[str], tuple], path: str, uploads: int, tick: float) -> Dict[str, float]:
+    """
+    Разбор uploads копий файла с одновременным замером задержки цикла
+    
+    Returns:
+        Время разбора и задержки цикла событий (мс)
+    """
+    lags: List[float] = []
+    done = asyncio.Event()
+    
+    async def monitor():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            expected = loop.time() + tick
+            await asyncio.sleep(tick)
+            lags.append(max(0.0, loop.time() - expected) * 1000)
+    
+    monitor_task = asyncio.create_task(monitor())
+    started = time.perf_counter()
+    await asyncio.gather(*(run_in_threadpool(parse, path) for _ in range(uploads)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await monitor_task
+    
+    lags.sort()
+    return {
+        "parse_s": elapsed,
+        "lag_p50_ms": statistics.median(lags) if lags else 0.0,
+        "lag_p99_ms": lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0,
+        "lag_max_ms": lags[-1] if lags else 0.0,
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Задержка цикла событий при разборе XLSX")
+    parser.add_argument("--rows", type=int, default=20000, help="Строк в книге")
+    parser.add_argument("--uploads", type=int, default=4, help="Одновременных загрузок")
+    parser.add_argument("--workers", type=int, default=2, help="Процессов пула")
+    parser.add_argument("--tick", type=float, default=10.0, help="Интервал замера задержки, мс")
+    parser.add_argument("--mode", choices=("thread", "pool", "both"), default="both")
+    args = parser.parse_args(argv)
+    
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    pool = ParsePool(workers=args.workers)
+    try:
+        make_workbook(path, args.rows)
+        print(f"Книга {args.rows} строк, {os.path.getsize(path) / 1024 / 1024:.1f}МБ; {args.uploads} загрузок")
+        
+        modes = {
+            "thread": lambda p: FileProcessor.process_file(p, max_rows=None),
+            "pool": lambda p: pool.process_file(p, max_rows=None),
+        }
+        if args.mode != "both":
+            modes = {args.mode: modes[args.mode]}
+        if "pool" in modes:
+            pool.warm_up()  # Запуск процессов не входит в замер
+        
+        for name, parse in modes.items():
+            result = asyncio.run(measure(parse, path, args.uploads, args.tick / 1000))
+            print(
+                f"{name:>6}: разбор {result['parse_s']:.2f}с, задержка цикла "
+                f"p50 {result['lag_p50_ms']:.1f}мс, p99 {result['lag_p99_ms']:.1f}мс, "
+                f"max {result['lag_max_ms']:.1f}мс"
+            )
+    finally:
+        pool.shutdown()
+        os.remove(path)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,13 +4,57 @@
 
 import os
 import re
-from typing import List
+from typing import Dict, List, Tuple
 
 # OpenAI настройки
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# Пул ключей (или ключей проектов) через запятую: "sk-...,sk-...:proj_..." - после двоеточия ID проекта.
+# Без OPENAI_API_KEYS используется один OPENAI_API_KEY
+OPENAI_API_KEYS: List[str] = [
+    k.strip()
+    for k in os.environ.get("OPENAI_API_KEYS", "").split(",")
+    if k.strip()
+] or ([OPENAI_API_KEY] if OPENAI_API_KEY else [])
+OPENAI_KEY_CONCURRENCY = int(os.environ.get("OPENAI_KEY_CONCURRENCY", "8"))  # Параллельных запросов на один ключ
+OPENAI_KEY_COOLDOWN_SECONDS = float(os.environ.get("OPENAI_KEY_COOLDOWN_SECONDS", "5"))  # Пауза ключа после 429 без Retry-After
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o")
 OPENAI_TIMEOUT = 90.0
 
+# Транспорт OpenAI: общий HTTP/2 пул с keep-alive соединениями
+OPENAI_HTTP2 = os.environ.get("OPENAI_HTTP2", "true").lower() in ("1", "true", "yes")
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "32"))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "16"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "120"))
+OPENAI_WARMUP = os.environ.get("OPENAI_WARMUP", "false").lower() in ("1", "true", "yes")
+OPENAI_WARMUP_CONNECTIONS = int(os.environ.get("OPENAI_WARMUP_CONNECTIONS", "2"))
+
+# Поисковые движки: список через запятую, формат "openai:<model>" или "stub"
+SEARCH_ENGINES: List[str] = [
+    e.strip()
+    for e in os.environ.get("SEARCH_ENGINES", f"openai:{OPENAI_MODEL}").split(",")
+    if e.strip()
+]
+# Параллельных запросов на одну страну (по умолчанию растет с числом ключей)
+COUNTRY_MAX_CONCURRENCY = int(os.environ.get("COUNTRY_MAX_CONCURRENCY", str(4 * max(1, len(OPENAI_API_KEYS)))))
+
+# Маршрутизация по уровням моделей (движок "tiered"): сначала быстрая модель,
+# OPENAI_MODEL - только для ответов с малым числом источников или без цитат
+OPENAI_FAST_MODEL = os.environ.get("OPENAI_FAST_MODEL", "gpt-4o-mini")
+TIER_MIN_SOURCES = int(os.environ.get("TIER_MIN_SOURCES", "3"))
+
+# Оценка стоимости запросов: USD за 1M токенов (вход/выход) и за вызов веб-поиска
+MODEL_PRICES: Dict[str, Tuple[float, ...]] = {
+    model.strip(): tuple(float(price) for price in prices.split("/"))
+    for model, _, prices in (
+        item.partition("=")
+        for item in os.environ.get(
+            "MODEL_PRICES", "gpt-4o=2.5/10,gpt-4o-mini=0.15/0.6,gpt-4.1=2/8,gpt-4.1-mini=0.4/1.6,gpt-4.1-nano=0.1/0.4"
+        ).split(",")
+    )
+    if prices
+}
+WEB_SEARCH_CALL_USD = float(os.environ.get("WEB_SEARCH_CALL_USD", "0.01"))
+
 # Домены для анализа (теперь используются как fallback)
 OUR_DOMAINS: List[str] = [
     d.strip().lower()
@@ -21,11 +65,95 @@ OUR_DOMAINS: List[str] = [
 # Файловые ограничения
 ALLOW_RETRY_SAME_FILE = os.environ.get("ALLOW_RETRY_SAME_FILE", "false").lower() in ("1", "true", "yes")
 MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "10"))
+MAX_DECOMPRESSED_MB = int(os.environ.get("MAX_DECOMPRESSED_MB", "100"))  # Лимит распакованного размера сжатых загрузок
+MAX_COMPRESSION_RATIO = float(os.environ.get("MAX_COMPRESSION_RATIO", "100"))  # Защита от zip-бомб
 MAX_ROWS_PROCESS = 10  # Жестко ограничено в MVP
+ANALYZE_MAX_ITEMS = int(os.environ.get("ANALYZE_MAX_ITEMS", "100"))  # Элементов в одном запросе POST /analyze
+PREFLIGHT_ROWS = int(os.environ.get("PREFLIGHT_ROWS", "20"))  # Строк, проверяемых при загрузке
+
+# Разбор загруженных файлов в отдельных процессах (0 - в процессе сервиса)
+PARSE_POOL_WORKERS = int(os.environ.get("PARSE_POOL_WORKERS", "2"))
+PARSE_POOL_MAX_TASKS = int(os.environ.get("PARSE_POOL_MAX_TASKS", "50"))  # Файлов на процесс до перезапуска
+
+# Оценочный режим для больших наборов запросов: стратифицированная выборка по стране и сайту
+ESTIMATE_PRECISION = float(os.environ.get("ESTIMATE_PRECISION", "5"))  # Полуширина интервала: пункты AIV-Score и п.п. доли видимости
+ESTIMATE_CONFIDENCE = float(os.environ.get("ESTIMATE_CONFIDENCE", "0.95"))
+ESTIMATE_INITIAL_PER_STRATUM = int(os.environ.get("ESTIMATE_INITIAL_PER_STRATUM", "10"))  # Строк каждой страты в первом раунде
+ESTIMATE_MAX_QUERIES = int(os.environ.get("ESTIMATE_MAX_QUERIES", "5000"))  # Предельный размер выборки (строк)
+
+# Повторное использование результатов по строкам (инкрементальный анализ)
+ROW_CACHE_ENABLED = os.environ.get("ROW_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ROW_CACHE_MAX_AGE_HOURS = float(os.environ.get("ROW_CACHE_MAX_AGE_HOURS", "192"))  # 8 дней - покрывает еженедельный аудит
+
+# Хранение сырых ответов движков по задачам для пересчета отчетов
+RAW_STORE_ENABLED = os.environ.get("RAW_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Колоночное хранилище отчетов задач (Parquet, нужен пакет pyarrow)
+RESULT_STORE_ENABLED = os.environ.get("RESULT_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULTS_DIR = os.environ.get("RESULTS_DIR", ".ai_visibility_results")
+RESULT_RETENTION_DAYS = float(os.environ.get("RESULT_RETENTION_DAYS", "30"))
+RESULT_STREAM_BATCH_ROWS = int(os.environ.get("RESULT_STREAM_BATCH_ROWS", "10000"))  # Строк в группе Parquet и в порции выдачи
+
+# Сводка по задаче в письме и отдельном листе отчета
+SUMMARY_TOP_COMPETITORS = int(os.environ.get("SUMMARY_TOP_COMPETITORS", "10"))
+SUMMARY_TOP_DOMAINS = int(os.environ.get("SUMMARY_TOP_DOMAINS", "5"))  # Доменов в тексте письма
+
+# Повторное использование готовых отчетов для одинаковых файлов
+REPORT_CACHE_ENABLED = os.environ.get("REPORT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+REPORT_CACHE_TTL_HOURS = float(os.environ.get("REPORT_CACHE_TTL_HOURS", "24"))  # Размер окна свежести
+
+# Допуск загрузок: лимит частоты по IP и кэш решений перед базой
+RATE_LIMIT_REQUESTS = int(os.environ.get("RATE_LIMIT_REQUESTS", "10"))
+RATE_LIMIT_WINDOW_SECONDS = float(os.environ.get("RATE_LIMIT_WINDOW_SECONDS", "60"))
+ACCESS_CACHE_SIZE = int(os.environ.get("ACCESS_CACHE_SIZE", "10000"))
+ACCESS_CACHE_TTL_SECONDS = float(os.environ.get("ACCESS_CACHE_TTL_SECONDS", "600"))
+# Прокси, от которых принимается X-Forwarded-For: адреса или сети через запятую,
+# "*" - любой (платформа сама перезаписывает заголовок, как Vercel)
+TRUSTED_PROXIES: List[str] = [
+    p.strip()
+    for p in os.environ.get("TRUSTED_PROXIES", "127.0.0.1,::1").split(",")
+    if p.strip()
+]
+
+# Справедливый планировщик запросов: общий пул потоков на все задачи
+# Общая параллельность запросов к движкам: по умолчанию 8 на каждый ключ OpenAI
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", str(8 * max(1, len(OPENAI_API_KEYS)))))
+SCHEDULER_BATCH_SIZE = int(os.environ.get("SCHEDULER_BATCH_SIZE", "5"))  # Строк в пакете
+SMALL_JOB_ROWS = int(os.environ.get("SMALL_JOB_ROWS", "20"))  # Задачи до этого размера считаются малыми
+SMALL_JOB_BOOST = float(os.environ.get("SMALL_JOB_BOOST", "4"))  # Множитель веса малых задач
+JOB_PRIORITY_WEIGHTS = {
+    "paid": float(os.environ.get("PAID_PRIORITY_WEIGHT", "4")),
+    "free": 1.0,
+}
+PAID_EMAILS: List[str] = [  # Адреса или домены в виде "@company.com"
+    e.strip().lower()
+    for e in os.environ.get("PAID_EMAILS", "").split(",")
+    if e.strip()
+]
+
+# Очередь обработки: сверх лимита новые задачи получают 503 с Retry-After
+MAX_BACKLOG_JOBS = int(os.environ.get("MAX_BACKLOG_JOBS", "20"))
+MAX_BACKLOG_ROWS = int(os.environ.get("MAX_BACKLOG_ROWS", "200"))
+BACKLOG_DEFAULT_ROW_SECONDS = float(os.environ.get("BACKLOG_DEFAULT_ROW_SECONDS", "15"))  # Оценка, пока нет статистики
+BACKLOG_THROUGHPUT_WINDOW_SECONDS = 600.0
+
+# Метрики сервиса: последних задержек на метку (страна, модель) в /metrics
+SERVICE_STATS_MAX_SAMPLES = int(os.environ.get("SERVICE_STATS_MAX_SAMPLES", "1000"))
+
+# Сроки задач и остановка сервиса
+JOB_DEADLINE_SECONDS = float(os.environ.get("JOB_DEADLINE_SECONDS", "1800"))
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_GRACE_SECONDS", "20"))
 
 # База данных
 REGISTRY_PATH = os.environ.get("REGISTRY_PATH", ".ai_visibility_gate.sqlite")
 
+# Регулярное отслеживание видимости
+TRACKING_SCHEDULER_ENABLED = os.environ.get("TRACKING_SCHEDULER_ENABLED", "false").lower() in ("1", "true", "yes")
+TRACKING_POLL_SECONDS = int(os.environ.get("TRACKING_POLL_SECONDS", "60"))
+TRACKING_INTERVALS = {"daily": 24, "weekly": 24 * 7}  # Интервалы перезапуска в часах
+TRACKING_MAX_SETS_PER_EMAIL = int(os.environ.get("TRACKING_MAX_SETS_PER_EMAIL", "3"))
+TRACKING_RETRY_MINUTES = float(os.environ.get("TRACKING_RETRY_MINUTES", "30"))  # Повтор набора после ошибки прогона
+
 # SMTP настройки
 SMTP_HOST = os.environ.get("SMTP_HOST")
 SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
@@ -39,7 +167,7 @@ EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
 
 # Валидация конфигурации
 def validate_config():
-    if not OPENAI_API_KEY:
+    if not OPENAI_API_KEYS:
         raise ValueError("OPENAI_API_KEY не установлен")
     if not SMTP_HOST or not SMTP_USER or not SMTP_PASS:
         raise ValueError("SMTP настройки не полные")
\ No newline at end of file
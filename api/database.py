@@ -3,16 +3,26 @@
 """
 
 import os
+import json
+import zlib
+import secrets
 import sqlite3
-from datetime import datetime
-from typing import Optional, Tuple
-from api.config import REGISTRY_PATH
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, List, Dict, Any, Iterator
+from api.config import REGISTRY_PATH, ROW_CACHE_MAX_AGE_HOURS, RESULT_RETENTION_DAYS
+
+# Не чаще одной очистки устаревших записей таблицы в час
+PRUNE_INTERVAL_SECONDS = 3600.0
 
 class Database:
     """Класс для работы с SQLite базой данных"""
     
     def __init__(self):
         self.db_path = REGISTRY_PATH
+        self._pruned_at: Dict[str, float] = {}
+        self._prune_lock = threading.Lock()
         self.init_db()
     
     def connect(self) -> sqlite3.Connection:
@@ -46,9 +56,197 @@ class Database:
             )
         """)
         
+        # Кэш результатов по строкам: (хеш содержимого строки, модель), последний результат.
+        # Поиск не зависит от файла - отредактированный файл имеет новый хеш
+        self._migrate_row_results(cur)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS row_results (
+                row_hash TEXT,
+                model TEXT,
+                sources_json TEXT,
+                computed_utc TEXT,
+                PRIMARY KEY (row_hash, model)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_row_results_age
+            ON row_results (computed_utc)
+        """)
+        
+        # Готовые отчеты по содержимому файла: (хеш файла, движки, окно свежести)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                file_hash TEXT,
+                model TEXT,
+                bucket INTEGER,
+                csv_content BLOB,
+                queries_count INTEGER,
+                created_utc TEXT,
+                PRIMARY KEY (file_hash, model, bucket)
+            )
+        """)
+        
+        # Входные строки задач и сжатые сырые ответы движков по строкам
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS job_inputs (
+                job_id TEXT PRIMARY KEY,
+                rows_blob BLOB,
+                engines_json TEXT,
+                created_utc TEXT
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_job_inputs_created
+            ON job_inputs (created_utc)
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS raw_responses (
+                job_id TEXT,
+                row_index INTEGER,
+                engine TEXT,
+                payload BLOB,
+                PRIMARY KEY (job_id, row_index, engine)
+            ) WITHOUT ROWID
+        """)
+        
+        # Контрольные точки задач, прерванных остановкой сервиса
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS job_checkpoints (
+                job_id TEXT PRIMARY KEY,
+                email TEXT,
+                ip TEXT,
+                file_hash TEXT,
+                rows_json TEXT,
+                completed_json TEXT,
+                created_utc TEXT
+            )
+        """)
+        
+        # Сохраненные наборы запросов для регулярного перезапуска.
+        # token - ключ владельца к динамике и удалению набора
+        self._migrate_tracking(cur)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS tracked_sets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT,
+                interval_hours REAL,
+                rows_json TEXT,
+                created_utc TEXT,
+                last_run_utc TEXT,
+                next_run_utc TEXT,
+                token TEXT
+            )
+        """)
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tracked_sets_token ON tracked_sets(token)")
+        
+        # Временной ряд результатов: одна точка на (набор, домен, запрос, страна, время)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS visibility_points (
+                domain TEXT,
+                prompt TEXT,
+                country TEXT,
+                ts TEXT,
+                set_id INTEGER,
+                aiv_score REAL,
+                best_rank INTEGER,
+                mentions INTEGER,
+                total_sources INTEGER,
+                PRIMARY KEY (set_id, domain, prompt, country, ts)
+            ) WITHOUT ROWID
+        """)
+        
+        # Недельные агрегаты набора, обновляются при записи точек
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS visibility_weekly (
+                set_id INTEGER,
+                domain TEXT,
+                country TEXT,
+                week_start TEXT,
+                points INTEGER,
+                score_sum REAL,
+                visible_points INTEGER,
+                PRIMARY KEY (set_id, domain, country, week_start)
+            ) WITHOUT ROWID
+        """)
+        self._finish_tracking_migration(cur)
+        
         conn.commit()
         conn.close()
     
+    @staticmethod
+    def _migrate_row_results(cur: sqlite3.Cursor) -> None:
+        """
+        Перенос кэша строк из схемы с file_hash в ключе: остается последний
+        результат на (строка, модель)
+        """
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(row_results)")]
+        if "file_hash" not in columns:
+            return
+        cur.execute("ALTER TABLE row_results RENAME TO row_results_old")
+        cur.execute("DROP INDEX IF EXISTS idx_row_results_row")
+        cur.execute("""
+            CREATE TABLE row_results (
+                row_hash TEXT,
+                model TEXT,
+                sources_json TEXT,
+                computed_utc TEXT,
+                PRIMARY KEY (row_hash, model)
+            )
+        """)
+        cur.execute("""
+            INSERT OR REPLACE INTO row_results
+            SELECT row_hash, model, sources_json, computed_utc FROM row_results_old ORDER BY computed_utc
+        """)
+        cur.execute("DROP TABLE row_results_old")
+    
+    @staticmethod
+    def _migrate_tracking(cur: sqlite3.Cursor) -> None:
+        """
+        Подготовка таблиц отслеживания из схемы без разделения по наборам:
+        наборам выдаются ключи, старые точки переносятся после создания
+        новой таблицы, недельные агрегаты пересчитываются заново
+        """
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(tracked_sets)")]
+        if columns and "token" not in columns:
+            cur.execute("ALTER TABLE tracked_sets ADD COLUMN token TEXT")
+            for (set_id,) in cur.execute("SELECT id FROM tracked_sets").fetchall():
+                cur.execute("UPDATE tracked_sets SET token = ? WHERE id = ?", (secrets.token_urlsafe(16), set_id))
+        
+        key = {row[1]: row[5] for row in cur.execute("PRAGMA table_info(visibility_points)")}
+        if key and not key.get("set_id"):
+            cur.execute("ALTER TABLE visibility_points RENAME TO visibility_points_old")
+        
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(visibility_weekly)")]
+        if columns and "set_id" not in columns:
+            cur.execute("DROP TABLE visibility_weekly")
+    
+    @staticmethod
+    def _finish_tracking_migration(cur: sqlite3.Cursor) -> None:
+        """Перенос точек из старой таблицы и пересчет недельных агрегатов (см. _migrate_tracking)"""
+        if cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'visibility_points_old'").fetchone():
+            cur.execute("INSERT OR REPLACE INTO visibility_points SELECT * FROM visibility_points_old")
+            cur.execute("DROP TABLE visibility_points_old")
+        
+        if cur.execute("SELECT 1 FROM visibility_weekly LIMIT 1").fetchone() is None:
+            # Неделя начинается с понедельника, как в record_tracking_run
+            cur.execute("""
+                INSERT INTO visibility_weekly
+                SELECT set_id, domain, country, date(ts, '-6 days', 'weekday 1') AS week_start,
+                       COUNT(*), SUM(aiv_score), SUM(mentions > 0)
+                FROM visibility_points
+                GROUP BY set_id, domain, country, week_start
+            """)
+    
+    def _prune_due(self, name: str) -> bool:
+        """Пора ли чистить устаревшие записи name (не чаще PRUNE_INTERVAL_SECONDS)"""
+        now = time.monotonic()
+        with self._prune_lock:
+            last = self._pruned_at.get(name)
+            if last is not None and now - last < PRUNE_INTERVAL_SECONDS:
+                return False
+            self._pruned_at[name] = now
+            return True
+    
     def check_ip_file_access(self, ip: str, file_hash: str, allow_retry: bool = False) -> None:
         """
         Проверка доступа IP к обработке файла
@@ -127,6 +325,510 @@ class Database:
         conn.commit()
         conn.close()
     
+    def get_row_result(self, row_hash: str, model: str, max_age_hours: float) -> Optional[List[Dict[str, Any]]]:
+        """
+        Получение свежего результата для строки из кэша
+        
+        Args:
+            row_hash: Хеш содержимого строки
+            model: Модель, которой был получен результат
+            max_age_hours: Окно свежести в часах
+        
+        Returns:
+            Список источников или None, если свежего результата нет
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        threshold = (datetime.utcnow() - timedelta(hours=max_age_hours)).isoformat(timespec="seconds") + "Z"
+        
+        cur.execute(
+            """
+            SELECT sources_json FROM row_results
+            WHERE row_hash = ? AND model = ? AND computed_utc >= ?
+            """,
+            (row_hash, model, threshold)
+        )
+        row = cur.fetchone()
+        conn.close()
+        
+        return json.loads(row[0]) if row else None
+    
+    def save_row_result(self, row_hash: str, model: str, sources: List[Dict[str, Any]]) -> None:
+        """
+        Сохранение результата обработки строки и удаление результатов
+        старше ROW_CACHE_MAX_AGE_HOURS (они уже не выдаются)
+        
+        Args:
+            row_hash: Хеш содержимого строки
+            model: Модель, которой был получен результат
+            sources: Список источников из ответа
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        
+        cur.execute(
+            "INSERT OR REPLACE INTO row_results VALUES (?, ?, ?, ?)",
+            (row_hash, model, json.dumps(sources, ensure_ascii=False), now)
+        )
+        if self._prune_due("row_results"):
+            threshold = (datetime.utcnow() - timedelta(hours=ROW_CACHE_MAX_AGE_HOURS)).isoformat(timespec="seconds") + "Z"
+            cur.execute("DELETE FROM row_results WHERE computed_utc < ?", (threshold,))
+        
+        conn.commit()
+        conn.close()
+    
+    def get_report(self, file_hash: str, model: str, bucket: int) -> Optional[Tuple[bytes, int]]:
+        """
+        Получение готового отчета для файла
+        
+        Args:
+            file_hash: Хеш содержимого файла
+            model: Ключ набора движков
+            bucket: Номер окна свежести
+        
+        Returns:
+            Tuple[CSV отчета, количество запросов] или None
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        cur.execute(
+            "SELECT csv_content, queries_count FROM reports WHERE file_hash = ? AND model = ? AND bucket = ?",
+            (file_hash, model, bucket)
+        )
+        row = cur.fetchone()
+        conn.close()
+        
+        return (bytes(row[0]), row[1]) if row else None
+    
+    def save_report(self, file_hash: str, model: str, bucket: int, csv_content: bytes, queries_count: int) -> None:
+        """
+        Сохранение готового отчета и удаление отчетов из устаревших окон
+        
+        Args:
+            file_hash: Хеш содержимого файла
+            model: Ключ набора движков
+            bucket: Номер окна свежести
+            csv_content: CSV отчета
+            queries_count: Количество обработанных запросов
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        
+        cur.execute(
+            "INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?)",
+            (file_hash, model, bucket, sqlite3.Binary(csv_content), queries_count, now)
+        )
+        cur.execute("DELETE FROM reports WHERE bucket < ?", (bucket,))
+        
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def _pack(value: Any) -> bytes:
+        """Сжатие JSON-совместимой структуры для хранения"""
+        return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+    
+    @staticmethod
+    def _unpack(blob: bytes) -> Any:
+        """Распаковка значения, сохраненного через _pack"""
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+    
+    def save_raw_responses(
+        self,
+        job_id: str,
+        rows: List[Dict[str, str]],
+        engines: List[str],
+        responses: List[Tuple[int, str, Dict[str, Any]]],
+        append: bool = False
+    ) -> None:
+        """
+        Сохранение входных строк задачи и сырых ответов движков
+        
+        Задачи старше RESULT_RETENTION_DAYS (срок хранения их отчетов)
+        удаляются вместе с ответами.
+        
+        Args:
+            job_id: Идентификатор задачи
+            rows: Строки задачи (Country, Prompt, target_domain, tracked_domains)
+            engines: Имена движков в порядке отчета
+            responses: Кортежи (индекс строки, движок, ответ)
+            append: Дописать строки после уже сохраненных строк задачи;
+                индексы ответов сдвигаются на их число
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        
+        offset = 0
+        if append:
+            cur.execute("SELECT rows_blob FROM job_inputs WHERE job_id = ?", (job_id,))
+            stored = cur.fetchone()
+            if stored:
+                previous = self._unpack(stored[0])
+                offset = len(previous)
+                rows = previous + rows
+        
+        cur.execute(
+            "INSERT OR REPLACE INTO job_inputs VALUES (?, ?, ?, ?)",
+            (job_id, sqlite3.Binary(self._pack(rows)), json.dumps(engines), now)
+        )
+        cur.executemany(
+            "INSERT OR REPLACE INTO raw_responses VALUES (?, ?, ?, ?)",
+            (
+                (job_id, offset + row_index, engine, sqlite3.Binary(self._pack(response)))
+                for row_index, engine, response in responses
+            )
+        )
+        if self._prune_due("job_inputs"):
+            threshold = (datetime.utcnow() - timedelta(days=RESULT_RETENTION_DAYS)).isoformat(timespec="seconds") + "Z"
+            cur.execute(
+                "DELETE FROM raw_responses WHERE job_id IN (SELECT job_id FROM job_inputs WHERE created_utc < ?)",
+                (threshold,)
+            )
+            cur.execute("DELETE FROM job_inputs WHERE created_utc < ?", (threshold,))
+        
+        conn.commit()
+        conn.close()
+    
+    def get_job_input(self, job_id: str) -> Optional[Tuple[List[Dict[str, str]], List[str]]]:
+        """
+        Входные строки и движки сохраненной задачи
+        
+        Returns:
+            Tuple[строки, имена движков] или None
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        cur.execute("SELECT rows_blob, engines_json FROM job_inputs WHERE job_id = ?", (job_id,))
+        row = cur.fetchone()
+        conn.close()
+        
+        return (self._unpack(row[0]), json.loads(row[1])) if row else None
+    
+    def iter_raw_responses(self, job_id: str) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+        """
+        Сырые ответы задачи без загрузки всех строк в память разом
+        
+        Yields:
+            Кортежи (индекс строки, движок, ответ)
+        """
+        conn = self.connect()
+        try:
+            cur = conn.execute(
+                "SELECT row_index, engine, payload FROM raw_responses WHERE job_id = ? ORDER BY row_index",
+                (job_id,)
+            )
+            for row_index, engine, payload in cur:
+                yield row_index, engine, self._unpack(payload)
+        finally:
+            conn.close()
+    
+    def list_stored_jobs(self) -> List[str]:
+        """Идентификаторы задач с сохраненными ответами, от новых к старым"""
+        conn = self.connect()
+        cur = conn.cursor()
+        cur.execute("SELECT job_id FROM job_inputs ORDER BY created_utc DESC")
+        job_ids = [row[0] for row in cur.fetchall()]
+        conn.close()
+        return job_ids
+    
+    def save_job_checkpoint(
+        self,
+        job_id: str,
+        email: str,
+        ip: str,
+        file_hash: str,
+        rows: List[Dict[str, str]],
+        completed: Dict[str, list]
+    ) -> None:
+        """
+        Сохранение контрольной точки прерванной задачи
+        
+        Args:
+            job_id: Идентификатор задачи
+            email: Email получателя отчета
+            ip: IP адрес пользователя
+            file_hash: Хеш исходного файла
+            rows: Нормализованные строки файла
+            completed: Уже полученные источники по ключу "строка|движок"
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        
+        cur.execute(
+            "INSERT OR REPLACE INTO job_checkpoints VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                job_id, email, ip, file_hash,
+                json.dumps(rows, ensure_ascii=False),
+                json.dumps(completed, ensure_ascii=False),
+                now
+            )
+        )
+        
+        conn.commit()
+        conn.close()
+    
+    def get_job_checkpoints(self) -> List[Dict[str, Any]]:
+        """
+        Получение всех контрольных точек для возобновления задач
+        
+        Returns:
+            Список контрольных точек с полями job_id, email, ip, file_hash, rows, completed
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        cur.execute(
+            "SELECT job_id, email, ip, file_hash, rows_json, completed_json FROM job_checkpoints ORDER BY created_utc"
+        )
+        checkpoints = [
+            {
+                "job_id": job_id,
+                "email": email,
+                "ip": ip,
+                "file_hash": file_hash,
+                "rows": json.loads(rows_json),
+                "completed": json.loads(completed_json)
+            }
+            for job_id, email, ip, file_hash, rows_json, completed_json in cur.fetchall()
+        ]
+        
+        conn.close()
+        return checkpoints
+    
+    def delete_job_checkpoint(self, job_id: str) -> None:
+        """Удаление контрольной точки завершенной задачи"""
+        conn = self.connect()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM job_checkpoints WHERE job_id = ?", (job_id,))
+        conn.commit()
+        conn.close()
+    
+    def create_tracked_set(self, email: str, interval_hours: float, rows: List[Dict[str, str]]) -> Tuple[int, str]:
+        """
+        Сохранение набора запросов для регулярного перезапуска
+        
+        Args:
+            email: Email владельца набора
+            interval_hours: Интервал перезапуска в часах
+            rows: Строки с ключами Country, Prompt, Website, target_domain, tracked_domains
+        
+        Returns:
+            Tuple[идентификатор набора, ключ владельца для динамики и удаления]
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        token = secrets.token_urlsafe(16)
+        
+        # Первый запуск - при ближайшем проходе планировщика
+        cur.execute(
+            """
+            INSERT INTO tracked_sets (email, interval_hours, rows_json, created_utc, last_run_utc, next_run_utc, token)
+            VALUES (?, ?, ?, ?, NULL, ?, ?)
+            """,
+            (email, interval_hours, json.dumps(rows, ensure_ascii=False), now, now, token)
+        )
+        set_id = cur.lastrowid
+        
+        conn.commit()
+        conn.close()
+        return set_id, token
+    
+    def get_tracked_set_id(self, token: str) -> Optional[int]:
+        """Идентификатор набора по ключу владельца (None - нет такого набора)"""
+        conn = self.connect()
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM tracked_sets WHERE token = ?", (token,))
+        row = cur.fetchone()
+        conn.close()
+        return row[0] if row else None
+    
+    def delete_tracked_set(self, token: str) -> bool:
+        """
+        Остановка отслеживания: удаление набора вместе с его временным рядом
+        
+        Args:
+            token: Ключ владельца набора
+        
+        Returns:
+            True, если набор найден и удален
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM tracked_sets WHERE token = ?", (token,))
+        row = cur.fetchone()
+        if row is not None:
+            cur.execute("DELETE FROM visibility_weekly WHERE set_id = ?", row)
+            cur.execute("DELETE FROM visibility_points WHERE set_id = ?", row)
+            cur.execute("DELETE FROM tracked_sets WHERE id = ?", row)
+        conn.commit()
+        conn.close()
+        return row is not None
+    
+    def count_tracked_sets(self, email: str) -> int:
+        """Количество наборов отслеживания email (без учета регистра)"""
+        conn = self.connect()
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM tracked_sets WHERE lower(email) = ?", (email.lower(),))
+        count = cur.fetchone()[0]
+        conn.close()
+        return count
+    
+    def defer_tracked_set(self, set_id: int, minutes: float) -> None:
+        """
+        Перенос следующего запуска набора после ошибки прогона
+        
+        Args:
+            set_id: Идентификатор набора
+            minutes: Через сколько минут повторить
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        next_run = (datetime.utcnow() + timedelta(minutes=minutes)).isoformat(timespec="seconds") + "Z"
+        cur.execute("UPDATE tracked_sets SET next_run_utc = ? WHERE id = ?", (next_run, set_id))
+        conn.commit()
+        conn.close()
+    
+    def get_due_tracked_sets(self) -> List[Dict[str, Any]]:
+        """
+        Получение наборов запросов, время перезапуска которых наступило
+        
+        Returns:
+            Список наборов с полями id, email, interval_hours, rows
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        
+        cur.execute(
+            "SELECT id, email, interval_hours, rows_json FROM tracked_sets WHERE next_run_utc <= ? ORDER BY next_run_utc",
+            (now,)
+        )
+        due = [
+            {"id": set_id, "email": email, "interval_hours": interval_hours, "rows": json.loads(rows_json)}
+            for set_id, email, interval_hours, rows_json in cur.fetchall()
+        ]
+        
+        conn.close()
+        return due
+    
+    def record_tracking_run(self, set_id: int, interval_hours: float, points: List[Dict[str, Any]]) -> None:
+        """
+        Запись результатов прогона набора во временной ряд и недельные агрегаты
+        
+        Агрегаты набора за неделю пересчитываются по его точкам, поэтому
+        повторная запись точки не учитывается дважды, а результаты разных
+        наборов не смешиваются.
+        
+        Args:
+            set_id: Идентификатор набора
+            interval_hours: Интервал до следующего запуска
+            points: Точки с ключами domain, prompt, country, aiv_score, best_rank, mentions, total_sources
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        # Набор удален во время прогона: точки без набора не записываем
+        if cur.execute("SELECT 1 FROM tracked_sets WHERE id = ?", (set_id,)).fetchone() is None:
+            conn.close()
+            return
+        
+        now_dt = datetime.utcnow()
+        now = now_dt.isoformat(timespec="seconds") + "Z"
+        next_run = (now_dt + timedelta(hours=interval_hours)).isoformat(timespec="seconds") + "Z"
+        week_start_dt = (now_dt - timedelta(days=now_dt.weekday())).date()
+        week_start = week_start_dt.isoformat()
+        week_end = (week_start_dt + timedelta(days=7)).isoformat()
+        
+        for point in points:
+            cur.execute(
+                "INSERT OR REPLACE INTO visibility_points VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    point["domain"], point["prompt"], point["country"], now, set_id,
+                    point["aiv_score"], point["best_rank"], point["mentions"], point["total_sources"]
+                )
+            )
+        cur.execute(
+            """
+            INSERT OR REPLACE INTO visibility_weekly
+            SELECT set_id, domain, country, ?, COUNT(*), SUM(aiv_score), SUM(mentions > 0)
+            FROM visibility_points
+            WHERE set_id = ? AND ts >= ? AND ts < ?
+            GROUP BY domain, country
+            """,
+            (week_start, set_id, week_start, week_end)
+        )
+        
+        cur.execute(
+            "UPDATE tracked_sets SET last_run_utc = ?, next_run_utc = ? WHERE id = ?",
+            (now, next_run, set_id)
+        )
+        
+        conn.commit()
+        conn.close()
+    
+    def get_weekly_trend(self, set_id: int, domain: str, country: Optional[str] = None, weeks: int = 8) -> List[Dict[str, Any]]:
+        """
+        Недельная динамика AIV-Score домена в наборе по предрассчитанным агрегатам
+        
+        Изменение считается только к предыдущей календарной неделе: после
+        пропущенной недели delta равно None.
+        
+        Args:
+            set_id: Идентификатор набора
+            domain: Отслеживаемый домен
+            country: Страна (None - по всем странам)
+            weeks: Количество последних недель
+        
+        Returns:
+            Список недель (от старой к новой) со средним скором и изменением к прошлой неделе
+        """
+        conn = self.connect()
+        cur = conn.cursor()
+        
+        query = """
+            SELECT week_start, SUM(points), SUM(score_sum), SUM(visible_points)
+            FROM visibility_weekly WHERE set_id = ? AND domain = ?
+        """
+        params: list = [set_id, domain.lower()]
+        if country:
+            query += " AND country = ?"
+            params.append(country)
+        query += " GROUP BY week_start ORDER BY week_start DESC LIMIT ?"
+        params.append(weeks + 1)  # +1 неделя для расчета изменения у самой старой
+        
+        cur.execute(query, params)
+        rows = list(reversed(cur.fetchall()))
+        conn.close()
+        
+        trend = []
+        previous = None
+        for week_start, points, score_sum, visible_points in rows:
+            avg_score = round(score_sum / points, 1) if points else 0.0
+            week_before = (datetime.fromisoformat(week_start) - timedelta(days=7)).date().isoformat()
+            trend.append({
+                "week_start": week_start,
+                "points": points,
+                "avg_aiv_score": avg_score,
+                "visibility_rate": round(visible_points / points, 3) if points else 0.0,
+                "delta": round(avg_score - previous[1], 1) if previous and previous[0] == week_before else None
+            })
+            previous = (week_start, avg_score)
+        
+        return trend[-weeks:]
+    
     def get_stats(self) -> Tuple[int, int]:
         """
         Получение статистики
@@ -21,7 +21,15 @@ class EmailService:
         self.smtp_from = SMTP_FROM
         self.smtp_tls = SMTP_TLS
     
-    def send_report_email(self, recipient_email: str, csv_content: bytes, queries_count: int) -> bool:
+    def send_report_email(
+        self,
+        recipient_email: str,
+        csv_content: bytes,
+        queries_count: int,
+        summary_text: str = "",
+        summary_csv: Optional[bytes] = None,
+        notice: str = ""
+    ) -> bool:
         """
         Отправка email с отчетом
         
@@ -29,6 +37,9 @@ class EmailService:
             recipient_email: Email получателя
             csv_content: Содержимое CSV файла в байтах
             queries_count: Количество обработанных запросов
+            summary_text: Краткая сводка для начала письма
+            summary_csv: Лист сводки по доменам, странам и конкурентам
+            notice: Пояснение для неполного отчета вместо строки об успешном завершении
             
         Returns:
             True если отправлено успешно, False иначе
@@ -41,11 +52,13 @@ class EmailService:
             msg['Subject'] = f"AI Visibility Analysis Report - {queries_count} queries processed"
             
             # Текст сообщения
+            summary_block = f"\n            Results at a glance:\n{self._indent(summary_text)}\n" if summary_text else ""
+            status_line = notice or "Your AI Visibility analysis has been completed successfully."
             body = f"""
             Hello!
             
-            Your AI Visibility analysis has been completed successfully.
-            
+            {status_line}
+            {summary_block}
             Analysis Summary:
             - Total queries processed: {queries_count}
             - Analysis includes AIV-Score, competitor analysis, and geo-targeting results
@@ -76,6 +89,16 @@ class EmailService:
             )
             msg.attach(attachment)
             
+            if summary_csv is not None:
+                summary_attachment = MIMEBase('application', 'octet-stream')
+                summary_attachment.set_payload(summary_csv)
+                encoders.encode_base64(summary_attachment)
+                summary_attachment.add_header(
+                    'Content-Disposition',
+                    f'attachment; filename="ai_visibility_summary_{queries_count}_queries.csv"'
+                )
+                msg.attach(summary_attachment)
+            
             # Отправка email
             with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
                 if self.smtp_tls:
@@ -92,6 +115,11 @@ class EmailService:
             print(f"❌ Ошибка отправки email: {e}")
             return False
     
+    @staticmethod
+    def _indent(text: str) -> str:
+        """Отступ строк сводки под текст письма"""
+        return "\n".join(f"            {line}" for line in text.splitlines())
+    
     def test_connection(self) -> bool:
         """
         Тестирование подключения к SMTP серверу
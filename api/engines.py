@@ -0,0 +1,179 @@
+"""
+Поисковые движки: единый интерфейс для OpenAI и других источников ответов
+"""
+
+import hashlib
+import time
+from typing import Any, Dict, List, Optional
+
+from api.config import SEARCH_ENGINES, OPENAI_FAST_MODEL, TIER_MIN_SOURCES, MODEL_PRICES, WEB_SEARCH_CALL_USD
+from api.openai_client import openai_client
+from api.singleflight import SingleFlight
+
+# Общий для всех задач слой объединения одинаковых запросов к OpenAI
+openai_flight = SingleFlight()
+
+def estimate_cost(model: str, usage: Any) -> float:
+    """
+    Оценка стоимости одного запроса с веб-поиском в USD по MODEL_PRICES
+    
+    Args:
+        model: Модель (версия с датой сопоставляется с самым длинным префиксом)
+        usage: usage из ответа (объект SDK или словарь) или None
+    """
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        matches = [name for name in MODEL_PRICES if model.startswith(name)]
+        prices = MODEL_PRICES[max(matches, key=len)] if matches else (0.0, 0.0)
+    field = openai_client._field
+    input_tokens = (field(usage, "input_tokens") or 0) if usage is not None else 0
+    output_tokens = (field(usage, "output_tokens") or 0) if usage is not None else 0
+    return (input_tokens * prices[0] + output_tokens * prices[-1]) / 1_000_000 + WEB_SEARCH_CALL_USD
+
+class SearchEngine:
+    """Базовый класс поискового движка"""
+    
+    name = "base"
+    
+    def search(self, query: str, country: str = "", timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Выполнение запроса
+        
+        Args:
+            query: Поисковый запрос
+            country: Страна запроса
+            timeout: Максимальное время запроса в секундах
+        
+        Returns:
+            Dict с ключами sources, usage, query (и error при ошибке)
+        """
+        raise NotImplementedError
+
+class OpenAIEngine(SearchEngine):
+    """Движок на базе OpenAI Responses API с веб-поиском"""
+    
+    def __init__(self, model: str = ""):
+        self.model = model or openai_client.model
+        self.name = f"openai:{self.model}"
+    
+    def search(self, query: str, country: str = "", timeout: Optional[float] = None) -> Dict[str, Any]:
+        # Одновременные одинаковые запросы из разных задач делят один вызов API
+        started = time.monotonic()
+        
+        def call(call_timeout: Optional[float]) -> Dict[str, Any]:
+            return openai_client.search_with_web(query, model=self.model, country=country, timeout=call_timeout)
+        
+        try:
+            # Чужой вызов ждем не дольше собственного срока
+            result, shared = openai_flight.do_shared((self.model, query, country), lambda: call(timeout), timeout=timeout)
+        except TimeoutError as e:
+            result, shared = {"sources": [], "usage": None, "query": query, "error": str(e)}, False
+        if shared and "error" in result:
+            # Ошибка чужого вызова могла быть вызвана его более коротким сроком задачи
+            # или отменой - повторяем запрос один раз со своим сроком
+            remaining = None if timeout is None else timeout - (time.monotonic() - started)
+            if remaining is None or remaining > 0:
+                result, shared = call(remaining), False
+        result = dict(result)
+        # Попытки по моделям - для метрик задержки и стоимости по уровням (см. TieredEngine).
+        # Объединенный вызов оплачивает только его владелец, иначе стоимость
+        # в метриках умножается на число ожидавших
+        charged = not shared and "error" not in result
+        result["tiers"] = [{
+            "model": self.model,
+            "seconds": time.monotonic() - started,
+            "cost": estimate_cost(self.model, result.get("usage")) if charged else 0.0
+        }]
+        return result
+
+class TieredEngine(SearchEngine):
+    """
+    Маршрутизация по уровням моделей: запрос сначала выполняет быстрая
+    модель, а тяжелая - только если ответ слабый (ошибка, меньше
+    TIER_MIN_SOURCES источников или ни одной цитаты в тексте ответа)
+    
+    Спецификация: "tiered" или "tiered:<быстрая>><тяжелая>",
+    по умолчанию OPENAI_FAST_MODEL и OPENAI_MODEL.
+    """
+    
+    def __init__(self, models: str = ""):
+        fast, _, heavy = models.partition(">")
+        self.fast = OpenAIEngine(fast.strip() or OPENAI_FAST_MODEL)
+        self.heavy = OpenAIEngine(heavy.strip())
+        self.name = f"tiered:{self.fast.model}>{self.heavy.model}"
+    
+    @staticmethod
+    def needs_escalation(result: Dict[str, Any]) -> bool:
+        """Слабый ответ быстрой модели, который нужно повторить на тяжелой"""
+        if "error" in result:
+            return True
+        sources = result["sources"]
+        if len(sources) < TIER_MIN_SOURCES:
+            return True
+        # Нет ни одной цитаты url_citation: модель не опиралась на найденные страницы
+        return not any(source.get("start_index") is not None for source in sources)
+    
+    def search(self, query: str, country: str = "", timeout: Optional[float] = None) -> Dict[str, Any]:
+        started = time.monotonic()
+        result = self.fast.search(query, country, timeout=timeout)
+        if not self.needs_escalation(result):
+            return result
+        
+        remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+        escalated = self.heavy.search(query, country, timeout=remaining)
+        tiers = result["tiers"] + escalated["tiers"]
+        if "error" in escalated and "error" not in result:
+            # Тяжелая модель не ответила: слабый ответ лучше пустого
+            return {**result, "tiers": tiers, "escalated": True}
+        return {**escalated, "tiers": tiers, "escalated": True}
+
+class StubEngine(SearchEngine):
+    """Локальный детерминированный движок для разработки и нагрузочных тестов"""
+    
+    STUB_DOMAINS = [
+        "amazon.com", "reddit.com", "wikipedia.org", "youtube.com",
+        "bestbuy.com", "which.co.uk", "ebay.com", "trustpilot.com"
+    ]
+    
+    def __init__(self, variant: str = ""):
+        self.variant = variant
+        self.name = f"stub:{variant}" if variant else "stub"
+    
+    def search(self, query: str, country: str = "", timeout: Optional[float] = None) -> Dict[str, Any]:
+        digest = hashlib.sha256(f"{self.variant}|{country}|{query}".encode("utf-8")).digest()
+        sources = [
+            {
+                "url": f"https://www.{self.STUB_DOMAINS[b % len(self.STUB_DOMAINS)]}/result-{i + 1}",
+                "title": f"Result {i + 1}",
+                "description": ""
+            }
+            for i, b in enumerate(digest[:3 + digest[-1] % 5])
+        ]
+        return {"sources": sources, "usage": None, "query": query}
+
+# Фабрики движков по префиксу спецификации
+ENGINE_FACTORIES = {
+    "openai": OpenAIEngine,
+    "tiered": TieredEngine,
+    "stub": StubEngine,
+}
+
+def build_engine(spec: str) -> SearchEngine:
+    """
+    Создание движка по спецификации вида "openai:gpt-4o" или "stub"
+    
+    Raises:
+        ValueError: Если тип движка неизвестен
+    """
+    kind, _, arg = spec.partition(":")
+    factory = ENGINE_FACTORIES.get(kind.strip().lower())
+    if factory is None:
+        raise ValueError(f"Неизвестный поисковый движок: {spec}")
+    return factory(arg.strip())
+
+def build_engines(specs: List[str]) -> List[SearchEngine]:
+    """Создание списка движков по спецификациям"""
+    return [build_engine(spec) for spec in specs]
+
+# Движки, настроенные для сервиса
+engines = build_engines(SEARCH_ENGINES)
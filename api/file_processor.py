@@ -1,12 +1,85 @@
 """
-Обработка файлов CSV/TSV/XLSX с поддержкой колонок Country, Prompt, Website
+Обработка файлов CSV/TSV/XLSX (в том числе сжатых .gz, .zst и .zip)
+с поддержкой колонок Country, Prompt, Website
 """
 
 import os
+import io
+import re
+import csv
+import gzip
+import zipfile
+import hashlib
 import pandas as pd
-from typing import Tuple
+from typing import BinaryIO, List, Optional, Tuple, Union
 from urllib.parse import urlparse
-from api.config import MAX_ROWS_PROCESS
+from api.config import (
+    MAX_ROWS_PROCESS, PREFLIGHT_ROWS, MAX_DECOMPRESSED_MB, MAX_COMPRESSION_RATIO
+)
+
+# Допустимые названия колонок (в нижнем регистре) для каждой обязательной колонки
+COLUMN_ALIASES = {
+    'Country': ('country', 'страна'),
+    'Prompt': ('prompt', 'query', 'запрос', 'запит'),
+    'Website': ('website', 'domain', 'домен', 'сайт'),
+    # Необязательная колонка: дополнительные домены (конкуренты) для той же строки
+    'Tracked': ('tracked', 'tracked domains', 'competitors', 'конкуренты', 'конкуренти'),
+}
+REQUIRED_COLUMNS = ['Country', 'Prompt', 'Website']
+
+# Разделители нескольких доменов в одной ячейке Website/Tracked
+DOMAIN_SEPARATORS = re.compile(r"[\s,;|]+")
+
+# Первые байты CSV/TSV, которых достаточно для заголовка и нескольких строк
+PREFLIGHT_CHUNK_BYTES = 64 * 1024
+
+# Строк CSV/TSV в одной порции чтения
+READ_CHUNK_ROWS = 10000
+
+# Поддерживаемые форматы и сжатие (расширение сжатия -> способ)
+DATA_EXTENSIONS = (".csv", ".tsv", ".xlsx")
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd", ".zip": "zip"}
+
+# Степень сжатия проверяется после этого объема: маленькие файлы сжимаются сильно и без умысла
+COMPRESSION_RATIO_MIN_BYTES = 1024 * 1024
+
+class _LimitedStream(io.RawIOBase):
+    """
+    Поток распаковки с защитой от zip-бомб: ограничение распакованного
+    размера и степени сжатия проверяются по мере чтения
+    """
+    
+    def __init__(self, raw: BinaryIO, compressed_size: int, max_bytes: int, max_ratio: float, source: Optional[BinaryIO] = None):
+        self._raw = raw
+        self._source = source  # Сжатый файл: GzipFile и ZipFile его не закрывают
+        self._compressed_size = max(1, compressed_size)
+        self._max_bytes = max_bytes
+        self._max_ratio = max_ratio
+        self.bytes_read = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, buffer) -> int:
+        try:
+            data = self._raw.read(len(buffer))
+        except Exception as e:
+            # Поврежденный архив: ошибки gzip/zlib/zstd приводим к ошибке формата файла
+            raise ValueError(f"Не вдалося розпакувати файл: {e}")
+        self.bytes_read += len(data)
+        if self.bytes_read > self._max_bytes:
+            raise ValueError(f"Розпакований файл перевищує {self._max_bytes // (1024 * 1024)}МБ")
+        if (self.bytes_read > COMPRESSION_RATIO_MIN_BYTES
+                and self.bytes_read / self._compressed_size > self._max_ratio):
+            raise ValueError("Підозріло високий ступінь стиснення файлу")
+        buffer[:len(data)] = data
+        return len(data)
+    
+    def close(self) -> None:
+        self._raw.close()
+        if self._source is not None:
+            self._source.close()
+        super().close()
 
 class FileProcessor:
     """Класс для обработки загруженных файлов"""
@@ -36,12 +109,147 @@ class FileProcessor:
             return ""
     
     @staticmethod
-    def process_file(file_path: str) -> Tuple[pd.DataFrame, int]:
+    def parse_domains(*values: str) -> List[str]:
+        """
+        Домены из ячеек Website и Tracked без повторов
+        
+        Args:
+            values: Ячейки с одним или несколькими доменами/URL через запятую, ';', '|' или пробел
+        
+        Returns:
+            Домены в порядке появления (первый - основной домен строки)
+        """
+        domains: List[str] = []
+        for value in values:
+            for part in DOMAIN_SEPARATORS.split(value or ""):
+                domain = FileProcessor.extract_domain_from_url(part)
+                if domain and domain not in domains:
+                    domains.append(domain)
+        return domains
+    
+    @staticmethod
+    def normalize_column_name(column: str) -> Optional[str]:
+        """Стандартное имя колонки (Country, Prompt, Website) или None"""
+        lower_col = str(column).strip().lower()
+        for name, aliases in COLUMN_ALIASES.items():
+            if lower_col in aliases:
+                return name
+        return None
+    
+    @staticmethod
+    def check_required_columns(columns) -> None:
+        """
+        Проверка наличия обязательных колонок после нормализации
+        
+        Raises:
+            ValueError: Если отсутствуют обязательные колонки
+        """
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+        if missing_columns:
+            raise ValueError(f"В файле отсутствуют обязательные колонки: {', '.join(missing_columns)}")
+    
+    @staticmethod
+    def read_preview(content: bytes, file_extension: str, max_rows: int = PREFLIGHT_ROWS) -> Tuple[List[str], List[list]]:
+        """
+        Чтение заголовка и первых строк без загрузки всего файла
+        
+        Args:
+            content: Содержимое файла в байтах
+            file_extension: Расширение файла
+            max_rows: Сколько строк данных прочитать после заголовка
+        
+        Returns:
+            Tuple[заголовок, первые строки данных]
+        
+        Raises:
+            ValueError: Если формат не поддерживается или файл не читается
+        """
+        if file_extension in (".csv", ".tsv"):
+            # Обрезанный по границе байтов хвост может содержать неполный символ
+            text = content[:PREFLIGHT_CHUNK_BYTES].decode("utf-8-sig", errors="ignore")
+            lines = text.splitlines()
+            if len(content) > PREFLIGHT_CHUNK_BYTES:
+                lines = lines[:-1]  # Последняя строка может быть обрезана
+            reader = csv.reader(lines[:max_rows + 1], delimiter="\t" if file_extension == ".tsv" else ",")
+            preview = list(reader)
+        elif file_extension == ".xlsx":
+            from openpyxl import load_workbook
+            try:
+                # read_only - потоковое чтение листа без построения всей книги в памяти
+                workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+            except Exception:
+                raise ValueError("Не вдалося прочитати XLSX файл")
+            try:
+                sheet = workbook.active
+                preview = [
+                    ["" if value is None else str(value) for value in row]
+                    for row in sheet.iter_rows(max_row=max_rows + 1, values_only=True)
+                ]
+            finally:
+                workbook.close()
+        else:
+            raise ValueError(f"Неподдерживаемый формат файла: {file_extension}")
+        
+        if not preview:
+            return [], []
+        return preview[0], preview[1:]
+    
+    @staticmethod
+    def preflight(content: bytes, file_extension: str) -> None:
+        """
+        Быстрая проверка файла при загрузке: обязательные колонки и хотя бы одна
+        заполненная строка среди первых PREFLIGHT_ROWS
+        
+        Args:
+            content: Содержимое файла в байтах
+            file_extension: Расширение файла
+        
+        Raises:
+            ValueError: Если файл не пройдет обработку
+        """
+        data_extension, compression = FileProcessor.split_compression(file_extension)
+        if compression is not None:
+            # Для сжатого файла читаем только начало распакованного потока (XLSX - целиком)
+            stream, data_extension = FileProcessor.open_stream(content, file_extension)
+            with stream:
+                content = stream.read() if data_extension == ".xlsx" else stream.read(PREFLIGHT_CHUNK_BYTES + 1)
+        header, rows = FileProcessor.read_preview(content, data_extension)
+        columns = [FileProcessor.normalize_column_name(col) for col in header]
+        FileProcessor.check_required_columns(columns)
+        
+        positions = [columns.index(name) for name in REQUIRED_COLUMNS]
+        for row in rows:
+            values = [row[i].strip() if i < len(row) and row[i] else "" for i in positions]
+            if all(values):
+                return
+        raise ValueError("У перших рядках файлу немає заповнених значень Country, Prompt, Website")
+    
+    @staticmethod
+    def compute_row_hash(country: str, prompt: str) -> str:
+        """
+        Хеш содержимого строки, влияющего на ответ поиска
+        
+        Website в хеш не входит: метрики по домену пересчитываются из
+        сохраненных источников, поэтому правка домена не требует нового запроса.
+        
+        Args:
+            country: Страна запроса
+            prompt: Текст запроса
+        
+        Returns:
+            SHA-256 хеш нормализованной строки
+        """
+        normalized = f"{country.strip().lower()}\x1f{' '.join(prompt.split()).lower()}"
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def process_file(file_path: str, max_rows: Optional[int] = MAX_ROWS_PROCESS) -> Tuple[pd.DataFrame, int]:
         """
         Обработка файла и извлечение данных
         
         Args:
             file_path: Путь к файлу
+            max_rows: Ограничение количества строк (None - без ограничения)
             
         Returns:
             Tuple[DataFrame с данными, количество обработанных строк]
@@ -49,39 +257,84 @@ class FileProcessor:
         Raises:
             ValueError: Если файл неподдерживаемого формата или отсутствуют обязательные колонки
         """
-        ext = os.path.splitext(file_path.lower())[1]
-        
-        # Чтение файла в зависимости от расширения
-        if ext == ".csv":
-            df = pd.read_csv(file_path)
-        elif ext == ".tsv":
-            df = pd.read_csv(file_path, sep="\t")
-        elif ext == ".xlsx":
-            df = pd.read_excel(file_path)
-        else:
+        ext = FileProcessor.get_file_extension(file_path)
+        if ext not in DATA_EXTENSIONS and FileProcessor.split_compression(ext)[1] is None:
             raise ValueError(f"Неподдерживаемый формат файла: {ext}")
         
+        # Сжатые файлы распаковываются потоком прямо в разбор
+        stream, ext = FileProcessor.open_stream(file_path, ext)
+        with stream:
+            # Чтение файла в зависимости от расширения
+            if ext in (".csv", ".tsv"):
+                return FileProcessor.read_delimited(stream, "\t" if ext == ".tsv" else ",", max_rows)
+            df = pd.read_excel(stream if stream.seekable() else io.BytesIO(stream.read()))
+        
+        return FileProcessor.normalize_dataframe(df, max_rows)
+    
+    @staticmethod
+    def read_delimited(stream: BinaryIO, sep: str, max_rows: Optional[int] = MAX_ROWS_PROCESS) -> Tuple[pd.DataFrame, int]:
+        """
+        Чтение CSV/TSV порциями по READ_CHUNK_ROWS строк
+        
+        Каждая порция нормализуется сразу; чтение останавливается, как только
+        набрано max_rows строк, поэтому остаток большого файла не разбирается
+        (и не распаковывается).
+        
+        Returns:
+            Tuple[DataFrame с данными, количество обработанных строк]
+        
+        Raises:
+            ValueError: Если в файле нет ни одной строки с данными
+        """
+        chunks = []
+        rows_count = 0
+        try:
+            # dtype=str: типы не угадываются отдельно для каждой порции
+            for chunk in pd.read_csv(stream, sep=sep, dtype=str, chunksize=READ_CHUNK_ROWS):
+                normalized, count = FileProcessor.normalize_dataframe(chunk, max_rows=None)
+                chunks.append(normalized)
+                rows_count += count
+                if max_rows is not None and rows_count >= max_rows:
+                    break
+        except pd.errors.EmptyDataError:
+            raise ValueError("Файл пустий")
+        
+        # Только заголовок или ни одной заполненной строки
+        if not rows_count:
+            raise ValueError("Файл пустий: немає рядків з даними")
+        df = pd.concat(chunks, ignore_index=True)
+        if max_rows is not None:
+            df = df.head(max_rows)
+        return df, len(df)
+    
+    @staticmethod
+    def normalize_dataframe(df: pd.DataFrame, max_rows: Optional[int] = MAX_ROWS_PROCESS) -> Tuple[pd.DataFrame, int]:
+        """
+        Нормализация колонок и значений: общая часть для файлов и JSON запросов
+        
+        Args:
+            df: Исходные данные
+            max_rows: Ограничение количества строк (None - без ограничения)
+        
+        Returns:
+            Tuple[DataFrame с данными, количество обработанных строк]
+        
+        Raises:
+            ValueError: Если отсутствуют обязательные колонки
+        """
         # Нормализация названий колонок (приведение к нижнему регистру для поиска)
-        df.columns = df.columns.str.strip()
+        df.columns = df.columns.astype(str).str.strip()
         column_mapping = {}
         for col in df.columns:
-            lower_col = col.lower()
-            if lower_col in ['country', 'страна']:
-                column_mapping[col] = 'Country'
-            elif lower_col in ['prompt', 'query', 'запрос', 'запит']:
-                column_mapping[col] = 'Prompt'
-            elif lower_col in ['website', 'domain', 'домен', 'сайт']:
-                column_mapping[col] = 'Website'
+            normalized = FileProcessor.normalize_column_name(col)
+            if normalized:
+                column_mapping[col] = normalized
         
         # Переименование колонок
         df = df.rename(columns=column_mapping)
         
         # Проверка наличия обязательных колонок
-        required_columns = ['Country', 'Prompt', 'Website']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            raise ValueError(f"В файле отсутствуют обязательные колонки: {', '.join(missing_columns)}")
+        FileProcessor.check_required_columns(df.columns)
         
         # Очистка и нормализация данных
         df['Country'] = df['Country'].astype(str).str.strip()
@@ -95,19 +348,42 @@ class FileProcessor:
             (df['Website'] != '')
         ].reset_index(drop=True)
         
-        # Нормализация доменов (извлечение домена из URL если указан полный URL)
-        df['target_domain'] = df['Website'].apply(FileProcessor.extract_domain_from_url)
+        # Нормализация доменов (извлечение домена из URL если указан полный URL).
+        # Строка может отслеживать несколько доменов: все они считаются по одному запросу
+        tracked = df['Tracked'].fillna('').astype(str) if 'Tracked' in df.columns else [''] * len(df)
+        domains = [FileProcessor.parse_domains(website, extra) for website, extra in zip(df['Website'], tracked)]
+        df['target_domain'] = [row_domains[0] if row_domains else '' for row_domains in domains]
+        df['tracked_domains'] = [','.join(row_domains) for row_domains in domains]
         
         # Удаление строк где не удалось извлечь домен
         df = df[df['target_domain'] != ''].reset_index(drop=True)
         
         # Ограничение на количество строк (жесткий лимит MVP)
         original_count = len(df)
-        df = df.head(MAX_ROWS_PROCESS)
+        if max_rows is not None:
+            df = df.head(max_rows)
         processed_count = len(df)
         
         return df, processed_count
     
+    @staticmethod
+    def estimate_rows(content: bytes, file_extension: str) -> int:
+        """
+        Быстрая оценка количества строк без разбора файла
+        
+        Args:
+            content: Содержимое файла в байтах
+            file_extension: Расширение файла
+        
+        Returns:
+            Оценка количества строк данных с учетом лимита MAX_ROWS_PROCESS
+        """
+        if file_extension in (".csv", ".tsv"):
+            lines = content.count(b"\n") + (0 if content.endswith(b"\n") else 1)
+            return max(1, min(lines - 1, MAX_ROWS_PROCESS))
+        # Для XLSX и сжатых файлов без разбора оцениваем по верхней границе
+        return MAX_ROWS_PROCESS
+    
     @staticmethod
     def validate_file_size(content: bytes, max_size_mb: int) -> None:
         """
@@ -126,7 +402,97 @@ class FileProcessor:
     
     @staticmethod
     def get_file_extension(filename: str) -> str:
-        """Получение расширения файла"""
+        """
+        Получение расширения файла
+        
+        Для сжатых файлов возвращается составное расширение (".csv.gz", ".tsv.zst");
+        у архива .zip формат определяется по файлу внутри.
+        """
         if not filename:
             return ".csv"  # Дефолтное расширение
-        return os.path.splitext(filename.lower())[1] or ".csv"
\ No newline at end of file
+        root, ext = os.path.splitext(filename.lower())
+        if ext in COMPRESSION_EXTENSIONS and ext != ".zip":
+            inner_ext = os.path.splitext(root)[1]
+            if inner_ext in DATA_EXTENSIONS:
+                return inner_ext + ext
+        return ext or ".csv"
+    
+    @staticmethod
+    def split_compression(file_extension: str) -> Tuple[str, Optional[str]]:
+        """
+        Разделение расширения на формат данных и способ сжатия
+        
+        Returns:
+            Tuple[формат (".csv" по умолчанию для .gz/.zst без формата), способ сжатия или None]
+        """
+        # splitext(".gz") считает расширение именем скрытого файла
+        root, ext = ("", file_extension) if file_extension in COMPRESSION_EXTENSIONS else os.path.splitext(file_extension)
+        compression = COMPRESSION_EXTENSIONS.get(ext)
+        if compression is None:
+            return file_extension, None
+        return root or ".csv", compression
+    
+    @staticmethod
+    def open_stream(source: Union[str, bytes], file_extension: str) -> Tuple[BinaryIO, str]:
+        """
+        Открытие файла как потока распакованных данных
+        
+        Args:
+            source: Путь к файлу или его содержимое
+            file_extension: Расширение (см. get_file_extension)
+        
+        Returns:
+            Tuple[поток данных, формат данных (.csv, .tsv или .xlsx)]
+        
+        Raises:
+            ValueError: Если формат не поддерживается или архив некорректный
+        """
+        data_extension, compression = FileProcessor.split_compression(file_extension)
+        raw: BinaryIO = io.BytesIO(source) if isinstance(source, bytes) else open(source, "rb")
+        if compression is None:
+            return raw, data_extension
+        
+        compressed_size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        try:
+            if compression == "gzip":
+                stream = gzip.GzipFile(fileobj=raw, mode="rb")
+            elif compression == "zstd":
+                try:
+                    import zstandard
+                except ImportError:
+                    raise ValueError("Формат .zst не підтримується на цьому сервері")
+                stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+            else:
+                stream, data_extension = FileProcessor._open_zip_member(raw)
+        except (OSError, zipfile.BadZipFile) as e:
+            raw.close()
+            raise ValueError(f"Не вдалося розпакувати файл: {e}")
+        except ValueError:
+            raw.close()
+            raise
+        
+        if data_extension not in DATA_EXTENSIONS:
+            stream.close()
+            raise ValueError(f"Неподдерживаемый формат файла: {data_extension}")
+        limited = _LimitedStream(stream, compressed_size, MAX_DECOMPRESSED_MB * 1024 * 1024, MAX_COMPRESSION_RATIO, source=raw)
+        return io.BufferedReader(limited, buffer_size=PREFLIGHT_CHUNK_BYTES), data_extension
+    
+    @staticmethod
+    def _open_zip_member(raw: BinaryIO) -> Tuple[BinaryIO, str]:
+        """
+        Единственный файл данных в архиве .zip
+        
+        Raises:
+            ValueError: Если в архиве не один файл данных
+        """
+        archive = zipfile.ZipFile(raw)
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+        ]
+        if len(members) != 1:
+            raise ValueError("Архів .zip має містити рівно один файл")
+        member = members[0]
+        if member.file_size > MAX_DECOMPRESSED_MB * 1024 * 1024:
+            raise ValueError(f"Розпакований файл перевищує {MAX_DECOMPRESSED_MB}МБ")
+        return archive.open(member), os.path.splitext(member.filename.lower())[1]
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""
+Геотаргетинг: приведение значений колонки Country к ISO 3166-1 alpha-2
+"""
+
+from typing import Optional
+
+# Распространенные написания стран в загружаемых файлах
+COUNTRY_CODES = {
+    "uk": "GB", "united kingdom": "GB", "great britain": "GB", "england": "GB", "britain": "GB",
+    "usa": "US", "us": "US", "united states": "US", "united states of america": "US", "america": "US",
+    "germany": "DE", "deutschland": "DE", "германия": "DE", "німеччина": "DE",
+    "france": "FR", "франция": "FR", "франція": "FR",
+    "spain": "ES", "españa": "ES", "испания": "ES", "іспанія": "ES",
+    "italy": "IT", "italia": "IT", "италия": "IT", "італія": "IT",
+    "poland": "PL", "polska": "PL", "польша": "PL", "польща": "PL",
+    "ukraine": "UA", "украина": "UA", "україна": "UA",
+    "netherlands": "NL", "holland": "NL", "nederland": "NL",
+    "austria": "AT", "österreich": "AT",
+    "switzerland": "CH", "schweiz": "CH",
+    "belgium": "BE", "sweden": "SE", "norway": "NO", "denmark": "DK", "finland": "FI",
+    "portugal": "PT", "czech republic": "CZ", "czechia": "CZ", "ireland": "IE",
+    "canada": "CA", "australia": "AU", "new zealand": "NZ", "india": "IN",
+    "japan": "JP", "brazil": "BR", "mexico": "MX", "turkey": "TR", "türkiye": "TR",
+}
+
+def country_to_iso(country: str) -> Optional[str]:
+    """
+    Приведение страны к двухбуквенному ISO коду
+    
+    Args:
+        country: Значение колонки Country (название или код)
+    
+    Returns:
+        ISO код страны или None, если страну не удалось определить
+    """
+    if not country or not isinstance(country, str):
+        return None
+    
+    value = country.strip().lower()
+    if value in COUNTRY_CODES:
+        return COUNTRY_CODES[value]
+    
+    # Уже указан двухбуквенный код
+    if len(value) == 2 and value.isalpha():
+        return value.upper()
+    
+    return None
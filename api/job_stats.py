@@ -0,0 +1,103 @@
+"""
+Сбор метрик выполнения задачи (задержки и счетчики по меткам)
+"""
+
+import threading
+from collections import defaultdict, deque
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from api.config import SERVICE_STATS_MAX_SAMPLES
+
+class JobStats:
+    """
+    Потокобезопасный сборщик задержек и счетчиков одной задачи
+    
+    С max_samples хранятся только последние max_samples задержек каждой
+    метки (скользящее окно для метрик всего сервиса).
+    """
+    
+    def __init__(self, max_samples: Optional[int] = None):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(partial(deque, maxlen=max_samples) if max_samples else list)
+        self.counters: Dict[str, float] = defaultdict(float)
+    
+    def record_latency(self, label: str, seconds: float) -> None:
+        """Запись задержки по метке"""
+        with self._lock:
+            self.latencies[label].append(seconds)
+    
+    def increment(self, label: str, value: float = 1) -> None:
+        """Увеличение счетчика по метке"""
+        with self._lock:
+            self.counters[label] += value
+    
+    def count(self, prefix: str = "") -> int:
+        """Количество записанных задержек по меткам с указанным префиксом"""
+        with self._lock:
+            return sum(len(values) for label, values in self.latencies.items() if label.startswith(prefix))
+    
+    def tiers(self) -> Dict[str, Any]:
+        """
+        Маршрутизация по уровням моделей: запросы, эскалации на тяжелую модель,
+        стоимость (USD) и задержка по моделям
+        """
+        with self._lock:
+            requests = int(self.counters.get("requests", 0))
+            escalated = int(self.counters.get("escalated", 0))
+        cost = self.counter_values("cost_usd:")
+        return {
+            "requests": requests,
+            "escalated": escalated,
+            "escalation_rate": round(escalated / requests, 3) if requests else 0.0,
+            "cost_usd": {model: round(value, 4) for model, value in cost.items()},
+            "cost_usd_total": round(sum(cost.values()), 4),
+            "latency": self.summary("tier:"),
+        }
+    
+    def counter_values(self, prefix: str) -> Dict[str, float]:
+        """Счетчики с префиксом prefix, ключ - остаток метки (например, страна)"""
+        with self._lock:
+            return {
+                label[len(prefix):]: value
+                for label, value in sorted(self.counters.items())
+                if label.startswith(prefix)
+            }
+    
+    def summary(self, prefix: str = "") -> Dict[str, Dict[str, float]]:
+        """
+        Сводка по задержкам
+        
+        Args:
+            prefix: Только метки с этим префиксом (например, "country:")
+        
+        Returns:
+            Метка без префикса -> {count, avg, p50, p95, max} в секундах
+        """
+        with self._lock:
+            result = {}
+            for label, values in sorted(self.latencies.items()):
+                if not label.startswith(prefix) or not values:
+                    continue
+                ordered = sorted(values)
+                p95_index = max(0, int(round(0.95 * len(ordered))) - 1)
+                result[label[len(prefix):]] = {
+                    "count": len(ordered),
+                    "avg": round(sum(ordered) / len(ordered), 3),
+                    "p50": round(ordered[(len(ordered) - 1) // 2], 3),
+                    "p95": round(ordered[p95_index], 3),
+                    "max": round(ordered[-1], 3)
+                }
+            return result
+    
+    def format(self) -> str:
+        """Текстовая сводка для логов"""
+        lines = [
+            f"{label}: n={s['count']} avg={s['avg']}s p50={s['p50']}s p95={s['p95']}s max={s['max']}s"
+            for label, s in self.summary().items()
+        ]
+        lines.extend(f"{label}: {value:g}" for label, value in sorted(self.counters.items()))
+        return "\n".join(lines)
+
+# Задержки и счетчики всех задач сервиса за последнее окно (для /metrics)
+service_stats = JobStats(max_samples=SERVICE_STATS_MAX_SAMPLES)
@@ -0,0 +1,159 @@
+"""
+Реестр задач обработки: сроки выполнения, отмена и остановка сервиса
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import Future, wait
+from typing import Dict, List, Optional
+
+from api.config import JOB_DEADLINE_SECONDS
+from api.job_stats import JobStats
+
+# Время на запись контрольных точек прерванных задач сверх срока остановки
+CHECKPOINT_WRITE_SECONDS = 5.0
+
+class JobCancelledError(Exception):
+    """Задача отменена или истек ее срок"""
+    
+    def __init__(self, reason: str):
+        super().__init__(f"Задача прервана: {reason}")
+        self.reason = reason
+
+class JobInterruptedError(JobCancelledError):
+    """
+    Задача прервана на середине; содержит уже полученные результаты строк
+    и запросы, которые в момент прерывания еще выполнялись
+    """
+    
+    def __init__(self, reason: str, completed: Dict[str, list], in_flight: Optional[Dict[str, Future]] = None):
+        super().__init__(reason)
+        self.completed = completed
+        self.in_flight = in_flight or {}
+    
+    def collect_in_flight(self, timeout: Optional[float] = None) -> int:
+        """
+        Ожидание выполняющихся запросов и добавление их результатов в completed
+        
+        Args:
+            timeout: Сколько ждать, секунд (None - до завершения всех)
+        
+        Returns:
+            Количество добавленных результатов
+        """
+        if not self.in_flight:
+            return 0
+        done, _ = wait(list(self.in_flight.values()), timeout=timeout)
+        added = 0
+        for key, future in list(self.in_flight.items()):
+            if future not in done:
+                continue
+            del self.in_flight[key]
+            # Ответ с ошибкой после отмены задачи завершается JobCancelledError
+            if future.cancelled() or future.exception() is not None or 'error' in future.result():
+                continue
+            self.completed[key] = future.result()['sources']
+            added += 1
+        return added
+
+class Job:
+    """Одна задача обработки файла"""
+    
+    def __init__(self, email: str, client_ip: str, file_hash: str, deadline_seconds: float = JOB_DEADLINE_SECONDS, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.email = email
+        self.client_ip = client_ip
+        self.file_hash = file_hash
+        self.deadline = time.monotonic() + deadline_seconds
+        self.stats = JobStats()
+        # До какого момента прерванная задача может ждать запросы в работе (см. JobRegistry.drain)
+        self.in_flight_deadline = 0.0
+        self.cancel_reason: Optional[str] = None
+        self._cancelled = threading.Event()
+        self.done = threading.Event()
+    
+    def cancel(self, reason: str = "cancelled") -> None:
+        """Отмена задачи (первая причина сохраняется)"""
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+        self._cancelled.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        if not self._cancelled.is_set() and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+        return self._cancelled.is_set()
+    
+    def remaining(self) -> float:
+        """Секунд до истечения срока задачи"""
+        return max(0.0, self.deadline - time.monotonic())
+    
+    def in_flight_remaining(self) -> float:
+        """Секунд, которые прерванная задача еще может ждать запросы в работе"""
+        return max(0.0, self.in_flight_deadline - time.monotonic())
+    
+    def check(self) -> None:
+        """
+        Проверка, что задачу можно продолжать
+        
+        Raises:
+            JobCancelledError: Если задача отменена или срок истек
+        """
+        if self.cancelled:
+            raise JobCancelledError(self.cancel_reason)
+
+class JobRegistry:
+    """Задачи в работе и прием новых задач"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self.accepting = True
+    
+    def register(self, job: Job) -> Job:
+        """Регистрация задачи в работе"""
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+    
+    def finish(self, job: Job) -> None:
+        """Снятие задачи с учета после завершения worker"""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        job.done.set()
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def active(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+    
+    def drain(self, grace_seconds: float) -> None:
+        """
+        Остановка сервиса: прекращаем прием и первую половину grace_seconds
+        ждем завершения задач. Оставшиеся прерываются: не начатые запросы
+        снимаются из очереди, контрольная точка пишется сразу, а вторую
+        половину задачи дожидаются уже отправленных запросов и дополняют ее.
+        
+        Args:
+            grace_seconds: Время на завершение задач в работе
+        """
+        self.accepting = False
+        started = time.monotonic()
+        deadline = started + grace_seconds
+        for job in self.active():
+            job.done.wait(max(0.0, started + grace_seconds / 2 - time.monotonic()))
+        
+        remaining = self.active()
+        for job in remaining:
+            job.in_flight_deadline = deadline
+            job.cancel("shutdown")
+        # Сверх срока - только на запись контрольных точек
+        for job in remaining:
+            job.done.wait(max(0.0, deadline - time.monotonic()) + CHECKPOINT_WRITE_SECONDS)
+
+# Глобальный реестр задач
+job_registry = JobRegistry()
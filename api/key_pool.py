@@ -0,0 +1,228 @@
+"""
+Пул ключей OpenAI: состояние лимитов каждого ключа по заголовкам ответов
+и выбор ключа с наибольшим запасом
+"""
+
+import re
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+from api.config import OPENAI_KEY_CONCURRENCY, OPENAI_KEY_COOLDOWN_SECONDS
+
+# Длительность в заголовках x-ratelimit-reset-*: "20ms", "1s", "6m0s", "1h2m3.5s"
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# Пауза ключа, у которого закончилась квота (429 insufficient_quota), а не лимит частоты
+QUOTA_COOLDOWN_SECONDS = 600.0
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Длительность из заголовка лимитов в секундах или None"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+class ApiKey:
+    """
+    Ключ OpenAI с собственным клиентом, слотами параллельности
+    и последним известным состоянием лимитов
+    """
+    
+    __slots__ = (
+        "api_key", "project", "client", "concurrency", "in_flight",
+        "limit_requests", "remaining_requests", "requests_reset_at",
+        "limit_tokens", "remaining_tokens", "tokens_reset_at",
+        "cooldown_until", "requests", "rate_limited"
+    )
+    
+    def __init__(self, api_key: str, project: Optional[str] = None, client: Any = None, concurrency: int = OPENAI_KEY_CONCURRENCY):
+        self.api_key = api_key
+        self.project = project
+        self.client = client
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.limit_requests: Optional[int] = None
+        self.remaining_requests: Optional[int] = None
+        self.requests_reset_at = 0.0
+        self.limit_tokens: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+        self.tokens_reset_at = 0.0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.rate_limited = 0
+    
+    @classmethod
+    def from_spec(cls, spec: str, **kwargs) -> "ApiKey":
+        """Ключ из записи OPENAI_API_KEYS ("sk-..." или "sk-...:proj_...")"""
+        api_key, _, project = spec.partition(":")
+        return cls(api_key.strip(), project.strip() or None, **kwargs)
+    
+    @property
+    def name(self) -> str:
+        """Имя для логов и метрик без раскрытия ключа"""
+        return f"...{self.api_key[-4:]}" + (f"/{self.project}" if self.project else "")
+    
+    def headroom(self, now: float) -> float:
+        """
+        Доля оставшегося лимита (0..1) по запросам и токенам
+        
+        Неизвестный лимит и лимит после времени сброса считаются полными.
+        """
+        headroom = 1.0
+        for limit, remaining, reset_at in (
+            (self.limit_requests, self.remaining_requests, self.requests_reset_at),
+            (self.limit_tokens, self.remaining_tokens, self.tokens_reset_at),
+        ):
+            if limit and remaining is not None and now < reset_at:
+                headroom = min(headroom, max(0, remaining) / limit)
+        return headroom
+    
+    def update(self, headers: Mapping[str, str], now: float) -> None:
+        """Состояние лимитов из заголовков x-ratelimit-* ответа"""
+        for kind in ("requests", "tokens"):
+            limit = _header_int(headers, f"x-ratelimit-limit-{kind}")
+            remaining = _header_int(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            reset_at = now + (reset if reset is not None else 60.0)
+            current = getattr(self, f"remaining_{kind}")
+            if current is not None and now < getattr(self, f"{kind}_reset_at"):
+                # До сброса ответы приходят не по порядку: запросы, отправленные позже,
+                # уже учтены в оценке, поэтому берем меньшее значение
+                remaining = min(remaining, current)
+            setattr(self, f"limit_{kind}", limit)
+            setattr(self, f"remaining_{kind}", remaining)
+            setattr(self, f"{kind}_reset_at", reset_at)
+            if remaining <= 0:
+                # Лимит исчерпан: до сброса ключ не выбирается
+                self.cooldown_until = max(self.cooldown_until, reset_at)
+    
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "key": self.name,
+            "in_flight": self.in_flight,
+            "headroom": round(self.headroom(now), 3),
+            "remaining_requests": self.remaining_requests,
+            "remaining_tokens": self.remaining_tokens,
+            "cooling_down_s": round(max(0.0, self.cooldown_until - now), 1),
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+        }
+
+class KeyPool:
+    """
+    Выбор ключа для запроса
+    
+    Берется ключ со свободным слотом и наибольшим запасом лимита (при
+    равенстве - с меньшим числом запросов в работе). Ключ после 429 или
+    с исчерпанным лимитом пропускается до времени сброса; если свободных
+    ключей нет, запрос ждет освобождения слота или окончания паузы.
+    """
+    
+    def __init__(self, keys: List[ApiKey]):
+        self.keys = keys
+        self._cond = threading.Condition()
+    
+    def acquire(self, timeout: float) -> ApiKey:
+        """
+        Занять слот ключа
+        
+        Args:
+            timeout: Сколько ждать свободного ключа, секунд
+        
+        Raises:
+            TimeoutError: Если за timeout ни один ключ не освободился
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                best = None
+                best_rank = None
+                next_ready = deadline
+                for key in self.keys:
+                    if key.cooldown_until > now:
+                        next_ready = min(next_ready, key.cooldown_until)
+                        continue
+                    if key.in_flight >= key.concurrency:
+                        continue
+                    rank = (key.headroom(now), -key.in_flight)
+                    if best_rank is None or rank > best_rank:
+                        best, best_rank = key, rank
+                
+                if best is not None:
+                    best.in_flight += 1
+                    best.requests += 1
+                    if best.remaining_requests is not None and now < best.requests_reset_at:
+                        # Оценка до следующего ответа, чтобы параллельные запросы распределялись по ключам;
+                        # последний разрешенный запрос ставит ключ на паузу до сброса, не дожидаясь 429
+                        best.remaining_requests -= 1
+                        if best.remaining_requests <= 0:
+                            best.cooldown_until = max(best.cooldown_until, best.requests_reset_at)
+                    return best
+                
+                if now >= deadline:
+                    raise TimeoutError("Все ключи OpenAI исчерпали лимит запросов")
+                self._cond.wait(next_ready - now)
+    
+    def release(
+        self,
+        key: ApiKey,
+        headers: Optional[Mapping[str, str]] = None,
+        rate_limited: bool = False,
+        quota_exceeded: bool = False
+    ) -> None:
+        """
+        Освобождение слота ключа с учетом заголовков ответа
+        
+        Args:
+            key: Ключ из acquire
+            headers: Заголовки ответа (в том числе ответа с ошибкой)
+            rate_limited: Ответ 429 - ключ уходит на паузу Retry-After
+            quota_exceeded: Закончилась квота (insufficient_quota) - длинная пауза
+        """
+        now = time.monotonic()
+        with self._cond:
+            key.in_flight -= 1
+            if headers is not None:
+                key.update(headers, now)
+            if rate_limited:
+                key.rate_limited += 1
+                pause = QUOTA_COOLDOWN_SECONDS if quota_exceeded else self.retry_after(headers)
+                key.cooldown_until = max(key.cooldown_until, now + pause)
+                print(f"OpenAI key {key.name}: 429, пауза {pause:g}с")
+            self._cond.notify_all()
+    
+    @staticmethod
+    def retry_after(headers: Optional[Mapping[str, str]]) -> float:
+        """Пауза из retry-after-ms / Retry-After или OPENAI_KEY_COOLDOWN_SECONDS"""
+        if headers is not None:
+            retry_after_ms = parse_duration(headers.get("retry-after-ms"))
+            if retry_after_ms is not None:
+                return retry_after_ms / 1000
+            retry_after = parse_duration(headers.get("retry-after"))
+            if retry_after is not None:
+                return retry_after
+        return OPENAI_KEY_COOLDOWN_SECONDS
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """Состояние ключей для мониторинга"""
+        now = time.monotonic()
+        with self._cond:
+            return [key.snapshot(now) for key in self.keys]
@@ -3,6 +3,8 @@
 """
 
 import os
+import json
+import time
 import tempfile
 import threading
 import hashlib
@@ -11,15 +13,32 @@ import pandas as pd
 from io import BytesIO
 
 from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse
+from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse, FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 
 # Импорт наших модулей
-from api.config import EMAIL_REGEX, MAX_UPLOAD_MB, ALLOW_RETRY_SAME_FILE, validate_config
+from api.config import (
+    EMAIL_REGEX, MAX_UPLOAD_MB, ALLOW_RETRY_SAME_FILE,
+    TRACKING_SCHEDULER_ENABLED, TRACKING_INTERVALS, TRACKING_MAX_SETS_PER_EMAIL, OPENAI_WARMUP,
+    SHUTDOWN_GRACE_SECONDS, ANALYZE_MAX_ITEMS, validate_config
+)
 from api.database import db
+from api.admission import admission
+from api.backlog import backlog, BacklogFullError
+from api.engines import openai_flight
+from api.scheduler import fair_scheduler, get_job_priority
 from api.file_processor import FileProcessor
+from api.parse_pool import parse_pool
 from api.openai_client import openai_client
-from api.metrics import MetricsCalculator
+from api.pipeline import analyze_rows, iter_row_results, completed_rows, get_cached_report, save_cached_report
+from api.job_stats import service_stats
+from api.aggregation import JobAggregator
+from api.recompute import recompute_job
+from api.result_store import result_store
+from api.jobs import Job, JobInterruptedError, job_registry
+from api.tracking import tracking_scheduler
 from api.email_service import email_service
 
 # Создание FastAPI приложения
@@ -779,6 +798,33 @@ usb-c хаб
 </body>
 </html>"""
 
+@app.on_event("startup")
+async def start_background_services():
+    """
+    Запуск фоновых сервисов
+    """
+    if TRACKING_SCHEDULER_ENABLED:
+        tracking_scheduler.start()
+    if OPENAI_WARMUP:
+        # Прогрев в фоне, чтобы не задерживать старт приложения
+        threading.Thread(target=openai_client.warm_up, daemon=True).start()
+    if parse_pool.enabled:
+        threading.Thread(target=parse_pool.warm_up, daemon=True).start()
+    resume_checkpointed_jobs()
+
+@app.on_event("shutdown")
+async def drain_background_services():
+    """
+    Остановка: новые задачи не принимаются, задачи в работе завершаются в пределах
+    SHUTDOWN_GRACE_SECONDS, оставшиеся строки сохраняются в контрольную точку
+    """
+    tracking_scheduler.stop()
+    active_jobs = len(job_registry.active())
+    if active_jobs:
+        print(f"Остановка: ожидание {active_jobs} задач (до {SHUTDOWN_GRACE_SECONDS:g}с)")
+    await run_in_threadpool(job_registry.drain, SHUTDOWN_GRACE_SECONDS)
+    parse_pool.shutdown()
+
 @app.get("/", response_class=HTMLResponse)
 async def get_landing_page():
     """
@@ -791,6 +837,22 @@ async def handle_upload(request: Request, file: UploadFile = File(...), email: s
     """
     Обработка загруженного файла
     """
+    client_ip = get_client_ip(request)
+    
+    # Сервис останавливается - новые задачи не принимаем
+    if not job_registry.accepting:
+        raise HTTPException(
+            status_code=503,
+            detail="Сервіс перезапускається. Спробуйте за хвилину",
+            headers={"Retry-After": "60"}
+        )
+    
+    # Лимит частоты проверяется до чтения файла и обращения к базе
+    try:
+        admission.check_rate(client_ip)
+    except PermissionError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
     # Валидация email
     if not EMAIL_REGEX.match(email):
         raise HTTPException(status_code=400, detail="Некоректний формат email")
@@ -800,41 +862,86 @@ async def handle_upload(request: Request, file: UploadFile = File(...), email: s
     if not content:
         raise HTTPException(status_code=400, detail="Файл пустий")
 
-    print(f"Прийнято файл: {file.filename} від {get_client_ip(request)} для {email}")
+    print(f"Прийнято файл: {file.filename} від {client_ip} для {email}")
 
-    # Валидация размера файла
-    # Добавил этот блок в worker, чтобы не ждать здесь
-    # try:
-    #     FileProcessor.validate_file_size(content, MAX_UPLOAD_MB)
-    # except ValueError as e:
-    #     raise HTTPException(status_code=400, detail=str(e))
+    # Валидация размера файла до распаковки: MAX_DECOMPRESSED_MB ограничивает
+    # только распакованные данные
+    try:
+        FileProcessor.validate_file_size(content, MAX_UPLOAD_MB)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Проверка заголовка и первых строк до постановки в очередь: некорректный файл
+    # получает ответ сразу и не расходует лимит "один файл на IP".
+    # XLSX разбирается в пуле процессов, не задерживая цикл событий
+    file_extension = FileProcessor.get_file_extension(file.filename)
+    try:
+        await run_in_threadpool(parse_pool.preflight, content, file_extension)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Проверяем не использовал ли пользователь уже сервис
     # Хэш файла для проверки, чтобы пользователь не отправлял один и тот же файл много раз
-    client_ip = get_client_ip(request)
     file_hash = hashlib.sha256(content).hexdigest()
     
+    # Тот же файл уже обрабатывался (в том числе другим пользователем) - отчет готов,
+    # место в очереди обработки не нужно
+    cached_report = get_cached_report(file_hash)
+    
+    # Прием в очередь обработки до записи "один файл на IP": клиент, получивший 503,
+    # повторяет тот же файл через Retry-After и не должен получить 429
+    backlog_rows = None
+    if cached_report is None:
+        try:
+            backlog_rows = backlog.admit(FileProcessor.estimate_rows(content, file_extension))
+        except BacklogFullError as e:
+            print(f"Очередь заполнена, отказ для {client_ip}: повтор через {e.retry_after}с")
+            raise HTTPException(
+                status_code=503,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)}
+            )
+    
     try:
-        db.check_ip_file_access(client_ip, file_hash, ALLOW_RETRY_SAME_FILE)
+        admission.check_file_access(client_ip, file_hash, ALLOW_RETRY_SAME_FILE)
     except PermissionError as e:
+        if backlog_rows is not None:
+            backlog.release(backlog_rows)
         raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         print(f"Database warning: {e}")
         pass
     
+    if cached_report is not None:
+        csv_content, queries_count = cached_report
+        print(f"Найден готовый отчет для файла {file_hash[:12]}")
+        threading.Thread(
+            target=deliver_report,
+            args=(email, client_ip, csv_content, queries_count),
+            daemon=True
+        ).start()
+        return JSONResponse({
+            "ok": True,
+            "email": email,
+            "status": "processing",
+            "cached": True,
+            "message": "Файл прийнято в обробку. Очікуйте звіт на email."
+        })
+    
     # Сохраняем файл во временную директорию для обработки
-    file_extension = FileProcessor.get_file_extension(file.filename)
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
             temp_file.write(content)
             temp_file_path = temp_file.name
     except Exception as e:
+        backlog.release(backlog_rows)
         raise HTTPException(status_code=500, detail="Ошибка сохранения файла")
     
     # Запускаем обработку в отдельном потоке
+    job = job_registry.register(Job(email, client_ip, file_hash))
     worker_thread = threading.Thread(
         target=process_file_worker,
-        args=(temp_file_path, email, client_ip),
+        args=(temp_file_path, job, backlog_rows),
         daemon=True
     )
     worker_thread.start()
@@ -843,72 +950,495 @@ async def handle_upload(request: Request, file: UploadFile = File(...), email: s
     return JSONResponse({
         "ok": True,
         "email": email,
+        "job_id": job.id,
         "status": "processing",
         "message": "Файл прийнято в обробку. Очікуйте звіт на email."
     })
 
-def process_file_worker(file_path: str, email: str, client_ip: str):
+@app.post("/analyze")
+async def analyze_items(request: Request):
     """
-    Фоновая задача для обработки файла и отправки отчета
+    Синхронный анализ для интеграций: JSON список {country, prompt, website}
+    (или {"items": [...]}), результаты выдаются NDJSON по мере готовности
+    
+    Каждая строка ответа - {"index", "country", "prompt", "engine", "results"},
+    где results - строки отчета по доменам; последняя строка - {"done": true, ...}.
     """
+    client_ip = get_client_ip(request)
+    
+    if not job_registry.accepting:
+        raise HTTPException(
+            status_code=503,
+            detail="Сервіс перезапускається. Спробуйте за хвилину",
+            headers={"Retry-After": "60"}
+        )
+    
     try:
-        print(f"Начало обработки файла {file_path}")
+        admission.check_rate(client_ip)
+    except PermissionError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    body = await request.body()
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некоректний JSON")
+    items = payload.get("items") if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="Очікується непорожній список елементів {country, prompt, website}")
+    if len(items) > ANALYZE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Забагато елементів: {len(items)} > {ANALYZE_MAX_ITEMS}")
+    
+    records = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail=f"Елемент {index}: очікується об'єкт")
+        competitors = item.get("competitors") or ""
+        if isinstance(competitors, list):
+            competitors = ",".join(str(domain) for domain in competitors)
+        record = {
+            "Country": str(item.get("country") or "").strip(),
+            "Prompt": str(item.get("prompt") or "").strip(),
+            "Website": str(item.get("website") or "").strip(),
+            "Tracked": str(competitors),
+            "item_index": index
+        }
+        missing = [key.lower() for key in ("Country", "Prompt", "Website") if not record[key]]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Елемент {index}: не заповнено {', '.join(missing)}")
+        records.append(record)
+    
+    # Та же нормализация, что и для файлов (домены из URL, несколько доменов в строке)
+    df, rows_count = FileProcessor.normalize_dataframe(pd.DataFrame(records), max_rows=None)
+    if not rows_count:
+        raise HTTPException(status_code=400, detail="Не вдалося визначити домени сайтів")
+    
+    try:
+        backlog_rows = backlog.admit(rows_count)
+    except BacklogFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    job = job_registry.register(Job("api", client_ip, hashlib.sha256(body).hexdigest()))
+    item_indexes = df['item_index'].tolist()
+    
+    async def stream_results():
+        started = time.monotonic()
+        completed = 0
+        errors = 0
+        results = iter_row_results(df, job.file_hash, tenant=client_ip, job=job)
+        try:
+            # Ожидание следующего результата в пуле потоков; при отключении клиента
+            # генератор закрывается в finally и снимает не начатые запросы
+            while True:
+                result = await run_in_threadpool(next, results, None)
+                if result is None:
+                    break
+                index = result["row"]
+                line = {
+                    "index": item_indexes[index],
+                    "country": df.at[index, 'Country'],
+                    "prompt": df.at[index, 'Prompt'],
+                    **{key: value for key, value in result.items() if key != "row"}
+                }
+                completed += 1
+                errors += "error" in result
+                yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+            yield json.dumps({
+                "done": True,
+                "job_id": job.id,
+                "completed": completed,
+                "errors": errors,
+                "elapsed": round(time.monotonic() - started, 3)
+            }) + "\n"
+        finally:
+            results.close()
+            backlog.release(backlog_rows, min(completed, rows_count))
+            job_registry.finish(job)
+    
+    return StreamingResponse(
+        stream_results(),
+        media_type="application/x-ndjson",
+        headers={"X-Job-Id": job.id}
+    )
 
-        # Обработка файла
-        df, queries_count = FileProcessor.process_file(file_path)
-        
-        # Запрос к OpenAI
-        all_results = []
-        for index, row in df.iterrows():
-            country = row['Country']
-            prompt = row['Prompt']
-            website = row['Website']
-            
-            # Запрос к OpenAI
-            response_data = openai_client.search_with_web(prompt)
-            
-            # Расчет метрик
-            metrics_data = MetricsCalculator.calculate_metrics(
-                country=country,
-                target_domain=website,
-                sources=response_data['sources']
-            )
-            all_results.append(metrics_data)
+def process_file_worker(file_path: str, job: Job, backlog_rows: int):
+    """
+    Фоновая задача для обработки файла и отправки отчета
+    """
+    queries_count = 0
+    try:
+        print(f"Начало обработки файла {file_path} (задача {job.id})")
 
-        # Создание отчета
-        report_df = pd.DataFrame(all_results)
+        # Обработка файла (в пуле процессов: разбор книги не держит GIL сервиса)
+        df, queries_count = parse_pool.process_file(file_path)
         
-        # Конвертация в CSV
-        csv_buffer = BytesIO()
-        report_df.to_csv(csv_buffer, index=False, encoding='utf-8')
-        csv_content = csv_buffer.getvalue()
-
-        # Сохранение email в БД
-        db.save_email(email, client_ip)
-
-        # Отправка email
-        email_service.send_report_email(
-            recipient_email=email,
-            csv_content=csv_content,
-            queries_count=queries_count
-        )
+        run_job(job, df, queries_count)
         
     except Exception as e:
         print(f"❌ Ошибка в worker-потоке: {e}")
     finally:
+        backlog.release(backlog_rows, queries_count)
+        job_registry.finish(job)
+        
         # Удаляем временный файл
         if os.path.exists(file_path):
             os.remove(file_path)
             print(f"Временный файл {file_path} удален.")
 
+def run_job(job: Job, df: pd.DataFrame, queries_count: int, completed: Optional[dict] = None):
+    """
+    Запросы по строкам, расчет метрик и отправка отчета для одной задачи
+    
+    При остановке сервиса готовые результаты строк сохраняются в контрольную
+    точку и задача возобновляется после перезапуска. Задача, у которой истек
+    срок, отправляет отчет по готовым строкам.
+    """
+    # Запросы к OpenAI и расчет метрик (задержки задачи видны в /metrics, пока она в работе)
+    job_stats = job.stats
+    aggregator = JobAggregator()
+    try:
+        all_results = analyze_rows(
+            df, job.file_hash, stats=job_stats,
+            tenant=job.email.lower(), priority=get_job_priority(job.email),
+            job=job, completed=completed, aggregator=aggregator
+        )
+    except JobInterruptedError as e:
+        if e.reason == "shutdown":
+            checkpoint_job(job, df, e)
+        elif e.reason == "deadline":
+            db.delete_job_checkpoint(job.id)
+            deliver_partial_report(job, df, queries_count, e)
+        else:
+            db.delete_job_checkpoint(job.id)
+            print(f"Задача {job.id} прервана: {e.reason}")
+        return
+    
+    if job_stats.latencies:
+        print(f"Метрики задачи {job.id}:\n{job_stats.format()}")
+    
+    csv_content = store_job_report(job, all_results)
+    
+    # Отчет без ошибок API можно выдавать повторно для того же файла
+    if not job_stats.counters.get("errors"):
+        save_cached_report(job.file_hash, csv_content, queries_count)
+    
+    deliver_report(job.email, job.client_ip, csv_content, queries_count, aggregator)
+    if completed is not None:
+        db.delete_job_checkpoint(job.id)
+
+def store_job_report(job: Job, all_results: list) -> bytes:
+    """
+    Отчет задачи в CSV и в хранилище результатов для GET /jobs/{job_id}/report
+    
+    Returns:
+        CSV отчета
+    """
+    report_df = pd.DataFrame(all_results)
+    
+    # Конвертация в CSV
+    csv_buffer = BytesIO()
+    report_df.to_csv(csv_buffer, index=False, encoding='utf-8')
+    
+    try:
+        result_store.write(job.id, report_df)
+    except Exception as e:
+        print(f"Result store warning: {e}")
+    return csv_buffer.getvalue()
+
+def checkpoint_job(job: Job, df: pd.DataFrame, interrupted: JobInterruptedError):
+    """
+    Контрольная точка задачи, прерванной остановкой сервиса
+    
+    Точка пишется сразу, до ожидания запросов в работе: если сервис
+    завершится раньше, после перезапуска продолжится хотя бы с нее.
+    Запросы в работе ждем в пределах оставшегося срока остановки
+    и дописываем их результаты.
+    """
+    # reindex: у возобновленных старых контрольных точек нет tracked_domains
+    rows = df.reindex(
+        columns=['Country', 'Prompt', 'Website', 'target_domain', 'tracked_domains'], fill_value=''
+    ).to_dict(orient="records")
+    db.save_job_checkpoint(job.id, job.email, job.client_ip, job.file_hash, rows, interrupted.completed)
+    if interrupted.collect_in_flight(job.in_flight_remaining()):
+        db.save_job_checkpoint(job.id, job.email, job.client_ip, job.file_hash, rows, interrupted.completed)
+    print(f"Задача {job.id} сохранена: готово {len(interrupted.completed)} результатов, продолжение после перезапуска")
+
+def deliver_partial_report(job: Job, df: pd.DataFrame, queries_count: int, interrupted: JobInterruptedError):
+    """
+    Отчет по строкам, готовым к истечению срока задачи, с пометкой в письме
+    """
+    partial_df, partial_completed = completed_rows(df, interrupted.completed)
+    print(f"Задача {job.id}: истек срок, отчет по {len(partial_df)} из {queries_count} запросов")
+    aggregator = JobAggregator()
+    all_results = analyze_rows(
+        partial_df, job.file_hash, use_cache=False, completed=partial_completed, aggregator=aggregator
+    ) if len(partial_df) else []
+    csv_content = store_job_report(job, all_results)
+    deliver_report(
+        job.email, job.client_ip, csv_content, len(partial_df), aggregator,
+        notice=(
+            f"The analysis reached its time limit: the report covers {len(partial_df)} "
+            f"of {queries_count} queries. Upload the remaining queries as a new file to complete it."
+        )
+    )
+
+def resume_job_worker(checkpoint: dict, job: Job, backlog_rows: int):
+    """
+    Фоновое возобновление задачи из контрольной точки
+    """
+    try:
+        df = pd.DataFrame(checkpoint["rows"])
+        print(f"Возобновление задачи {job.id}: {len(df)} строк, готово {len(checkpoint['completed'])}")
+        run_job(job, df, len(df), completed=checkpoint["completed"])
+    except Exception as e:
+        print(f"❌ Ошибка возобновления задачи {job.id}: {e}")
+    finally:
+        backlog.release(backlog_rows, len(checkpoint["rows"]))
+        job_registry.finish(job)
+
+def resume_checkpointed_jobs():
+    """
+    Запуск задач, прерванных предыдущей остановкой сервиса
+    """
+    try:
+        checkpoints = db.get_job_checkpoints()
+    except Exception as e:
+        print(f"Database warning: {e}")
+        return
+    
+    for checkpoint in checkpoints:
+        job = job_registry.register(Job(
+            checkpoint["email"], checkpoint["ip"], checkpoint["file_hash"],
+            job_id=checkpoint["job_id"]
+        ))
+        backlog_rows = backlog.admit(len(checkpoint["rows"]), force=True)
+        threading.Thread(
+            target=resume_job_worker,
+            args=(checkpoint, job, backlog_rows),
+            daemon=True
+        ).start()
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    Отмена задачи: не начатые строки снимаются из очереди, отчет не отправляется
+    """
+    job = job_registry.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задачу не знайдено")
+    job.cancel("cancelled by user")
+    return JSONResponse({"ok": True, "job_id": job_id, "status": "cancelling"})
+
+@app.get("/jobs/{job_id}/recompute")
+async def recompute_job_report(job_id: str, reextract: bool = False):
+    """
+    Пересчет отчета задачи по сохраненным ответам (без запросов к API)
+    """
+    report_df = await run_in_threadpool(recompute_job, job_id, reextract)
+    if report_df is None:
+        raise HTTPException(status_code=404, detail="Задачу не знайдено")
+    
+    csv_buffer = BytesIO()
+    report_df.to_csv(csv_buffer, index=False, encoding='utf-8')
+    csv_buffer.seek(0)
+    return StreamingResponse(
+        csv_buffer,
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="ai_visibility_report_{job_id}.csv"'}
+    )
+
+@app.get("/jobs/{job_id}/report")
+async def download_job_report(job_id: str, format: str = "csv"):
+    """
+    Отчет задачи из хранилища результатов в формате csv, xlsx или parquet
+    """
+    if format not in ("csv", "xlsx", "parquet"):
+        raise HTTPException(status_code=400, detail="Формат звіту: csv, xlsx або parquet")
+    path = result_store.path(job_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Звіт задачі не знайдено")
+    
+    filename = f"ai_visibility_report_{job_id}.{format}"
+    if format == "parquet":
+        return FileResponse(path, media_type="application/vnd.apache.parquet", filename=filename)
+    if format == "xlsx":
+        xlsx_path = await run_in_threadpool(result_store.write_xlsx, path)
+        return FileResponse(
+            xlsx_path,
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            filename=filename,
+            background=BackgroundTask(os.remove, xlsx_path)
+        )
+    return StreamingResponse(
+        result_store.iter_csv(path),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Состояние очереди обработки и объединения запросов для мониторинга
+    
+    latency_by_country - задержки запросов по странам за последние
+    SERVICE_STATS_MAX_SAMPLES запросов каждой страны; у задач в работе - свои
+    (jobs.per_job, без идентификаторов задач).
+    tiers - эскалации на тяжелую модель и стоимость по моделям с запуска сервиса.
+    """
+    active_jobs = job_registry.active()
+    return JSONResponse({
+        "backlog": backlog.stats(),
+        "jobs": {
+            "active": len(active_jobs),
+            "accepting": job_registry.accepting,
+            # Без идентификаторов: id задачи - единственный ключ к ее отчету и отмене
+            "per_job": [
+                {"latency_by_country": job.stats.summary("country:"), "tiers": job.stats.tiers()}
+                for job in active_jobs
+            ]
+        },
+        "latency_by_country": service_stats.summary("country:"),
+        "errors_by_country": service_stats.counter_values("errors:"),
+        "tiers": service_stats.tiers(),
+        "scheduler": fair_scheduler.stats(),
+        "openai_coalescing": openai_flight.stats(),
+        "openai_keys": openai_client.key_stats()
+    })
+
+@app.post("/tracking")
+async def create_tracking(request: Request, file: UploadFile = File(...), email: str = Form(...), interval: str = Form("weekly")):
+    """
+    Сохранение набора запросов для регулярного отслеживания
+    
+    Каждый набор - регулярные платные запросы, поэтому действуют те же лимит
+    частоты и правило "один файл на IP", что и для /upload, и не более
+    TRACKING_MAX_SETS_PER_EMAIL наборов на email.
+    """
+    client_ip = get_client_ip(request)
+    try:
+        admission.check_rate(client_ip)
+    except PermissionError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    if not EMAIL_REGEX.match(email):
+        raise HTTPException(status_code=400, detail="Некоректний формат email")
+    if interval not in TRACKING_INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Інтервал має бути одним з: {', '.join(TRACKING_INTERVALS)}")
+    
+    content = await file.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="Файл пустий")
+    try:
+        FileProcessor.validate_file_size(content, MAX_UPLOAD_MB)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if db.count_tracked_sets(email) >= TRACKING_MAX_SETS_PER_EMAIL:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Досягнуто ліміт наборів відстеження ({TRACKING_MAX_SETS_PER_EMAIL}) для цього email"
+        )
+    
+    file_hash = hashlib.sha256(content).hexdigest()
+    try:
+        admission.check_file_access(client_ip, file_hash, ALLOW_RETRY_SAME_FILE)
+    except PermissionError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        print(f"Database warning: {e}")
+    
+    file_extension = FileProcessor.get_file_extension(file.filename)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
+        temp_file.write(content)
+        temp_file_path = temp_file.name
+    
+    try:
+        df, rows_count = await run_in_threadpool(parse_pool.process_file, temp_file_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.remove(temp_file_path)
+    
+    rows = df[['Country', 'Prompt', 'Website', 'target_domain', 'tracked_domains']].to_dict(orient="records")
+    set_id, token = db.create_tracked_set(email, TRACKING_INTERVALS[interval], rows)
+    
+    # token - единственный ключ к динамике набора и его удалению
+    return JSONResponse({
+        "ok": True,
+        "tracking_id": set_id,
+        "tracking_token": token,
+        "interval": interval,
+        "rows": rows_count
+    })
+
+@app.get("/tracking/{token}/trend")
+async def get_tracking_trend(token: str, domain: str, country: Optional[str] = None, weeks: int = 8):
+    """
+    Недельная динамика AIV-Score домена в наборе владельца ключа
+    """
+    set_id = db.get_tracked_set_id(token)
+    if set_id is None:
+        raise HTTPException(status_code=404, detail="Набір відстеження не знайдено")
+    
+    weeks = max(1, min(weeks, 104))
+    return JSONResponse({
+        "domain": domain.lower(),
+        "country": country,
+        "weeks": db.get_weekly_trend(set_id, domain, country, weeks)
+    })
+
+@app.delete("/tracking/{token}")
+async def delete_tracking(token: str):
+    """
+    Остановка отслеживания: набор удаляется вместе с его динамикой
+    """
+    if not db.delete_tracked_set(token):
+        raise HTTPException(status_code=404, detail="Набір відстеження не знайдено")
+    return JSONResponse({"ok": True, "status": "deleted"})
+
+def deliver_report(
+    email: str,
+    client_ip: str,
+    csv_content: bytes,
+    queries_count: int,
+    aggregator: Optional[JobAggregator] = None,
+    notice: str = ""
+):
+    """
+    Сохранение email и отправка готового отчета со сводкой
+    
+    Для отчета из кэша сводка собирается по его CSV; notice - пометка
+    о неполном отчете вместо строки об успешном завершении.
+    """
+    try:
+        # Сохранение email в БД
+        db.save_email(email, client_ip)
+    except Exception as e:
+        print(f"Database warning: {e}")
+    
+    if aggregator is None:
+        aggregator = JobAggregator.from_report_csv(csv_content)
+    
+    # Отправка email
+    email_service.send_report_email(
+        recipient_email=email,
+        csv_content=csv_content,
+        queries_count=queries_count,
+        summary_text=aggregator.email_header(),
+        summary_csv=aggregator.to_csv(),
+        notice=notice
+    )
+
 def get_client_ip(request: Request) -> str:
     """
-    Получение IP адреса клиента из заголовков запроса
+    Получение IP адреса клиента: X-Forwarded-For только от TRUSTED_PROXIES
     """
-    x_forwarded_for = request.headers.get('X-Forwarded-For')
-    if x_forwarded_for:
-        return x_forwarded_for.split(',')[0].strip()
-    return request.client.host
+    peer_ip = request.client.host if request.client else ""
+    return admission.proxies.client_ip(peer_ip, request.headers.get('X-Forwarded-For'))
 
 # Запуск валидации конфигурации
 validate_config()
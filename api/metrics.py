@@ -5,11 +5,15 @@
 from typing import List, Dict, Any, Tuple, Optional
 from urllib.parse import urlparse
 from collections import Counter
+from functools import lru_cache
+
+from api.source_types import source_classifier
 
 class MetricsCalculator:
     """Класс для расчета метрик AI Visibility"""
     
     @staticmethod
+    @lru_cache(maxsize=65536)  # Одни и те же URL повторяются в строках и при массовом пересчете
     def extract_domain(url: str) -> str:
         """
         Извлечение домена из URL
@@ -26,6 +30,24 @@ class MetricsCalculator:
         except:
             return ""
     
+    @staticmethod
+    def build_domain_index(sources: List[Dict]) -> Tuple[List[str], Dict[str, List[int]]]:
+        """
+        Индекс источников для расчета метрик по нескольким доменам за один проход
+        
+        Args:
+            sources: Список источников
+        
+        Returns:
+            Tuple[домены источников по порядку, домен -> ранги (с 1) по возрастанию]
+        """
+        domains = [MetricsCalculator.extract_domain(source.get("url", "")) for source in sources]
+        index: Dict[str, List[int]] = {}
+        for rank, domain in enumerate(domains, 1):
+            if domain:
+                index.setdefault(domain, []).append(rank)
+        return domains, index
+    
     @staticmethod
     def calculate_aiv_score(sources: List[Dict], target_domain: str) -> float:
         """
@@ -38,19 +60,26 @@ class MetricsCalculator:
         Returns:
             AIV-Score от 0 до 100
         """
-        target_domain = target_domain.lower()
-        N = len(sources)
+        _, index = MetricsCalculator.build_domain_index(sources)
+        return MetricsCalculator.aiv_score_from_ranks(index.get(target_domain.lower(), []), len(sources))
+    
+    @staticmethod
+    def aiv_score_from_ranks(our_ranks: List[int], N: int) -> float:
+        """
+        Расчет AIV-Score по рангам домена среди N источников
+        
+        Args:
+            our_ranks: Ранги целевого домена по возрастанию
+            N: Количество источников
+        
+        Returns:
+            AIV-Score от 0 до 100
+        """
         K = min(5, max(1, N)) if N > 0 else 1
         
         # 40% Inclusion - есть ли вообще источники
         inclusion = 1.0 if N > 0 else 0.0
         
-        # Поиск рангов целевого домена
-        our_ranks = [
-            i + 1 for i, source in enumerate(sources)
-            if MetricsCalculator.extract_domain(source.get("url", "")) == target_domain
-        ]
-        
         # 40% Presence × Prominence - есть ли мы и насколько высоко
         presence = 1.0 if our_ranks else 0.0
         prominence = (1.0 - (min(our_ranks) - 1) / K) if our_ranks else 0.0
@@ -93,14 +122,29 @@ class MetricsCalculator:
             target_domain: Целевой домен
             k: Количество конкурентов для анализа
             
+        Returns:
+            Tuple[индекс силы, текстовое описание]
+        """
+        domains, _ = MetricsCalculator.build_domain_index(sources)
+        return MetricsCalculator.competitor_strength_from_domains(domains, target_domain, k)
+    
+    @staticmethod
+    def competitor_strength_from_domains(domains: List[str], target_domain: str, k: int = 3) -> Tuple[Optional[float], str]:
+        """
+        Расчет силы конкурентов по доменам источников (см. build_domain_index)
+        
+        Args:
+            domains: Домены источников по порядку
+            target_domain: Целевой домен
+            k: Количество конкурентов для анализа
+        
         Returns:
             Tuple[индекс силы, текстовое описание]
         """
         target_domain = target_domain.lower()
         competitor_ranks = []
         
-        for i, source in enumerate(sources, 1):
-            domain = MetricsCalculator.extract_domain(source.get("url", ""))
+        for i, domain in enumerate(domains, 1):
             if domain and domain != target_domain:
                 competitor_ranks.append(i)
                 if len(competitor_ranks) >= k:
@@ -134,19 +178,7 @@ class MetricsCalculator:
         if not sources:
             return "N/A"
         
-        types = []
-        for source in sources:
-            url = source.get("url", "").lower()
-            if any(keyword in url for keyword in ["forum", "reddit", "quora"]):
-                types.append("Forum")
-            elif any(keyword in url for keyword in ["/docs", "/help"]):
-                types.append("Docs")
-            elif any(keyword in url for keyword in ["/product", "/buy", "/shop"]):
-                types.append("Product")
-            elif any(keyword in url for keyword in ["/blog", "/review"]):
-                types.append("Blog")
-            else:
-                types.append("Other")
+        types = source_classifier.classify_many([source.get("url", "") for source in sources])
         
         # Подсчет статистики
         counter = Counter(types)
@@ -171,27 +203,54 @@ class MetricsCalculator:
         Returns:
             Словарь с метриками
         """
-        target_domain = target_domain.lower()
+        return MetricsCalculator.calculate_metrics_for_domains(sources, [target_domain], country)[0]
+    
+    @staticmethod
+    def calculate_metrics_for_domains(sources: List[Dict], target_domains: List[str], country: str = "") -> List[Dict[str, Any]]:
+        """
+        Расчет метрик одного запроса сразу для нескольких отслеживаемых доменов
+        
+        Источники разбираются один раз в индекс домен -> ранги, общие для
+        запроса метрики (типы источников) тоже считаются один раз.
         
-        # Подсчет упоминаний целевого домена
-        our_mentions = 0
-        best_rank = None
+        Args:
+            sources: Список источников
+            target_domains: Отслеживаемые домены (свой сайт и конкуренты)
+            country: Страна запроса
         
-        for i, source in enumerate(sources, 1):
-            domain = MetricsCalculator.extract_domain(source.get("url", ""))
-            if domain == target_domain:
-                our_mentions += 1
-                if best_rank is None:
-                    best_rank = i
+        Returns:
+            Словари с метриками в порядке target_domains
+        """
+        domains, index = MetricsCalculator.build_domain_index(sources)
+        coverage_type = MetricsCalculator.analyze_coverage_type(sources)
+        top_domains = domains[:5]  # Конкуренты берутся из первых 5 источников
+        
+        return [
+            MetricsCalculator._domain_metrics(domains, index, top_domains, coverage_type, target_domain.lower(), country)
+            for target_domain in target_domains
+        ]
+    
+    @staticmethod
+    def _domain_metrics(
+        domains: List[str],
+        index: Dict[str, List[int]],
+        top_domains: List[str],
+        coverage_type: str,
+        target_domain: str,
+        country: str
+    ) -> Dict[str, Any]:
+        """Метрики одного домена по индексу источников запроса"""
+        our_ranks = index.get(target_domain, [])
+        our_mentions = len(our_ranks)
+        best_rank = our_ranks[0] if our_ranks else None
         
         # Расчет всех метрик
-        aiv_score = MetricsCalculator.calculate_aiv_score(sources, target_domain)
-        competitor_index, competitor_label = MetricsCalculator.calculate_competitor_strength(sources, target_domain)
+        aiv_score = MetricsCalculator.aiv_score_from_ranks(our_ranks, len(domains))
+        competitor_index, competitor_label = MetricsCalculator.competitor_strength_from_domains(domains, target_domain)
         
         # Список конкурентов (исключая наш домен)
         competitors = []
-        for source in sources[:5]:  # Берем первые 5
-            domain = MetricsCalculator.extract_domain(source.get("url", ""))
+        for domain in top_domains:
             if domain and domain != target_domain and domain not in competitors:
                 competitors.append(domain)
         
@@ -210,6 +269,6 @@ class MetricsCalculator:
             "Конкуренти": ", ".join(competitors[:3]),  # Показываем топ-3 конкурентов
             "Competitor Strength Index": competitor_index,
             "Competitor Strength Label": competitor_label,
-            "Coverage Type": MetricsCalculator.analyze_coverage_type(sources),
-            "Total Sources": len(sources)
+            "Coverage Type": coverage_type,
+            "Total Sources": len(domains)
         }
\ No newline at end of file
@@ -2,53 +2,182 @@
 Клиент для работы с OpenAI Responses API
 """
 
+import threading
+import time
+from contextlib import nullcontext
 from typing import Dict, List, Any, Optional
-from openai import OpenAI
-from api.config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_TIMEOUT
+import httpx
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError, APIStatusError
+from api.config import (
+    OPENAI_API_KEYS, OPENAI_MODEL, OPENAI_TIMEOUT, COUNTRY_MAX_CONCURRENCY,
+    OPENAI_HTTP2, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE, OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_WARMUP_CONNECTIONS
+)
+from api.geo import country_to_iso
+from api.key_pool import ApiKey, KeyPool
+
+# Повторы при ошибках сервера и соединения (сверх первой попытки); 429 повторяется на другом ключе
+SERVER_ERROR_RETRIES = 2
 
 class OpenAIClient:
     """Клиент для OpenAI Responses API"""
     
     def __init__(self):
-        self.client = None
+        self.key_pool: Optional[KeyPool] = None
+        self.http_clients: List[httpx.Client] = []
         self.model = OPENAI_MODEL
         self.timeout = OPENAI_TIMEOUT
+        self._init_lock = threading.Lock()
+        # Лимит параллельности на каждую страну поверх общего пула соединений,
+        # чтобы строки крупной страны не вытесняли запросы мелких
+        self.country_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self.country_concurrency = COUNTRY_MAX_CONCURRENCY
     
-    def _ensure_client(self):
-        """Ленивая инициализация клиента при первом использовании"""
-        if self.client is not None:
-            return
-            
-        if not OPENAI_API_KEY:
-            raise ValueError("OPENAI_API_KEY не установлен")
+    def _build_http_client(self) -> httpx.Client:
+        """Общий транспорт: HTTP/2, ограниченный пул и keep-alive соединения"""
+        limits = httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        )
+        try:
+            return httpx.Client(http2=OPENAI_HTTP2, limits=limits, timeout=self.timeout)
+        except ImportError:
+            # Пакет h2 не установлен - остаемся на HTTP/1.1
+            print("HTTP/2 недоступен (нет пакета h2), используется HTTP/1.1")
+            return httpx.Client(limits=limits, timeout=self.timeout)
+    
+    def _build_client(self, key: ApiKey, http_client: httpx.Client) -> OpenAI:
+        """
+        Клиент SDK для одного ключа со своим пулом соединений
         
+        Повторы SDK отключены: при 429 он повторил бы запрос на том же ключе,
+        а повторы с выбором ключа выполняет _create_response.
+        """
+        kwargs: Dict[str, Any] = {"api_key": key.api_key, "http_client": http_client, "max_retries": 0}
+        if key.project:
+            # Заголовок вместо аргумента project: поддерживается всеми версиями SDK 1.x
+            kwargs["default_headers"] = {"OpenAI-Project": key.project}
         try:
-            self.client = OpenAI(api_key=OPENAI_API_KEY)
+            return OpenAI(**kwargs)
         except TypeError:
             # Fallback для несовместимости с httpx на Vercel
             import os
             os.environ['HTTPX_DISABLE_PROXY'] = '1'
-            self.client = OpenAI(api_key=OPENAI_API_KEY)
+            return OpenAI(**kwargs)
+    
+    def _ensure_client(self):
+        """Ленивая потокобезопасная инициализация клиентов всех ключей при первом использовании"""
+        if self.key_pool is not None:
+            return
+        
+        with self._init_lock:
+            if self.key_pool is not None:
+                return
+            
+            if not OPENAI_API_KEYS:
+                raise ValueError("OPENAI_API_KEY не установлен")
+            
+            keys = [ApiKey.from_spec(spec) for spec in OPENAI_API_KEYS]
+            http_clients = []
+            for key in keys:
+                http_client = self._build_http_client()
+                key.client = self._build_client(key, http_client)
+                http_clients.append(http_client)
+            self.http_clients = http_clients
+            self.key_pool = KeyPool(keys)
+            if len(keys) > 1:
+                print(f"OpenAI: пул из {len(keys)} ключей")
     
-    def search_with_web(self, query: str) -> Dict[str, Any]:
+    def _get_country_slot(self, country_code: Optional[str]) -> Optional[threading.BoundedSemaphore]:
+        """
+        Семафор параллельности для страны
+        
+        Запросы без распознанной страны идут без лимита по стране.
+        """
+        if not country_code:
+            return None
+        
+        slot = self.country_slots.get(country_code)
+        if slot is None:
+            with self._init_lock:
+                slot = self.country_slots.setdefault(
+                    country_code, threading.BoundedSemaphore(self.country_concurrency)
+                )
+        return slot
+    
+    def warm_up(self, connections: int = OPENAI_WARMUP_CONNECTIONS) -> None:
+        """
+        Предварительное открытие соединений с API (DNS, TCP, TLS)
+        
+        Запросы без авторизации к базовому URL не расходуют токены;
+        статус ответа не важен, важно установленное соединение.
+        
+        Args:
+            connections: Сколько соединений открыть параллельно (для HTTP/1.1)
+        """
+        self._ensure_client()
+        
+        def touch(http_client: httpx.Client, base_url: str):
+            try:
+                http_client.head(base_url)
+            except httpx.HTTPError as e:
+                print(f"Прогрев соединения не удался: {e}")
+        
+        started = time.monotonic()
+        # У каждого ключа свой пул соединений
+        threads = [
+            threading.Thread(target=touch, args=(http_client, str(key.client.base_url)))
+            for key, http_client in zip(self.key_pool.keys, self.http_clients)
+            for _ in range(max(1, connections))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"Соединения с OpenAI прогреты за {time.monotonic() - started:.2f}с")
+    
+    @staticmethod
+    def build_web_search_tool(country_code: Optional[str]) -> Dict[str, Any]:
+        """Описание инструмента веб-поиска с геотаргетингом по стране"""
+        tool: Dict[str, Any] = {"type": "websearch"}
+        if country_code:
+            tool["user_location"] = {"type": "approximate", "country": country_code}
+        return tool
+    
+    def search_with_web(
+        self,
+        query: str,
+        model: Optional[str] = None,
+        country: str = "",
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
         """
         Выполнение запроса к OpenAI с веб-поиском
         
         Args:
             query: Поисковый запрос
+            model: Модель (по умолчанию OPENAI_MODEL)
+            country: Страна запроса - передается в поиск как местоположение пользователя
+            timeout: Таймаут запроса в секундах (по умолчанию OPENAI_TIMEOUT)
             
         Returns:
             Dict с источниками, usage и query
         """
         self._ensure_client()
+        country_code = country_to_iso(country)
+        slot = self._get_country_slot(country_code)
         
         try:
-            response = self.client.responses.create(
-                model=self.model,
-                input=f"{query} briefly and include sources citations.",
-                tools=[{"type": "websearch"}],
-                timeout=self.timeout
-            )
+            with slot or nullcontext():
+                response = self._create_response(
+                    self.timeout if timeout is None else min(timeout, self.timeout),
+                    model=model or self.model,
+                    input=f"{query} briefly and include sources citations.",
+                    tools=[self.build_web_search_tool(country_code)],
+                    # Без этого параметра вызов веб-поиска не возвращает список источников
+                    include=["web_search_call.action.sources"]
+                )
             
             # Извлечение источников из ответа
             sources = self.extract_sources(response)
@@ -57,7 +186,9 @@ class OpenAIClient:
             return {
                 "sources": sources,
                 "usage": usage,
-                "query": query
+                "query": query,
+                # Сырой вывод модели - для пересчета отчетов без повторных запросов
+                "output": self.to_plain(getattr(response, "output", None))
             }
             
         except Exception as e:
@@ -69,49 +200,166 @@ class OpenAIClient:
                 "error": str(e)
             }
     
+    def _create_response(self, timeout: float, **request) -> Any:
+        """
+        Запрос к Responses API через ключ с наибольшим запасом лимита
+        
+        Заголовки x-ratelimit-* каждого ответа обновляют состояние ключа.
+        При 429 ключ уходит на паузу, и запрос сразу повторяется на другом
+        ключе (если свободных нет - ждет в пределах таймаута). Ошибки сервера
+        и соединения повторяются до SERVER_ERROR_RETRIES раз.
+        
+        Args:
+            timeout: Общий срок запроса с ожиданием ключа и повторами, секунд
+            request: Параметры responses.create
+        
+        Raises:
+            Исключение SDK последней попытки или TimeoutError, если ни один ключ не освободился
+        """
+        deadline = time.monotonic() + timeout
+        rate_limit_retries = len(self.key_pool.keys)
+        server_retries = SERVER_ERROR_RETRIES
+        while True:
+            key = self.key_pool.acquire(max(0.0, deadline - time.monotonic()))
+            try:
+                raw = key.client.responses.with_raw_response.create(
+                    **request, timeout=max(1.0, deadline - time.monotonic())
+                )
+            except RateLimitError as e:
+                self.key_pool.release(
+                    key, e.response.headers, rate_limited=True,
+                    quota_exceeded=getattr(e, "code", None) == "insufficient_quota"
+                )
+                if rate_limit_retries <= 0 or time.monotonic() >= deadline:
+                    raise
+                rate_limit_retries -= 1
+                continue
+            except (APIConnectionError, InternalServerError) as e:
+                self.key_pool.release(key, e.response.headers if isinstance(e, APIStatusError) else None)
+                if server_retries <= 0 or isinstance(e, APITimeoutError) or time.monotonic() >= deadline:
+                    raise
+                server_retries -= 1
+                time.sleep(min(0.5 * (SERVER_ERROR_RETRIES - server_retries), max(0.0, deadline - time.monotonic())))
+                continue
+            except APIStatusError as e:
+                self.key_pool.release(key, e.response.headers)
+                raise
+            except BaseException:
+                self.key_pool.release(key)
+                raise
+            
+            self.key_pool.release(key, raw.headers)
+            return raw.parse()
+    
+    def key_stats(self) -> List[Dict[str, Any]]:
+        """Состояние ключей OpenAI (пусто до первого запроса)"""
+        return self.key_pool.stats() if self.key_pool is not None else []
+    
+    @staticmethod
+    def to_plain(value: Any) -> Any:
+        """Типизированный объект SDK в JSON-совместимую структуру для хранения"""
+        if hasattr(value, "model_dump"):
+            return value.model_dump(mode="json", exclude_none=True)
+        if isinstance(value, (list, tuple)):
+            return [OpenAIClient.to_plain(item) for item in value]
+        return value
+    
+    @staticmethod
+    def _field(obj: Any, name: str, default: Any = None) -> Any:
+        """Поле типизированного объекта SDK или словаря (ответ, сохраненный как JSON)"""
+        if isinstance(obj, dict):
+            return obj.get(name, default)
+        return getattr(obj, name, default)
+    
+    @staticmethod
+    def _source_key(url: str) -> str:
+        """Ключ дедупликации URL: без фрагмента, метки utm_source=openai и завершающего слэша"""
+        url = url.split("#", 1)[0]
+        for marker in ("?utm_source=openai", "&utm_source=openai"):
+            url = url.replace(marker, "")
+        return url.rstrip("/").lower()
+    
     def extract_sources(self, response) -> List[Dict[str, Any]]:
         """
         Извлечение источников из ответа OpenAI
         
+        За один проход по response.output собираются аннотации url_citation
+        из текста ответа (с позициями символов), источники вызовов веб-поиска
+        и источники старого формата (поля sources/url элемента вывода).
+        Цитаты идут первыми в порядке появления в тексте (у каждой части текста
+        свои позиции, поэтому части идут по порядку), затем источники поиска,
+        на которые ответ не сослался; повторяющиеся URL отбрасываются.
+        
         Args:
             response: Ответ от OpenAI API
             
         Returns:
             Список источников с URL и заголовками
         """
+        field = self._field
+        citations: List[Dict[str, Any]] = []
+        search_sources: List[Dict[str, Any]] = []
+        
         try:
-            sources = []
-            
-            # Получаем output items из ответа
-            output_items = getattr(response, "output", [])
-            
-            for item in output_items:
-                item_dict = item.__dict__ if hasattr(item, "__dict__") else {}
+            for item in field(response, "output") or []:
+                item_type = field(item, "type")
                 
-                # Ищем источники в различных полях
-                if "sources" in item_dict:
-                    for source in item_dict["sources"]:
-                        source_dict = source.__dict__ if hasattr(source, "__dict__") else source
-                        if isinstance(source_dict, dict) and "url" in source_dict:
-                            sources.append({
-                                "url": source_dict.get("url", ""),
-                                "title": source_dict.get("title", ""),
-                                "description": source_dict.get("description", "")
+                if item_type == "message":
+                    for part in field(item, "content") or []:
+                        if field(part, "type") != "output_text":
+                            continue
+                        part_citations = []
+                        for annotation in field(part, "annotations") or []:
+                            if field(annotation, "type") != "url_citation" or not field(annotation, "url"):
+                                continue
+                            part_citations.append({
+                                "url": field(annotation, "url"),
+                                "title": field(annotation, "title") or "",
+                                "description": "",
+                                "start_index": field(annotation, "start_index"),
+                                "end_index": field(annotation, "end_index")
                             })
+                        # Позиции считаются от начала текста этой части
+                        part_citations.sort(key=lambda c: c["start_index"] if c["start_index"] is not None else float("inf"))
+                        citations.extend(part_citations)
                 
-                # Дополнительная логика извлечения источников
-                if "url" in item_dict:
-                    sources.append({
-                        "url": item_dict.get("url", ""),
-                        "title": item_dict.get("title", ""),
-                        "description": item_dict.get("description", "")
-                    })
-            
-            return sources
-            
+                elif item_type == "web_search_call":
+                    action = field(item, "action")
+                    for source in (field(action, "sources") if action is not None else None) or []:
+                        if not field(source, "url"):
+                            continue
+                        search_sources.append({
+                            "url": field(source, "url"),
+                            "title": field(source, "title") or "",
+                            "description": ""
+                        })
+                
+                else:
+                    # Старый формат: источники прямо в элементе вывода или сам элемент - источник
+                    legacy = list(field(item, "sources") or [])
+                    if field(item, "url"):
+                        legacy.append(item)
+                    for source in legacy:
+                        if not field(source, "url"):
+                            continue
+                        search_sources.append({
+                            "url": field(source, "url"),
+                            "title": field(source, "title") or "",
+                            "description": field(source, "description") or ""
+                        })
         except Exception as e:
             print(f"Ошибка извлечения источников: {e}")
-            return []
+        
+        sources = []
+        seen = set()
+        for source in citations + search_sources:
+            key = self._source_key(source["url"])
+            if key in seen:
+                continue
+            seen.add(key)
+            sources.append(source)
+        
+        return sources
 
 # Глобальный экземпляр клиента
 openai_client = OpenAIClient()
\ No newline at end of file
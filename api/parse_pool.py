@@ -0,0 +1,170 @@
+"""
+Разбор загруженных файлов в пуле процессов
+
+pd.read_excel (openpyxl) и нормализация держат GIL секундами на больших
+книгах; в потоке процесса сервиса это задерживает цикл событий uvicorn
+и все остальные запросы. Пул процессов ограничен PARSE_POOL_WORKERS,
+а результат возвращается в компактном виде: одна строка на колонку.
+"""
+
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+import pandas as pd
+
+from api.config import MAX_ROWS_PROCESS, PARSE_POOL_WORKERS, PARSE_POOL_MAX_TASKS
+from api.file_processor import FileProcessor
+
+# Колонки результата разбора, которые использует конвейер
+PARSED_COLUMNS = ("Country", "Prompt", "Website", "target_domain", "tracked_domains")
+
+# Разделитель значений внутри колонки (в тексте ячеек не встречается)
+FIELD_SEPARATOR = "\x00"
+
+# Результат разбора: (количество строк, значения колонок PARSED_COLUMNS через FIELD_SEPARATOR)
+PackedRows = Tuple[int, Tuple[str, ...]]
+
+def pack_rows(df: pd.DataFrame) -> PackedRows:
+    """
+    Компактная форма результата разбора для передачи между процессами
+    
+    Вместо DataFrame (массивы объектов, блоки, индекс) передается одна
+    строка на колонку: ее pickle - это копия байтов, а не обход
+    десятков тысяч отдельных объектов.
+    
+    Args:
+        df: Данные после FileProcessor.normalize_dataframe
+    
+    Returns:
+        Tuple[количество строк, значения колонок]
+    """
+    columns = []
+    for column in PARSED_COLUMNS:
+        values = df[column].astype(str) if column in df.columns else pd.Series([""] * len(df), dtype=object)
+        # Символ NUL не несет смысла в тексте запроса и удаляется
+        columns.append(FIELD_SEPARATOR.join(values.str.replace(FIELD_SEPARATOR, "", regex=False)))
+    return len(df), tuple(columns)
+
+def unpack_rows(packed: PackedRows) -> pd.DataFrame:
+    """DataFrame из компактной формы (см. pack_rows)"""
+    count, columns = packed
+    return pd.DataFrame({
+        column: values.split(FIELD_SEPARATOR) if count else []
+        for column, values in zip(PARSED_COLUMNS, columns)
+    }, columns=list(PARSED_COLUMNS))
+
+def _process_file(file_path: str, max_rows: Optional[int]) -> PackedRows:
+    """Разбор файла в процессе пула"""
+    df, _ = FileProcessor.process_file(file_path, max_rows=max_rows)
+    return pack_rows(df)
+
+def _ready() -> bool:
+    """Пустая задача для запуска процессов пула заранее"""
+    return True
+
+class ParsePool:
+    """
+    Ограниченный пул процессов для FileProcessor
+    
+    Процессы запускаются через spawn (fork небезопасен в процессе с потоками)
+    и на Python 3.11+ перезапускаются после PARSE_POOL_MAX_TASKS файлов, чтобы
+    память после больших книг возвращалась системе. Если процессы недоступны
+    (например, в serverless без /dev/shm), разбор выполняется в текущем процессе.
+    """
+    
+    def __init__(self, workers: int = PARSE_POOL_WORKERS, max_tasks: int = PARSE_POOL_MAX_TASKS):
+        self.workers = workers
+        self.max_tasks = max_tasks
+        self.enabled = workers > 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+    
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Ленивое создание пула; None - разбор в текущем процессе"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._executor is None:
+                options = {}
+                if sys.version_info >= (3, 11):
+                    # До 3.11 у ProcessPoolExecutor нет max_tasks_per_child: процессы живут до остановки
+                    options["max_tasks_per_child"] = self.max_tasks or None
+                try:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        **options
+                    )
+                except (OSError, NotImplementedError, ValueError, TypeError) as e:
+                    print(f"Пул разбора файлов недоступен ({e}), разбор в процессе сервиса")
+                    self.enabled = False
+            return self._executor
+    
+    def _run(self, fn, *args):
+        """
+        Выполнение функции в пуле (блокирует вызывающий поток, но не GIL)
+        
+        Raises:
+            ValueError: Ошибка разбора или процесс пула завершился аварийно
+        """
+        executor = self._get_executor()
+        if executor is None:
+            return fn(*args)
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # Процесс убит (например, по памяти на огромной книге): следующий вызов создаст новый пул
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise ValueError("Не вдалося обробити файл: занадто великий або пошкоджений")
+    
+    def process_file(self, file_path: str, max_rows: Optional[int] = MAX_ROWS_PROCESS) -> Tuple[pd.DataFrame, int]:
+        """
+        FileProcessor.process_file в процессе пула
+        
+        Returns:
+            Tuple[DataFrame с колонками PARSED_COLUMNS, количество обработанных строк]
+        
+        Raises:
+            ValueError: Если файл не пройдет обработку
+        """
+        packed = self._run(_process_file, file_path, max_rows)
+        return unpack_rows(packed), packed[0]
+    
+    def preflight(self, content: bytes, file_extension: str) -> None:
+        """
+        FileProcessor.preflight: XLSX и архивы .zip в процессе пула,
+        начало CSV/TSV читается на месте
+        
+        Raises:
+            ValueError: Если файл не пройдет обработку
+        """
+        if file_extension.endswith((".xlsx", ".zip")):
+            self._run(FileProcessor.preflight, content, file_extension)
+        else:
+            FileProcessor.preflight(content, file_extension)
+    
+    def warm_up(self) -> None:
+        """Запуск процессов пула заранее, чтобы первая загрузка не ждала импорт pandas"""
+        executor = self._get_executor()
+        if executor is None:
+            return
+        try:
+            for future in [executor.submit(_ready) for _ in range(self.workers)]:
+                future.result()
+        except Exception as e:
+            print(f"Parse pool warm-up warning: {e}")
+    
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# Глобальный пул разбора файлов
+parse_pool = ParsePool()
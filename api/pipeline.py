@@ -0,0 +1,492 @@
+"""
+Общий конвейер анализа строк: поиск с веб-источниками и расчет метрик
+"""
+
+import time
+from collections import defaultdict
+from concurrent.futures import Future, as_completed, wait
+from functools import partial
+from itertools import chain, zip_longest
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import pandas as pd
+
+from api.config import (
+    ROW_CACHE_ENABLED, ROW_CACHE_MAX_AGE_HOURS, RAW_STORE_ENABLED,
+    REPORT_CACHE_ENABLED, REPORT_CACHE_TTL_HOURS
+)
+from api.database import db
+from api.file_processor import FileProcessor
+from api.geo import country_to_iso
+from api.engines import SearchEngine, engines as default_engines
+from api.metrics import MetricsCalculator
+from api.openai_client import openai_client
+from api.job_stats import JobStats, service_stats
+from api.scheduler import fair_scheduler
+from api.aggregation import JobAggregator
+from api.jobs import Job, JobCancelledError, JobInterruptedError
+
+def report_cache_key(engines: Optional[List[SearchEngine]] = None) -> Tuple[str, int]:
+    """
+    Ключ готового отчета помимо хеша файла: набор движков и текущее окно свежести
+    
+    Returns:
+        Tuple[ключ движков, номер окна свежести]
+    """
+    engines = engines or default_engines
+    bucket = int(time.time() // (REPORT_CACHE_TTL_HOURS * 3600))
+    return ",".join(engine.name for engine in engines), bucket
+
+def get_cached_report(file_hash: str) -> Optional[Tuple[bytes, int]]:
+    """
+    Готовый отчет для файла с тем же содержимым, если он еще свежий
+    
+    Returns:
+        Tuple[CSV отчета, количество запросов] или None
+    """
+    if not REPORT_CACHE_ENABLED:
+        return None
+    try:
+        model_key, bucket = report_cache_key()
+        return db.get_report(file_hash, model_key, bucket)
+    except Exception as e:
+        print(f"Database warning: {e}")
+        return None
+
+def save_cached_report(file_hash: str, csv_content: bytes, queries_count: int) -> None:
+    """
+    Сохранение отчета для повторной выдачи по тому же содержимому файла
+    """
+    if not REPORT_CACHE_ENABLED:
+        return
+    try:
+        model_key, bucket = report_cache_key()
+        db.save_report(file_hash, model_key, bucket, csv_content, queries_count)
+    except Exception as e:
+        print(f"Database warning: {e}")
+
+def get_row_sources(country: str, prompt: str, engine_name: str) -> Optional[list]:
+    """
+    Получение свежих источников для строки из кэша, если он включен
+    """
+    if not ROW_CACHE_ENABLED:
+        return None
+    try:
+        row_hash = FileProcessor.compute_row_hash(country, prompt)
+        return db.get_row_result(row_hash, engine_name, ROW_CACHE_MAX_AGE_HOURS)
+    except Exception as e:
+        print(f"Database warning: {e}")
+        return None
+
+def save_row_sources(country: str, prompt: str, engine_name: str, sources: list) -> None:
+    """
+    Сохранение источников строки для повторного использования
+    """
+    try:
+        row_hash = FileProcessor.compute_row_hash(country, prompt)
+        db.save_row_result(row_hash, engine_name, sources)
+    except Exception as e:
+        print(f"Database warning: {e}")
+
+def record_search_metrics(collector: JobStats, country: str, seconds: float, response_data: Dict[str, Any]) -> None:
+    """
+    Метрики одного запроса: задержка по стране, задержка и стоимость по
+    моделям (уровням) движка, эскалации на тяжелую модель и ошибки
+    
+    Страна в метках - ISO код или "other": значения Country приходят из
+    файлов пользователей и публикуются в /metrics.
+    """
+    country = country_to_iso(country) or "other"
+    collector.record_latency(f"country:{country}", seconds)
+    collector.increment("requests")
+    for tier in response_data.get('tiers', ()):
+        collector.record_latency(f"tier:{tier['model']}", tier['seconds'])
+        collector.increment(f"cost_usd:{tier['model']}", tier['cost'])
+    if response_data.get('escalated'):
+        collector.increment("escalated")
+    if 'error' in response_data:
+        collector.increment("errors")
+        collector.increment(f"errors:{country}")
+
+def search_row_sources(
+    engine: SearchEngine,
+    country: str,
+    prompt: str,
+    stats: Optional[JobStats] = None,
+    job: Optional[Job] = None
+) -> Dict[str, Any]:
+    """
+    Новый запрос источников для одной строки одного движка
+    
+    Returns:
+        Ответ движка (sources, usage, ...)
+    
+    Raises:
+        JobCancelledError: Если задача отменена или ее срок истек
+    """
+    timeout = None
+    if job is not None:
+        job.check()
+        # Срок задачи ограничивает таймаут каждого запроса
+        timeout = job.remaining()
+    
+    started = time.monotonic()
+    response_data = engine.search(prompt, country, timeout=timeout)
+    elapsed = time.monotonic() - started
+    if job is not None and 'error' in response_data:
+        # Ошибка из-за прерывания задачи не должна попасть в отчет как пустой результат
+        job.check()
+    # Метрики задачи и окно сервиса для /metrics
+    record_search_metrics(service_stats, country, elapsed, response_data)
+    if stats is not None:
+        record_search_metrics(stats, country, elapsed, response_data)
+    if ROW_CACHE_ENABLED and 'error' not in response_data:
+        # Сохраняем и при отключенном чтении - свежий результат полезен обычным загрузкам
+        save_row_sources(country, prompt, engine.name, response_data['sources'])
+    return response_data
+
+def interleave_by_country(rows: List[tuple]) -> List[int]:
+    """
+    Порядок отправки строк: по очереди из каждой страны
+    
+    Args:
+        rows: Кортежи (country, prompt, target_domain)
+    
+    Returns:
+        Индексы строк, чередующие страны в порядке их первого появления
+    """
+    groups: Dict[str, List[int]] = defaultdict(list)
+    for index, (country, _, _) in enumerate(rows):
+        groups[country].append(index)
+    return [
+        index
+        for index in chain.from_iterable(zip_longest(*groups.values()))
+        if index is not None
+    ]
+
+def row_domains(df: pd.DataFrame) -> List[List[str]]:
+    """
+    Отслеживаемые домены каждой строки, основной домен первым
+    
+    Строки без tracked_domains (контрольные точки и наборы отслеживания,
+    сохраненные до появления колонки) отслеживают только target_domain.
+    """
+    if 'tracked_domains' not in df.columns:
+        return [[domain] for domain in df['target_domain']]
+    return [
+        tracked.split(",") if isinstance(tracked, str) and tracked else [domain]
+        for domain, tracked in zip(df['target_domain'], df['tracked_domains'])
+    ]
+
+def build_report_rows(sources: list, target_domains: List[str], country: str, engine_name: str, engines_count: int) -> List[Dict[str, Any]]:
+    """
+    Строки отчета для одного запроса одного движка: по строке на каждый домен
+    
+    Args:
+        sources: Источники ответа
+        target_domains: Отслеживаемые домены строки
+        country: Страна строки
+        engine_name: Имя движка
+        engines_count: Количество движков в задаче
+    """
+    # Расчет метрик: один разбор источников на все домены строки
+    metrics_rows = MetricsCalculator.calculate_metrics_for_domains(
+        sources=sources,
+        target_domains=target_domains,
+        country=country
+    )
+    if engines_count > 1:
+        # Разбивка по движкам: отдельная строка отчета на каждый движок
+        metrics_rows = [{"Engine": engine_name, **metrics_data} for metrics_data in metrics_rows]
+    return metrics_rows
+
+def completed_key(index: int, engine: SearchEngine) -> str:
+    """Ключ результата строки в контрольной точке задачи"""
+    return f"{index}|{engine.name}"
+
+def completed_rows(
+    df: pd.DataFrame,
+    completed: Dict[str, list],
+    engines: Optional[List[SearchEngine]] = None
+) -> Tuple[pd.DataFrame, Dict[str, list]]:
+    """
+    Строки прерванной задачи, по которым готовы ответы всех движков
+    
+    Args:
+        df: Строки задачи
+        completed: Результаты из JobInterruptedError.completed
+        engines: Движки задачи (по умолчанию SEARCH_ENGINES)
+    
+    Returns:
+        Tuple[готовые строки, их результаты с ключами по новым индексам] -
+        для analyze_rows(..., completed=...) без новых запросов
+    """
+    engines = engines or default_engines
+    positions = [
+        index for index in range(len(df))
+        if all(completed_key(index, engine) in completed for engine in engines)
+    ]
+    remapped = {
+        completed_key(new_index, engine): completed[completed_key(index, engine)]
+        for new_index, index in enumerate(positions)
+        for engine in engines
+    }
+    return df.iloc[positions].reset_index(drop=True), remapped
+
+def plan_rows(
+    rows: List[tuple],
+    engines: List[SearchEngine],
+    use_cache: bool,
+    completed: Optional[Dict[str, list]],
+    stats: Optional[JobStats],
+    job: Optional[Job]
+) -> Tuple[Dict[Tuple[int, int], list], List[Tuple[int, int]], List[Callable[[], Dict[str, Any]]]]:
+    """
+    Разделение запросов (строка × движок) на готовые и новые
+    
+    Returns:
+        Tuple[источники готовых запросов, ключи новых запросов, функции новых запросов]
+        (ключ - пара индекс строки, индекс движка; новые - с чередованием стран)
+    """
+    use_cache = use_cache and ROW_CACHE_ENABLED
+    completed = completed or {}
+    sources_by_row: Dict[Tuple[int, int], list] = {}
+    pending_keys: List[Tuple[int, int]] = []
+    pending_tasks = []
+    for index in interleave_by_country(rows):
+        country, prompt, _ = rows[index]
+        for engine_index, engine in enumerate(engines):
+            cached = completed.get(completed_key(index, engine))
+            if cached is None and use_cache:
+                cached = get_row_sources(country, prompt, engine.name)
+            if cached is not None:
+                sources_by_row[(index, engine_index)] = cached
+                continue
+            pending_keys.append((index, engine_index))
+            pending_tasks.append(partial(search_row_sources, engine, country, prompt, stats, job))
+    return sources_by_row, pending_keys, pending_tasks
+
+def analyze_rows(
+    df: pd.DataFrame,
+    file_hash: str,
+    use_cache: bool = True,
+    engines: Optional[List[SearchEngine]] = None,
+    stats: Optional[JobStats] = None,
+    tenant: Optional[str] = None,
+    priority: str = "free",
+    job: Optional[Job] = None,
+    completed: Optional[Dict[str, list]] = None,
+    aggregator: Optional[JobAggregator] = None,
+    append_raw: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Анализ всех строк нормализованного DataFrame
+    
+    Строки из кэша считаются сразу, остальные запросы (строка × движок)
+    уходят в общий справедливый планировщик. Все движки опрашиваются
+    параллельно, поэтому время задачи определяется самым медленным движком.
+    Строки отправляются с чередованием стран, чтобы крупная страна не
+    задерживала мелкие.
+    
+    Args:
+        df: Данные после FileProcessor.process_file
+        file_hash: Хеш исходного файла
+        use_cache: Использовать сохраненные результаты строк
+        engines: Движки для опроса (по умолчанию SEARCH_ENGINES)
+        stats: Сборщик метрик задачи (задержки по странам)
+        tenant: Владелец задачи для справедливой очереди (по умолчанию хеш файла)
+        priority: Приоритет задачи (ключ JOB_PRIORITY_WEIGHTS)
+        job: Задача со сроком и отменой
+        completed: Результаты строк из контрольной точки прерванной задачи
+        aggregator: Сводка по задаче, пополняемая по мере расчета строк отчета
+        append_raw: Дописать ответы к уже сохраненным строкам задачи
+            (раунды оценки), а не заменить их
+    
+    Returns:
+        Список словарей с метриками: по строкам, внутри строки - по движкам,
+        внутри движка - по отслеживаемым доменам
+    
+    Raises:
+        JobInterruptedError: Если задача прервана; содержит готовые результаты строк
+            и запросы, которые еще выполняются
+    """
+    engines = engines or default_engines
+    rows = list(df[['Country', 'Prompt', 'target_domain']].itertuples(index=False, name=None))
+    domains_by_row = row_domains(df)
+    
+    sources_by_row, pending_keys, pending_tasks = plan_rows(
+        rows, engines, use_cache, completed, stats, job
+    )
+    
+    reused_rows = len(sources_by_row)
+    if stats is not None and reused_rows:
+        stats.increment("reused", reused_rows)
+    responses_by_row: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    if pending_tasks:
+        futures = fair_scheduler.submit_job(pending_tasks, tenant or file_hash, priority)
+        wait_for_rows(futures, job)
+        
+        interrupted_reason = None
+        in_flight: Dict[str, Future] = {}
+        for (index, engine_index), future in zip(pending_keys, futures):
+            if not future.done():
+                # Запрос еще выполняется: задача прервана, ждать его здесь не нужно
+                in_flight[completed_key(index, engines[engine_index])] = future
+                interrupted_reason = job.cancel_reason if job is not None else "cancelled"
+                continue
+            if future.cancelled() or isinstance(future.exception(), JobCancelledError):
+                interrupted_reason = job.cancel_reason if job is not None else "cancelled"
+                continue
+            responses_by_row[(index, engine_index)] = future.result()
+            sources_by_row[(index, engine_index)] = future.result()['sources']
+        
+        if interrupted_reason is not None:
+            raise JobInterruptedError(interrupted_reason, {
+                completed_key(index, engines[engine_index]): sources
+                for (index, engine_index), sources in sources_by_row.items()
+            }, in_flight)
+    
+    if job is not None and RAW_STORE_ENABLED:
+        store_raw_responses(
+            job.id, rows, domains_by_row, engines, sources_by_row, responses_by_row, append=append_raw
+        )
+    
+    all_results: List[Dict[str, Any]] = []
+    for index, (country, prompt, _) in enumerate(rows):
+        for engine_index, engine in enumerate(engines):
+            metrics_rows = build_report_rows(
+                sources_by_row[(index, engine_index)], domains_by_row[index], country, engine.name, len(engines)
+            )
+            if aggregator is not None:
+                aggregator.add_many(metrics_rows)
+            all_results.extend(metrics_rows)
+    
+    if reused_rows:
+        print(f"Повторно использовано {reused_rows} из {len(rows) * len(engines)} результатов")
+    
+    return all_results
+
+def iter_row_results(
+    df: pd.DataFrame,
+    file_hash: str,
+    engines: Optional[List[SearchEngine]] = None,
+    stats: Optional[JobStats] = None,
+    tenant: Optional[str] = None,
+    priority: str = "free",
+    job: Optional[Job] = None,
+    use_cache: bool = True
+) -> Iterator[Dict[str, Any]]:
+    """
+    Результаты строк по мере готовности (для потоковой выдачи)
+    
+    Строки из кэша выдаются сразу, новые запросы идут через общий
+    планировщик и выдаются в порядке завершения. Если потребитель
+    перестал читать (клиент отключился), задача отменяется и не начатые
+    запросы снимаются из очереди.
+    
+    Args:
+        df: Данные после FileProcessor.normalize_dataframe
+        file_hash: Ключ набора строк (владелец очереди по умолчанию)
+        engines: Движки для опроса (по умолчанию SEARCH_ENGINES)
+        stats: Сборщик метрик
+        tenant: Владелец для справедливой очереди
+        priority: Приоритет (ключ JOB_PRIORITY_WEIGHTS)
+        job: Задача со сроком и отменой
+        use_cache: Использовать сохраненные результаты строк
+    
+    Yields:
+        {"row": индекс строки, "engine": имя движка, "results": строки отчета[, "error": ...]}
+    """
+    engines = engines or default_engines
+    rows = list(df[['Country', 'Prompt', 'target_domain']].itertuples(index=False, name=None))
+    domains_by_row = row_domains(df)
+    
+    def result(index: int, engine_index: int, sources: list) -> Dict[str, Any]:
+        engine = engines[engine_index]
+        return {
+            "row": index,
+            "engine": engine.name,
+            "results": build_report_rows(sources, domains_by_row[index], rows[index][0], engine.name, len(engines))
+        }
+    
+    sources_by_row, pending_keys, pending_tasks = plan_rows(
+        rows, engines, use_cache, None, stats, job
+    )
+    for (index, engine_index), sources in sources_by_row.items():
+        yield result(index, engine_index, sources)
+    
+    futures = fair_scheduler.submit_job(pending_tasks, tenant or file_hash, priority) if pending_tasks else []
+    keys = dict(zip(futures, pending_keys))
+    finished = False
+    try:
+        for future in as_completed(futures):
+            index, engine_index = keys[future]
+            if future.cancelled() or future.exception() is not None:
+                error = "cancelled" if future.cancelled() else str(future.exception())
+                yield {"row": index, "engine": engines[engine_index].name, "results": [], "error": error}
+                continue
+            response_data = future.result()
+            item = result(index, engine_index, response_data['sources'])
+            if 'error' in response_data:
+                item["error"] = response_data['error']
+            yield item
+        finished = True
+    finally:
+        if not finished:
+            if job is not None:
+                job.cancel("disconnected")
+            for future in futures:
+                future.cancel()
+
+def store_raw_responses(
+    job_id: str,
+    rows: List[tuple],
+    domains_by_row: List[List[str]],
+    engines: List[SearchEngine],
+    sources_by_row: Dict[Tuple[int, int], list],
+    responses_by_row: Dict[Tuple[int, int], Dict[str, Any]],
+    append: bool = False
+) -> None:
+    """
+    Сохранение ответов задачи для последующего пересчета отчета без запросов
+    
+    Для строк из кэша сохраняются только источники. С append строки
+    дописываются после уже сохраненных строк задачи.
+    """
+    responses = []
+    for (index, engine_index), sources in sources_by_row.items():
+        response = responses_by_row.get((index, engine_index))
+        payload: Dict[str, Any] = {"sources": sources, "cached": response is None}
+        if response is not None:
+            payload["usage"] = openai_client.to_plain(response.get("usage"))
+            payload["output"] = response.get("output")
+            if "error" in response:
+                payload["error"] = response["error"]
+        responses.append((index, engines[engine_index].name, payload))
+    
+    try:
+        db.save_raw_responses(
+            job_id,
+            [
+                {"Country": country, "Prompt": prompt, "target_domain": domain, "tracked_domains": ",".join(domains)}
+                for (country, prompt, domain), domains in zip(rows, domains_by_row)
+            ],
+            [engine.name for engine in engines],
+            responses,
+            append=append
+        )
+    except Exception as e:
+        print(f"Database warning: {e}")
+
+def wait_for_rows(futures: List[Future], job: Optional[Job]) -> None:
+    """
+    Ожидание запросов задачи; при отмене снимает из очереди еще не начатые
+    и сразу возвращает управление - уже выполняющиеся запросы остаются
+    в JobInterruptedError.in_flight, чтобы контрольная точка не ждала их
+    """
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=0.5)
+        if job is not None and job.cancelled:
+            for future in pending:
+                future.cancel()
+            return
@@ -0,0 +1,94 @@
+"""
+Пересчет отчетов по сохраненным ответам движков без запросов к API
+
+Использование:
+    python -m api.recompute JOB_ID [-o report.csv] [--reextract]
+    python -m api.recompute JOB_ID JOB_ID ... -o reports_dir
+    python -m api.recompute --all -o reports_dir
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+import pandas as pd
+
+from api.database import db
+from api.openai_client import openai_client
+from api.pipeline import build_report_rows
+
+def recompute_job(job_id: str, reextract: bool = False) -> Optional[pd.DataFrame]:
+    """
+    Пересчет отчета задачи по сохраненным ответам
+    
+    Args:
+        job_id: Идентификатор задачи
+        reextract: Заново извлечь источники из сырого вывода модели
+            (учитывает изменения extract_sources, а не только формул метрик)
+    
+    Returns:
+        DataFrame отчета или None, если задача не найдена
+    """
+    job_input = db.get_job_input(job_id)
+    if job_input is None:
+        return None
+    rows, engine_names = job_input
+    
+    responses: Dict[tuple, Dict[str, Any]] = {
+        (row_index, engine): payload
+        for row_index, engine, payload in db.iter_raw_responses(job_id)
+    }
+    
+    report: List[Dict[str, Any]] = []
+    for index, row in enumerate(rows):
+        target_domains = (row.get("tracked_domains") or row["target_domain"]).split(",")
+        for engine_name in engine_names:
+            payload = responses.get((index, engine_name), {})
+            sources = payload.get("sources", [])
+            if reextract and payload.get("output"):
+                sources = openai_client.extract_sources({"output": payload["output"]})
+            report.extend(build_report_rows(
+                sources, target_domains, row["Country"], engine_name, len(engine_names)
+            ))
+    
+    return pd.DataFrame(report)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Пересчет отчетов AI Visibility по сохраненным ответам")
+    parser.add_argument("job_ids", nargs="*", help="Идентификаторы задач")
+    parser.add_argument("--all", action="store_true", help="Пересчитать все сохраненные задачи")
+    parser.add_argument("-o", "--output", help="CSV файл (одна задача) или каталог (несколько задач)")
+    parser.add_argument("--reextract", action="store_true", help="Заново извлечь источники из сырого вывода")
+    args = parser.parse_args(argv)
+    
+    job_ids = db.list_stored_jobs() if args.all else args.job_ids
+    if not job_ids:
+        parser.error("укажите идентификаторы задач или --all")
+    if len(job_ids) > 1 and not args.output:
+        parser.error("для нескольких задач укажите каталог отчетов -o")
+    
+    to_directory = len(job_ids) > 1 or (args.output and os.path.isdir(args.output))
+    if to_directory and args.output:
+        os.makedirs(args.output, exist_ok=True)
+    
+    started = time.monotonic()
+    total_rows = 0
+    for job_id in job_ids:
+        report_df = recompute_job(job_id, reextract=args.reextract)
+        if report_df is None:
+            print(f"Задача {job_id} не найдена", file=sys.stderr)
+            continue
+        total_rows += len(report_df)
+        
+        if not args.output:
+            report_df.to_csv(sys.stdout, index=False)
+            continue
+        path = os.path.join(args.output, f"{job_id}.csv") if to_directory else args.output
+        report_df.to_csv(path, index=False, encoding="utf-8")
+    
+    print(f"Пересчитано {total_rows} строк из {len(job_ids)} задач за {time.monotonic() - started:.2f}с", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
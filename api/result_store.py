@@ -0,0 +1,161 @@
+"""
+Колоночное хранилище результатов задач (Parquet) и потоковая выдача отчетов
+"""
+
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Iterator, Optional
+import pandas as pd
+
+from api.config import (
+    RESULT_STORE_ENABLED, RESULTS_DIR, RESULT_RETENTION_DAYS, RESULT_STREAM_BATCH_ROWS
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow необязателен: без него результаты задач не сохраняются
+    pa = pq = None
+
+# Идентификатор задачи - uuid4 hex; проверка защищает путь к файлу
+JOB_ID_REGEX = re.compile(r"^[0-9a-f]{32}$")
+
+class ResultStore:
+    """
+    Отчеты задач в файлах Parquet на локальном диске
+    
+    Файл читается через memory map группами строк, поэтому выдача CSV/XLSX
+    не собирает весь отчет в памяти, а Parquet отдается файлом как есть.
+    """
+    
+    def __init__(self, directory: str = RESULTS_DIR, enabled: bool = RESULT_STORE_ENABLED):
+        self.directory = directory
+        self.enabled = enabled and pa is not None
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+        if enabled and pa is None:
+            print(
+                "⚠️ pyarrow не установлен - хранение результатов задач отключено, "
+                "GET /jobs/{job_id}/report будет отвечать 404 (установите requirements.txt "
+                "или задайте RESULT_STORE_ENABLED=false)"
+            )
+    
+    def path(self, job_id: str) -> Optional[str]:
+        """Путь к файлу результатов задачи или None, если его нет"""
+        if not JOB_ID_REGEX.match(job_id):
+            return None
+        path = os.path.join(self.directory, f"{job_id}.parquet")
+        return path if os.path.exists(path) else None
+    
+    @staticmethod
+    def to_table(report_df: pd.DataFrame) -> "pa.Table":
+        """
+        Отчет в таблицу Arrow
+        
+        Пустые строки в колонках с числами ("Позиція") становятся null,
+        чтобы колонка получила числовой тип.
+        """
+        report_df = report_df.copy()
+        for column in report_df.columns[report_df.dtypes == object]:
+            report_df[column] = report_df[column].where(report_df[column] != "", None)
+        return pa.Table.from_pandas(report_df, preserve_index=False)
+    
+    def write(self, job_id: str, report_df: pd.DataFrame) -> Optional[str]:
+        """
+        Сохранение отчета задачи
+        
+        Args:
+            job_id: Идентификатор задачи
+            report_df: Отчет задачи
+        
+        Returns:
+            Путь к файлу или None, если хранение отключено
+        """
+        if not self.enabled:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{job_id}.parquet")
+        self.write_file(report_df, path)
+        self.prune()
+        return path
+    
+    def write_file(self, report_df: pd.DataFrame, path: str) -> None:
+        """
+        Запись отчета в Parquet с группами по RESULT_STREAM_BATCH_ROWS строк
+        
+        Raises:
+            RuntimeError: Если pyarrow не установлен
+        """
+        if pa is None:
+            raise RuntimeError("Для Parquet нужен пакет pyarrow")
+        tmp_path = f"{path}.tmp"
+        pq.write_table(self.to_table(report_df), tmp_path, row_group_size=RESULT_STREAM_BATCH_ROWS)
+        os.replace(tmp_path, path)
+    
+    def open(self, path: str) -> "pq.ParquetFile":
+        """Файл результатов через memory map (для выдачи и аналитики без копирования)"""
+        return pq.ParquetFile(pa.memory_map(path, "r"))
+    
+    def prune(self) -> None:
+        """Удаление файлов старше RESULT_RETENTION_DAYS (не чаще раза в час)"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < 3600:
+                return
+            self._last_prune = now
+        cutoff = now - RESULT_RETENTION_DAYS * 86400
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".parquet") and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+        except OSError as e:
+            print(f"Result store warning: {e}")
+    
+    def iter_frames(self, path: str) -> Iterator[pd.DataFrame]:
+        """Отчет группами строк в виде DataFrame"""
+        for batch in self.open(path).iter_batches(batch_size=RESULT_STREAM_BATCH_ROWS):
+            # integer_object_nulls: позиция остается целым числом, null - пустой ячейкой
+            yield batch.to_pandas(integer_object_nulls=True)
+    
+    def iter_csv(self, path: str) -> Iterator[bytes]:
+        """
+        Потоковая выдача отчета в CSV того же вида, что и во вложении письма
+        """
+        header = True
+        for frame in self.iter_frames(path):
+            buffer = io.StringIO()
+            frame.to_csv(buffer, index=False, header=header)
+            header = False
+            yield buffer.getvalue().encode("utf-8")
+        if header:
+            # Отчет без строк: только заголовок
+            yield (",".join(self.open(path).schema_arrow.names) + "\n").encode("utf-8")
+    
+    def write_xlsx(self, path: str) -> str:
+        """
+        Отчет в XLSX во временном файле (openpyxl write_only пишет строки
+        потоком, без построения листа в памяти)
+        
+        Returns:
+            Путь к временному файлу; удаляет вызывающий
+        """
+        from openpyxl import Workbook
+        
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Report")
+        sheet.append(self.open(path).schema_arrow.names)
+        for frame in self.iter_frames(path):
+            for row in frame.itertuples(index=False, name=None):
+                sheet.append([None if value is None or value != value else value for value in row])
+        
+        fd, xlsx_path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        workbook.save(xlsx_path)
+        return xlsx_path
+
+# Глобальное хранилище результатов
+result_store = ResultStore()
@@ -0,0 +1,353 @@
+"""
+Оценочный режим для больших наборов запросов: стратифицированная выборка
+по стране и сайту, доверительные интервалы по доменам и наращивание
+выборки до заданной точности
+"""
+
+import math
+import random
+import sys
+from collections import defaultdict
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Tuple
+import pandas as pd
+
+from api.config import (
+    ESTIMATE_PRECISION, ESTIMATE_CONFIDENCE, ESTIMATE_INITIAL_PER_STRATUM, ESTIMATE_MAX_QUERIES
+)
+from api.engines import SearchEngine, engines as default_engines
+from api.job_stats import JobStats
+from api.jobs import Job, JobInterruptedError
+from api.pipeline import analyze_rows, build_report_rows, row_domains
+
+# Колонки таблицы оценок
+ESTIMATE_COLUMNS = [
+    "Страна", "Целевой домен", "Rows", "Sampled",
+    "AIV-Score", "AIV-Score ±", "Inclusion Rate %", "Inclusion Rate ± %", "Precise"
+]
+
+# Значение колонки "Страна" в оценке домена по всем странам
+ALL_COUNTRIES = "All"
+
+Stratum = Tuple[str, str]  # (страна, основной домен строки)
+Cell = Tuple[str, str]  # (страна, отслеживаемый домен)
+
+class _Moments:
+    """Суммы наблюдений одной ячейки в одной страте"""
+    
+    __slots__ = ("n", "aiv", "aiv_sq", "visible", "visible_sq")
+    
+    def __init__(self):
+        self.n = 0
+        self.aiv = self.aiv_sq = 0.0
+        self.visible = self.visible_sq = 0.0
+    
+    def add(self, aiv: float, visible: float) -> None:
+        self.n += 1
+        self.aiv += aiv
+        self.aiv_sq += aiv * aiv
+        self.visible += visible
+        self.visible_sq += visible * visible
+    
+    def variance(self, total: float, total_sq: float) -> float:
+        """Выборочная дисперсия (n - 1 в знаменателе)"""
+        return max(0.0, (total_sq - total * total / self.n) / (self.n - 1))
+    
+    def visible_variance(self) -> float:
+        """
+        Дисперсия доли видимости не меньше p(1 - p) для p = (x + 1) / (n + 2):
+        при 0% или 100% в выборке интервал не схлопывается в точку
+        """
+        adjusted = (self.visible + 1) / (self.n + 2)
+        return max(self.variance(self.visible, self.visible_sq), adjusted * (1 - adjusted))
+
+class StratifiedEstimator:
+    """
+    Оценка AIV-Score и доли видимости по доменам без запросов по всем строкам
+    
+    Страта - строки одной страны с одним основным доменом (Website). Строки
+    каждой страты перемешиваются один раз, и каждый раунд берет следующие
+    строки перестановки: первый раунд - до initial_per_stratum строк каждой
+    страты, следующие - удваивают выборку еще неточных ячеек с размещением
+    по стратам пропорционально их размеру. Ячейка (страна, отслеживаемый домен) оценивается
+    взвешенным по числу строк средним по стратам с поправкой на конечную
+    совокупность; ячейка точна, когда полуширина интервалов AIV-Score
+    и доли видимости (в процентных пунктах) не больше precision.
+    """
+    
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        precision: float = ESTIMATE_PRECISION,
+        confidence: float = ESTIMATE_CONFIDENCE,
+        initial_per_stratum: int = ESTIMATE_INITIAL_PER_STRATUM,
+        max_rows: int = ESTIMATE_MAX_QUERIES,
+        seed: int = 0
+    ):
+        self.df = df
+        self.precision = precision
+        self.confidence = confidence
+        self.initial_per_stratum = max(2, initial_per_stratum)
+        self.max_rows = max_rows
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.domains_by_row = row_domains(df)
+        
+        self.strata: Dict[Stratum, List[int]] = defaultdict(list)
+        self.row_stratum: List[Stratum] = []
+        # Число строк каждой ячейки в каждой страте известно по всему файлу
+        self.population: Dict[Cell, Dict[Stratum, int]] = defaultdict(lambda: defaultdict(int))
+        for index, (country, domains) in enumerate(zip(df['Country'], self.domains_by_row)):
+            stratum = (country, domains[0])
+            self.strata[stratum].append(index)
+            self.row_stratum.append(stratum)
+            for domain in domains:
+                self.population[(country, domain)][stratum] += 1
+        
+        rng = random.Random(seed)
+        for indexes in self.strata.values():
+            rng.shuffle(indexes)
+        self.taken: Dict[Stratum, int] = dict.fromkeys(self.strata, 0)
+        self.moments: Dict[Cell, Dict[Stratum, _Moments]] = defaultdict(dict)
+        self.sampled = 0
+        self.rounds = 0
+        self.interrupted: Optional[str] = None
+    
+    def next_batch(self) -> List[int]:
+        """
+        Строки следующего раунда
+        
+        Returns:
+            Индексы строк df (пусто - выборка исчерпана или достигнут max_rows)
+        """
+        budget = (self.max_rows or len(self.row_stratum)) - self.sampled
+        if budget <= 0:
+            return []
+        
+        if self.rounds == 0:
+            wanted = dict.fromkeys(self.strata, self.initial_per_stratum)
+        else:
+            wanted: Dict[Stratum, int] = {}
+            for cell in self.imprecise_cells():
+                # Выборка неточной ячейки удваивается и распределяется по стратам
+                # пропорционально числу строк ячейки в страте
+                population = self.population[cell]
+                cell_rows = sum(population.values())
+                target = 2 * max(self.initial_per_stratum, sum(self.taken[stratum] for stratum in population))
+                for stratum, size in population.items():
+                    extra = math.ceil(target * size / cell_rows) - self.taken[stratum]
+                    wanted[stratum] = max(wanted.get(stratum, 0), extra)
+        wanted = {
+            stratum: min(count, len(self.strata[stratum]) - self.taken[stratum])
+            for stratum, count in wanted.items()
+        }
+        wanted = {stratum: count for stratum, count in wanted.items() if count > 0}
+        
+        total = sum(wanted.values())
+        if total > budget:
+            # Бюджет делится между стратами пропорционально запрошенному
+            wanted = {stratum: max(1, count * budget // total) for stratum, count in wanted.items()}
+        
+        batch: List[int] = []
+        for stratum, count in wanted.items():
+            count = min(count, budget - len(batch))
+            if count <= 0:
+                break
+            start = self.taken[stratum]
+            batch.extend(self.strata[stratum][start:start + count])
+            self.taken[stratum] += count
+        
+        if batch:
+            self.rounds += 1
+            self.sampled += len(batch)
+        return batch
+    
+    def add_row(self, index: int, engine_rows: List[List[Dict[str, Any]]]) -> None:
+        """
+        Учет результатов одной строки выборки
+        
+        Args:
+            index: Индекс строки df
+            engine_rows: Строки отчета по каждому движку (в порядке доменов строки)
+        """
+        stratum = self.row_stratum[index]
+        domains = self.domains_by_row[index]
+        # Единица выборки - строка: при нескольких движках берется среднее по движкам
+        for position, domain in enumerate(domains):
+            values = [rows[position] for rows in engine_rows if position < len(rows)]
+            if not values:
+                continue
+            aiv = sum(float(metrics["AIV-Score"]) for metrics in values) / len(values)
+            visible = sum(1.0 for metrics in values if metrics["Позиція"] not in ("", None)) / len(values)
+            moments = self.moments[(stratum[0], domain)].get(stratum)
+            if moments is None:
+                moments = self.moments[(stratum[0], domain)][stratum] = _Moments()
+            moments.add(aiv, visible)
+    
+    def add_results(self, batch: List[int], results: List[Dict[str, Any]], engines_count: int) -> None:
+        """
+        Учет результатов раунда (см. analyze_rows: по строкам, движкам, доменам)
+        """
+        offset = 0
+        for index in batch:
+            width = len(self.domains_by_row[index])
+            self.add_row(index, [
+                results[offset + engine * width:offset + (engine + 1) * width]
+                for engine in range(engines_count)
+            ])
+            offset += engines_count * width
+    
+    def add_completed(self, batch: List[int], completed: Dict[str, list], engines: List[SearchEngine]) -> None:
+        """Учет готовых строк прерванного раунда (JobInterruptedError.completed)"""
+        engine_rows: Dict[int, List[List[Dict[str, Any]]]] = defaultdict(list)
+        for key, sources in completed.items():
+            position, _, engine_name = key.partition("|")
+            index = batch[int(position)]
+            engine_rows[index].append(build_report_rows(
+                sources, self.domains_by_row[index], self.row_stratum[index][0], engine_name, len(engines)
+            ))
+        for index, rows in engine_rows.items():
+            self.add_row(index, rows)
+    
+    def _estimate(self, population: Dict[Stratum, int], moments: Dict[Stratum, _Moments]) -> Dict[str, Any]:
+        """
+        Стратифицированная оценка одной ячейки
+        
+        Returns:
+            Строка таблицы оценок без колонок страны и домена
+        """
+        total = sum(population.values())
+        sampled = 0
+        covered = 0.0
+        aiv = visible = 0.0
+        aiv_var = visible_var = 0.0
+        exact_variance = True
+        for stratum, size in population.items():
+            stratum_moments = moments.get(stratum)
+            if stratum_moments is None or stratum_moments.n == 0:
+                exact_variance = False
+                continue
+            n = stratum_moments.n
+            weight = size / total
+            sampled += n
+            covered += weight
+            aiv += weight * stratum_moments.aiv / n
+            visible += weight * stratum_moments.visible / n
+            if n >= size:
+                continue  # Страта опрошена целиком
+            if n < 2:
+                exact_variance = False
+                continue
+            fpc = 1 - n / size
+            aiv_var += weight * weight * fpc * stratum_moments.variance(stratum_moments.aiv, stratum_moments.aiv_sq) / n
+            visible_var += weight * weight * fpc * stratum_moments.visible_variance() / n
+        
+        if not covered:
+            return {"Rows": total, "Sampled": 0, "AIV-Score": "", "AIV-Score ±": "",
+                    "Inclusion Rate %": "", "Inclusion Rate ± %": "", "Precise": False}
+        # Страты без наблюдений не входят в среднее, а интервал считается неизвестным
+        aiv_margin = self.z * math.sqrt(aiv_var) if exact_variance else math.inf
+        visible_margin = 100 * self.z * math.sqrt(visible_var) if exact_variance else math.inf
+        return {
+            "Rows": total,
+            "Sampled": sampled,
+            "AIV-Score": round(aiv / covered, 1),
+            "AIV-Score ±": round(aiv_margin, 1) if exact_variance else "",
+            "Inclusion Rate %": round(100 * visible / covered, 1),
+            "Inclusion Rate ± %": round(visible_margin, 1) if exact_variance else "",
+            "Precise": aiv_margin <= self.precision and visible_margin <= self.precision
+        }
+    
+    def imprecise_cells(self) -> List[Cell]:
+        """Ячейки (страна, домен), интервалы которых шире precision"""
+        return [
+            cell for cell, population in self.population.items()
+            if not self._estimate(population, self.moments.get(cell, {}))["Precise"]
+        ]
+    
+    def rows(self) -> List[Dict[str, Any]]:
+        """
+        Таблица оценок: по странам и доменам, затем по доменам для всех стран
+        
+        Returns:
+            Словари с колонками ESTIMATE_COLUMNS
+        """
+        rows = []
+        by_domain: Dict[str, Tuple[Dict[Stratum, int], Dict[Stratum, _Moments]]] = {}
+        for (country, domain), population in sorted(self.population.items()):
+            moments = self.moments.get((country, domain), {})
+            rows.append({"Страна": country, "Целевой домен": domain, **self._estimate(population, moments)})
+            # Страты разных стран не пересекаются: оценка по всем странам - объединение страт
+            all_population, all_moments = by_domain.setdefault(domain, ({}, {}))
+            all_population.update(population)
+            all_moments.update(moments)
+        if len({country for country, _ in self.population}) > 1:
+            rows.extend(
+                {"Страна": ALL_COUNTRIES, "Целевой домен": domain, **self._estimate(population, moments)}
+                for domain, (population, moments) in sorted(by_domain.items())
+            )
+        return rows
+    
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.rows(), columns=ESTIMATE_COLUMNS)
+
+def run_estimate(
+    df: pd.DataFrame,
+    file_hash: str,
+    engines: Optional[List[SearchEngine]] = None,
+    stats: Optional[JobStats] = None,
+    tenant: Optional[str] = None,
+    priority: str = "free",
+    job: Optional[Job] = None,
+    use_cache: bool = True,
+    estimator: Optional[StratifiedEstimator] = None
+) -> StratifiedEstimator:
+    """
+    Оценка по выборке, растущей раундами до заданной точности
+    
+    Каждый раунд - обычный analyze_rows по строкам выборки (кэш строк,
+    справедливая очередь, сроки задачи). Прерванная задача возвращает
+    оценку по уже готовым строкам с причиной в estimator.interrupted.
+    
+    Args:
+        df: Данные после FileProcessor.process_file (все строки файла)
+        file_hash: Хеш файла (и зерно перестановки строк: выборка воспроизводима)
+        engines: Движки для опроса (по умолчанию SEARCH_ENGINES)
+        stats: Сборщик метрик задачи
+        tenant: Владелец задачи для справедливой очереди
+        priority: Приоритет задачи
+        job: Задача со сроком и отменой
+        use_cache: Использовать сохраненные результаты строк
+        estimator: Оценщик с параметрами (по умолчанию из ESTIMATE_*)
+    
+    Returns:
+        Оценщик с накопленной выборкой (таблица - estimator.to_frame())
+    """
+    engines = engines or default_engines
+    estimator = estimator or StratifiedEstimator(df, seed=int(file_hash[:16], 16))
+    while True:
+        batch = estimator.next_batch()
+        if not batch:
+            break
+        sample = df.iloc[batch].reset_index(drop=True)
+        try:
+            results = analyze_rows(
+                sample, file_hash, use_cache=use_cache, engines=engines,
+                stats=stats, tenant=tenant, priority=priority, job=job,
+                append_raw=estimator.rounds > 1
+            )
+        except JobInterruptedError as e:
+            e.collect_in_flight()
+            estimator.add_completed(batch, e.completed, engines)
+            estimator.interrupted = e.reason
+            break
+        estimator.add_results(batch, results, len(engines))
+        
+        imprecise = len(estimator.imprecise_cells())
+        print(
+            f"Раунд {estimator.rounds}: выборка {estimator.sampled} из {len(df)} строк, "
+            f"неточных оценок {imprecise} из {len(estimator.population)}",
+            file=sys.stderr
+        )
+        if not imprecise:
+            break
+    return estimator
@@ -0,0 +1,144 @@
+"""
+Справедливый планировщик строк: пакеты строк разных задач чередуются
+взвешенной справедливой очередью (WFQ) по владельцу задачи
+"""
+
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+from api.config import (
+    SCHEDULER_WORKERS, SCHEDULER_BATCH_SIZE, SMALL_JOB_ROWS, SMALL_JOB_BOOST,
+    JOB_PRIORITY_WEIGHTS, PAID_EMAILS
+)
+
+def get_job_priority(email: str) -> str:
+    """Приоритет задачи по email владельца: paid для адресов и доменов из PAID_EMAILS"""
+    email = (email or "").lower()
+    domain = email.rsplit("@", 1)[-1]
+    return "paid" if email in PAID_EMAILS or f"@{domain}" in PAID_EMAILS else "free"
+
+class _Batch:
+    """
+    Пакет задач одной работы: задает очередность и виртуальное время,
+    а сами задачи разбирают свободные потоки по одной
+    """
+    
+    __slots__ = ("tasks", "tenant", "taken")
+    
+    def __init__(self, tasks: List[tuple], tenant: str):
+        self.tasks = tasks
+        self.tenant = tenant
+        self.taken = 0
+    
+    @property
+    def remaining(self) -> int:
+        return len(self.tasks) - self.taken
+
+class FairScheduler:
+    """
+    Общий пул потоков для запросов всех задач
+    
+    Каждый пакет получает виртуальную метку окончания
+    max(виртуальное время, последняя метка владельца) + размер / вес.
+    Свободные потоки берут по одной задаче из пакета с наименьшей меткой,
+    так что задачи пакета выполняются параллельно. Владелец с большим
+    файлом не блокирует остальных, а небольшие задачи получают
+    дополнительный вес.
+    """
+    
+    def __init__(self, workers: int = SCHEDULER_WORKERS, batch_size: int = SCHEDULER_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._tenant_finish: Dict[str, float] = {}
+        self._threads: List[threading.Thread] = []
+        self.running = 0
+    
+    def _ensure_started(self) -> None:
+        """Ленивый запуск рабочих потоков (вызывается под блокировкой)"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"fair-scheduler-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def submit_job(
+        self,
+        tasks: List[Callable[[], Any]],
+        tenant: str,
+        priority: str = "free"
+    ) -> List[Future]:
+        """
+        Постановка задач работы в очередь
+        
+        Args:
+            tasks: Функции без аргументов (обычно запрос по одной строке)
+            tenant: Владелец работы (email или IP)
+            priority: Ключ JOB_PRIORITY_WEIGHTS
+        
+        Returns:
+            Future для каждой функции в исходном порядке
+        """
+        futures = [Future() for _ in tasks]
+        weight = JOB_PRIORITY_WEIGHTS.get(priority, 1.0)
+        if len(tasks) <= SMALL_JOB_ROWS:
+            weight *= SMALL_JOB_BOOST
+        
+        items = list(zip(tasks, futures))
+        with self._cond:
+            self._ensure_started()
+            finish = max(self._virtual_time, self._tenant_finish.get(tenant, 0.0))
+            for start in range(0, len(items), self.batch_size):
+                batch = _Batch(items[start:start + self.batch_size], tenant)
+                finish += len(batch.tasks) / weight
+                heapq.heappush(self._heap, (finish, next(self._seq), batch))
+            self._tenant_finish[tenant] = finish
+            self._cond.notify_all()
+        return futures
+    
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                finish, _, batch = self._heap[0]
+                task, future = batch.tasks[batch.taken]
+                batch.taken += 1
+                if not batch.remaining:
+                    # Пакет разобран: виртуальное время доходит до его метки
+                    heapq.heappop(self._heap)
+                    self._virtual_time = max(self._virtual_time, finish)
+                    # Владельцы без задач в очереди не копят "кредит" на будущее
+                    if self._tenant_finish.get(batch.tenant, 0.0) <= self._virtual_time:
+                        self._tenant_finish.pop(batch.tenant, None)
+                self.running += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(task())
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self.running -= 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Состояние очереди для мониторинга"""
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "queued_batches": len(self._heap),
+                "queued_tasks": sum(batch.remaining for _, _, batch in self._heap),
+                "running_tasks": self.running,
+                "tenants": len(self._tenant_finish)
+            }
+
+# Глобальный экземпляр планировщика
+fair_scheduler = FairScheduler()
@@ -0,0 +1,100 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight)
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+class _Call:
+    """Выполняющийся вызов, результат которого ждут все участники"""
+    
+    __slots__ = ("done", "result", "error")
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Пока вызов с ключом выполняется, повторные вызовы с тем же ключом
+    не запускают новый, а получают результат первого
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+    
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Выполнение fn с объединением по ключу
+        
+        Args:
+            key: Ключ идентичности запроса
+            fn: Функция, выполняющая запрос
+        
+        Returns:
+            Результат fn (общий для всех одновременных вызовов)
+        
+        Raises:
+            Исключение fn, если оно возникло - у всех участников
+        """
+        return self.do_shared(key, fn)[0]
+    
+    def do_shared(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Выполнение fn с объединением по ключу и признаком чужого результата
+        
+        Args:
+            key: Ключ идентичности запроса
+            fn: Функция, выполняющая запрос
+            timeout: Сколько ждать чужой вызов, секунд (None - без ограничения)
+        
+        Returns:
+            Tuple[результат fn, True если результат получен от другого участника]
+        
+        Raises:
+            TimeoutError: Если чужой вызов не завершился за timeout
+            Исключение fn, если оно возникло - у всех участников
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+        
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError("Превышено время ожидания объединенного запроса")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Ключ удаляется до пробуждения ожидающих: новые вызовы после этого
+            # момента выполнят свежий запрос
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+    
+    def stats(self) -> Dict[str, int]:
+        """Статистика: выполнено вызовов, объединено вызовов, сейчас в полете"""
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls)
+            }
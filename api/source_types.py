@@ -0,0 +1,151 @@
+"""
+Классификация источников по типу: индекс категорий доменов и единое
+регулярное выражение по пути URL
+"""
+
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Файл категорий доменов (домен<TAB>категория), загружается при первом использовании
+DOMAIN_CATEGORIES_PATH = os.path.join(os.path.dirname(__file__), "data", "domain_categories.tsv")
+
+# Типы по пути URL для доменов без категории. Один скомпилированный шаблон:
+# побеждает самое раннее совпадение в пути
+PATH_PATTERNS: List[Tuple[str, str]] = [
+    ("Forum", r"/(?:forums?|community|communities|threads?|discussions?|topics?|boards?)(?:/|$|\.)|/t/|/viewtopic"),
+    ("Review", r"/(?:reviews?|tests?|comparisons?|compare|vs|ratings?|best-[\w-]+|top-\d+[\w-]*)(?:/|$|\.)"),
+    ("Docs", r"/(?:docs?|documentation|help|support|faq|manuals?|guides?|kb|knowledge-?base)(?:/|$|\.)"),
+    ("Product", r"/(?:products?|p|dp|item|itm|buy|shop|store|catalog|collections?|category|sku)(?:/|$|\.)|/gp/product/"),
+    ("Blog", r"/(?:blog|blogs|news|articles?|magazine|stories|posts?|insights?)(?:/|$|\.)"),
+    ("Video", r"/(?:watch|videos?|embed)(?:/|$|\.)"),
+]
+
+# Схема и authority (необязательны) и путь URL без query и fragment
+URL_PARTS = re.compile(r"(?:[a-z][a-z0-9+.-]*:)?(?://([^/?#]*))?([^?#]*)")
+
+# Типы по первой метке хоста (forum.example.com, shop.example.com)
+HOST_LABEL_TYPES: Dict[str, str] = {
+    "forum": "Forum", "forums": "Forum", "community": "Forum",
+    "docs": "Docs", "help": "Docs", "support": "Docs",
+    "shop": "Product", "store": "Product",
+    "blog": "Blog", "news": "News",
+}
+
+class SourceClassifier:
+    """
+    Классификатор источников: категория домена (с учетом родительских доменов),
+    затем первая метка хоста, затем шаблон по пути URL
+    
+    Индекс доменов загружается из файла при первой классификации.
+    """
+    
+    def __init__(self, categories_path: str = DOMAIN_CATEGORIES_PATH, cache_size: int = 65536):
+        self.categories_path = categories_path
+        self._lock = threading.Lock()
+        self._domains: Optional[Dict[str, str]] = None
+        self._path_search = re.compile(
+            "|".join(f"(?P<{name}>{pattern})" for name, pattern in PATH_PATTERNS)
+        ).search
+        # Хостов намного меньше, чем URL: кэшируем решение по хосту, путь проверяем шаблоном
+        self.host_type = lru_cache(maxsize=cache_size)(self._host_type)
+    
+    def _load(self) -> Dict[str, str]:
+        """Ленивая загрузка индекса доменов (одна строка категории на все домены)"""
+        if self._domains is not None:
+            return self._domains
+        with self._lock:
+            if self._domains is None:
+                domains: Dict[str, str] = {}
+                categories: Dict[str, str] = {}
+                try:
+                    with open(self.categories_path, encoding="utf-8") as f:
+                        for line in f:
+                            if not line.strip() or line.startswith("#"):
+                                continue
+                            domain, _, category = line.rstrip("\n").partition("\t")
+                            category = category.strip()
+                            if domain and category:
+                                domains[domain.strip().lower()] = categories.setdefault(category, category)
+                except OSError as e:
+                    print(f"Категории доменов недоступны ({e}), используется только классификация по URL")
+                self._domains = domains
+        return self._domains
+    
+    def domain_category(self, host: str) -> Optional[str]:
+        """
+        Категория домена или ближайшего родительского домена
+        
+        Args:
+            host: Домен без www (например, uk.trustpilot.com)
+        """
+        domains = self._load()
+        while host:
+            category = domains.get(host)
+            if category is not None:
+                return category
+            _, _, host = host.partition(".")
+            if "." not in host:
+                return None
+        return None
+    
+    def _host_type(self, authority: str) -> Optional[str]:
+        """Тип по хосту (категория домена или первая метка хоста) или None"""
+        host = authority.rsplit("@", 1)[-1].split(":", 1)[0] if ("@" in authority or ":" in authority) else authority
+        if host.startswith("www."):
+            host = host[4:]
+        
+        category = self.domain_category(host)
+        if category is not None:
+            return category
+        
+        label, dot, _ = host.partition(".")
+        return HOST_LABEL_TYPES.get(label) if dot else None
+    
+    def classify(self, url: str) -> str:
+        """
+        Тип одного источника
+        
+        Args:
+            url: URL источника
+        
+        Returns:
+            Категория (Marketplace, Review, Forum, ...) или Other
+        """
+        match = URL_PARTS.match(url.lower())
+        host_type = self.host_type(match.group(1) or "")
+        if host_type is not None:
+            return host_type
+        path_match = self._path_search(match.group(2))
+        return path_match.lastgroup if path_match else "Other"
+    
+    def classify_many(self, urls: List[str]) -> List[str]:
+        """
+        Типы источников списком (пакетный режим: кэш по URL общий для всех вызовов)
+        
+        Args:
+            urls: URL источников
+        
+        Returns:
+            Типы в том же порядке
+        """
+        split_url = URL_PARTS.match
+        host_type = self.host_type
+        path_search = self._path_search
+        types = []
+        for url in urls:
+            match = split_url(url.lower()) if url else None
+            if match is None:
+                types.append("Other")
+                continue
+            found = host_type(match.group(1) or "")
+            if found is None:
+                path_match = path_search(match.group(2))
+                found = path_match.lastgroup if path_match else "Other"
+            types.append(found)
+        return types
+
+# Глобальный экземпляр классификатора
+source_classifier = SourceClassifier()
@@ -0,0 +1,119 @@
+"""
+Планировщик регулярного отслеживания видимости по сохраненным наборам запросов
+"""
+
+import threading
+from typing import Any, Dict, List
+import pandas as pd
+
+from api.config import TRACKING_POLL_SECONDS, TRACKING_RETRY_MINUTES
+from api.database import db
+from api.engines import engines
+from api.pipeline import iter_row_results
+from api.scheduler import get_job_priority
+
+class TrackingScheduler:
+    """Фоновый планировщик, перезапускающий сохраненные наборы запросов"""
+    
+    def __init__(self):
+        self.poll_seconds = TRACKING_POLL_SECONDS
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self) -> None:
+        """Запуск фонового потока планировщика"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="tracking-scheduler", daemon=True)
+        self._thread.start()
+        print(f"Планировщик отслеживания запущен (интервал опроса {self.poll_seconds}с)")
+    
+    def stop(self) -> None:
+        """Остановка планировщика"""
+        self._stop.set()
+    
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_due()
+            except Exception as e:
+                print(f"❌ Ошибка планировщика отслеживания: {e}")
+            self._stop.wait(self.poll_seconds)
+    
+    def run_due(self) -> int:
+        """
+        Выполнение всех наборов, время которых наступило
+        
+        Набор с ошибкой прогона повторяется через TRACKING_RETRY_MINUTES,
+        а не при каждом опросе.
+        
+        Returns:
+            Количество выполненных наборов
+        """
+        due_sets = db.get_due_tracked_sets()
+        done = 0
+        for tracked_set in due_sets:
+            try:
+                self.run_set(tracked_set)
+                done += 1
+            except Exception as e:
+                print(f"❌ Набор отслеживания {tracked_set['id']}: {e}; повтор через {TRACKING_RETRY_MINUTES:g} мин")
+                db.defer_tracked_set(tracked_set["id"], TRACKING_RETRY_MINUTES)
+        return done
+    
+    @staticmethod
+    def run_set(tracked_set: Dict[str, Any]) -> None:
+        """
+        Прогон одного набора и запись результатов во временной ряд
+        
+        Запросы с ошибкой движка не записываются: пустой ответ с AIV 0
+        исказил бы динамику.
+        
+        Args:
+            tracked_set: Набор из Database.get_due_tracked_sets
+        
+        Raises:
+            RuntimeError: Если ни один запрос набора не выполнен
+        """
+        df = pd.DataFrame(tracked_set["rows"])
+        if df.empty:
+            db.record_tracking_run(tracked_set["id"], tracked_set["interval_hours"], [])
+            return
+        
+        # Кэш строк не читаем: каждый прогон должен отражать текущую выдачу.
+        # Временной ряд ведется по основному движку - ключ точки не содержит движка
+        items = iter_row_results(
+            df, f"tracking:{tracked_set['id']}", use_cache=False, engines=engines[:1],
+            tenant=tracked_set["email"].lower(), priority=get_job_priority(tracked_set["email"])
+        )
+        
+        points: List[Dict[str, Any]] = []
+        errors = 0
+        for item in items:
+            if "error" in item:
+                errors += 1
+                continue
+            # Строки результата - по отслеживаемым доменам строки
+            country, prompt = df["Country"].iat[item["row"]], df["Prompt"].iat[item["row"]]
+            for metrics in item["results"]:
+                points.append({
+                    "domain": metrics["Целевой домен"],
+                    "prompt": prompt,
+                    "country": country,
+                    "aiv_score": metrics["AIV-Score"],
+                    "best_rank": metrics["Позиція"] or None,
+                    "mentions": metrics["Mentions Count"],
+                    "total_sources": metrics["Total Sources"]
+                })
+        
+        if errors and errors == len(df):
+            raise RuntimeError(f"все {errors} запросов завершились ошибкой")
+        if errors:
+            print(f"Набор отслеживания {tracked_set['id']}: пропущено {errors} запросов с ошибкой")
+        
+        db.record_tracking_run(tracked_set["id"], tracked_set["interval_hours"], points)
+        print(f"Набор отслеживания {tracked_set['id']}: записано {len(points)} точек")
+
+# Глобальный экземпляр планировщика
+tracking_scheduler = TrackingScheduler()
@@ -0,0 +1,61 @@
+"""
+Извлечение источников из ответов OpenAI по корпусу записанных ответов
+(tests/fixtures/extract_sources): аннотации url_citation, источники
+веб-поиска и старый формат
+"""
+
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from api.openai_client import openai_client
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "extract_sources"
+FIXTURES = sorted(FIXTURES_DIR.glob("*.json"))
+
+def load_fixture(path: Path) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def to_sdk_object(value):
+    """Словарь ответа в объект с атрибутами, как типизированные объекты SDK"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: to_sdk_object(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [to_sdk_object(item) for item in value]
+    return value
+
+@pytest.mark.parametrize("path", FIXTURES, ids=[path.stem for path in FIXTURES])
+def test_fixture_sources(path):
+    fixture = load_fixture(path)
+    sources = openai_client.extract_sources(fixture["response"])
+    assert [source["url"] for source in sources] == fixture["expected"]
+
+@pytest.mark.parametrize("path", FIXTURES, ids=[path.stem for path in FIXTURES])
+def test_typed_response_matches_json(path):
+    response = load_fixture(path)["response"]
+    assert openai_client.extract_sources(to_sdk_object(response)) == openai_client.extract_sources(response)
+
+def test_citation_positions_are_kept():
+    sources = openai_client.extract_sources(load_fixture(FIXTURES_DIR / "annotations.json")["response"])
+    cited = [source for source in sources if "start_index" in source]
+    assert [(source["start_index"], source["end_index"]) for source in cited] == [(34, 40), (50, 66), (68, 72)]
+    assert "start_index" not in sources[-1]
+
+def test_multipart_citations_keep_part_order():
+    sources = openai_client.extract_sources(load_fixture(FIXTURES_DIR / "multipart.json")["response"])
+    # Цитата второй части с позицией 16 идет после цитаты первой части с позицией 40
+    assert [source["start_index"] for source in sources] == [0, 40, 16]
+
+def test_legacy_fields():
+    sources = openai_client.extract_sources(load_fixture(FIXTURES_DIR / "legacy.json")["response"])
+    assert sources[1] == {"url": "https://www.youtube.com/watch?v=abc", "title": "How to pull a shot", "description": ""}
+
+def test_malformed_response_returns_collected_sources():
+    response = {"output": [
+        {"type": "web_search_call", "action": {"sources": [{"url": "https://a.example/"}]}},
+        {"type": "message", "content": 5}
+    ]}
+    assert [source["url"] for source in openai_client.extract_sources(response)] == ["https://a.example/"]